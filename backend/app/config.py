@@ -10,6 +10,43 @@ class Settings(BaseSettings):
     face_images_count: int = 25
     upload_dir: str = "uploads"
     face_data_dir: str = "face_data"
+    qr_cache_dir: str = "qr_cache"
+    stream_keyframe_interval: int = 30
+    gallery_cache_size: int = 64
+    session_idle_timeout_minutes: int = 30
+    camera_sample_fps: float = 2.0
+    camera_reconnect_seconds: float = 5.0
+    camera_video_dir: str = "videos"
+    face_worker_processes: int = 0
+    training_image_max_side: int = 1024
+    batch_tile_size: int = 1024
+    batch_tile_overlap: int = 160
+    batch_detection_upsample: int = 1
+    batch_video_sample_fps: float = 1.0
+    batch_max_video_frames: int = 300
+    batch_max_unknown_evidence: int = 20
+    schedule_timezone: str = "UTC"
+    report_timezone: str = "UTC"
+    dashboard_cache_seconds: float = 30.0
+    presence_matrix_cache_size: int = 256
+    presence_matrix_max_age_seconds: float = 300.0
+    session_open_before_minutes: int = 10
+    check_in_tolerance: float = 0.5
+    check_in_max_attempts: int = 5
+    check_in_attempt_window_seconds: int = 300
+    bulk_import_max_image_bytes: int = 15 * 1024 * 1024
+    bulk_import_batch_size: int = 8
+    face_sample_dedup_distance: float = 0.1
+    blob_store_dir: str = "blobs"
+    thumbnail_size: int = 160
+    encoder_version: str = "v1"
+    encoder_version_poll_seconds: float = 30.0
+    reencode_batch_size: int = 20
+    reencode_concurrency: int = 2
+    reencode_pause_seconds: float = 0.5
+    prewarm_lead_minutes: int = 10
+    prewarm_poll_seconds: float = 60.0
+    prewarm_concurrency: int = 4
     
     class Config:
         env_file = ".env"
@@ -10,9 +10,24 @@ async def init_db():
     database = client[settings.database_name]
     await database.users.create_index("email", unique=True)
     await database.users.create_index("student_id", unique=True, sparse=True)
+    await database.users.create_index([("role", 1), ("status", 1)])
     await database.classes.create_index("code", unique=True)
     await database.attendance.create_index([("class_id", 1), ("date", 1)])
+    await database.attendance.create_index("date")
+    await database.attendance.create_index(
+        [("class_id", 1), ("session_key", 1)],
+        unique=True,
+        partialFilterExpression={"session_key": {"$exists": True}}
+    )
     await database.face_images.create_index("student_id", unique=True)
+    await database.face_images.create_index("updated_at")
+    # release_blobs counts references to a digest before deleting its file
+    await database.face_images.create_index("samples.blob")
+    await database.attendance_summary.create_index([("class_id", 1), ("student_id", 1)], unique=True)
+    # Class rows (student_id None) on their own, for the admin dashboard
+    await database.attendance_summary.create_index([("student_id", 1), ("class_id", 1)])
+    await database.attendance_daily.create_index([("class_id", 1), ("student_id", 1), ("day", 1)], unique=True)
+    await database.attendance_daily.create_index([("student_id", 1), ("day", 1)])
     
 async def close_db():
     global client
@@ -1,8 +1,15 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.database import init_db
+from app.database import init_db, close_db, get_database
 from app.routers import auth, admin, faculty, student
 from app.config import settings
+from app.services.attendance_daily import attendance_daily
+from app.services.attendance_summary import attendance_summary
+from app.services.camera_ingestion import camera_ingestion_manager
+from app.services.encoder_profiles import encoder_registry
+from app.services.face_workers import shutdown_process_pool
+from app.services.gallery_prewarm import gallery_prewarmer
+from app.services.jobs import job_manager
 
 app = FastAPI(title="Attendance Management System", version="1.0.0")
 
@@ -18,6 +25,20 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_event():
     await init_db()
+    await encoder_registry.load(get_database())
+    encoder_registry.start(get_database())
+    await attendance_summary.load(get_database())
+    await attendance_daily.load(get_database())
+    gallery_prewarmer.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await gallery_prewarmer.stop()
+    await encoder_registry.stop()
+    await camera_ingestion_manager.shutdown()
+    await job_manager.shutdown()
+    shutdown_process_pool()
+    await close_db()
 
 # Include routers
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
@@ -93,6 +93,7 @@ class Class(ClassBase):
 class AttendanceMode(str, Enum):
     MANUAL = "manual"
     AUTO = "auto"
+    QR = "qr"
 
 class AttendanceCreate(BaseModel):
     class_id: str
@@ -1,12 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Query
-from fastapi.responses import Response
-from typing import List, Optional
-from datetime import datetime, timedelta
+from fastapi import APIRouter, Body, Depends, HTTPException, status, UploadFile, File, Query, Request
+from typing import Dict, List, Optional
+from datetime import datetime
 import os
 import uuid
-import csv
+import zipfile
 import logging
-from io import StringIO
 from app.models import (
     UserCreate, User, UserUpdate, ClassCreate, Class,
     AttendanceReport, ClassAttendanceReport
@@ -15,11 +13,36 @@ from app.auth import get_current_admin, get_password_hash
 from app.database import get_database
 from app.config import settings
 from app.services.face_recognition import face_recognition_service
+from app.services.gallery_cache import gallery_cache
+from app.services.blob_store import blob_store
+from app.services.face_samples import add_face_samples, list_samples, release_blobs, remove_face_sample
+from app.utils.http_cache import file_response
+from app.utils.metrics import recognition_metrics
+from app.services.encoder_profiles import ENCODER_PROFILES, LEGACY_VERSION, encoder_registry
+from app.services.face_import import run_bulk_face_import
+from app.services.admin_dashboard import get_dashboard_stats as compute_dashboard_stats
+from app.services.attendance_summary import run_summary_rebuild
+from app.services.attendance_stats import attendance_percentage, count_presence, count_sessions, date_filter, find_students
+from app.services.gallery_prewarm import gallery_prewarmer
+from app.services.presence_matrix import presence_matrices
+from app.services.report_export import REPORT_FORMATS, ROSTER_COLUMNS, export_response, roster_rows
+from app.services.reencode import run_reencode
+from app.services.jobs import job_manager
 from app.utils.serialization import convert_object_ids
 from bson import ObjectId
 import aiofiles
 
 logger = logging.getLogger(__name__)
+
+# Blobs are content-addressed, so a URL's content never changes
+BLOB_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+# Background jobs that checkpoint their progress and can be restarted
+RESUMABLE_JOBS = {
+    "bulk_face_import": run_bulk_face_import,
+    "reencode_faces": run_reencode
+}
+
 router = APIRouter()
 
 @router.post("/students", response_model=dict)
@@ -51,8 +74,6 @@ async def add_student(student_data: UserCreate, current_user: dict = Depends(get
 
 @router.post("/students/{student_id}/face-data")
 async def upload_face_data(student_id: str, images: List[UploadFile] = File(...), current_user: dict = Depends(get_current_admin)):
-    import base64
-    
     db = get_database()
     
     student = await db.users.find_one({"student_id": student_id})
@@ -62,54 +83,173 @@ async def upload_face_data(student_id: str, images: List[UploadFile] = File(...)
     if len(images) == 0:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="At least one image is required")
     
-    base64_images = []
-    encodings = []
+    uploads = [(image.filename, await image.read()) for image in images]
+    outcome = await add_face_samples(db, student_id, uploads, replace=True)
     
-    for i, image in enumerate(images):
-        content = await image.read()
-        
-        base64_str = base64.b64encode(content).decode('utf-8')
-        base64_images.append(base64_str)
-        
-        encoding = face_recognition_service.encode_face_from_bytes(content)
-        if encoding is not None:
-            encodings.append(encoding)
-    
-    if len(encodings) == 0:
+    if not outcome["added"]:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No faces detected in any of the images")
     
-    face_data_path = face_recognition_service.save_face_encodings(student_id, encodings)
+    return {
+        "message": "Face data uploaded and trained successfully",
+        "images_processed": len(outcome["added"]),
+        "total_images": len(images),
+        "faces_detected": len(outcome["added"]),
+        "results": outcome["results"]
+    }
+
+@router.post("/students/{student_id}/face-data/samples")
+async def add_face_data_samples(student_id: str, images: List[UploadFile] = File(...), current_user: dict = Depends(get_current_admin)):
+    """Append training images without touching the student's existing samples"""
+    db = get_database()
     
-    await db.face_images.update_one(
-        {"student_id": student_id},
-        {
-            "$set": {
-                "student_id": student_id,
-                "images": base64_images,
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
-        },
-        upsert=True
-    )
+    student = await db.users.find_one({"student_id": student_id})
+    if not student:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student not found")
     
-    await db.users.update_one(
-        {"student_id": student_id},
-        {"$set": {
-            "face_data_path": face_data_path,
-            "has_face_data": True,
-            "face_data_updated_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
-        }}
-    )
+    if len(images) == 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="At least one image is required")
+    
+    uploads = [(image.filename, await image.read()) for image in images]
+    outcome = await add_face_samples(db, student_id, uploads)
     
     return {
-        "message": "Face data uploaded and trained successfully",
-        "images_processed": len(encodings),
-        "total_images": len(images),
-        "faces_detected": len(encodings)
+        "message": f"Added {len(outcome['added'])} of {len(images)} images",
+        **outcome
     }
 
+@router.delete("/students/{student_id}/face-data/samples/{sample_id}")
+async def delete_face_data_sample(student_id: str, sample_id: str, current_user: dict = Depends(get_current_admin)):
+    db = get_database()
+    
+    remaining = await remove_face_sample(db, student_id, sample_id)
+    if remaining is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Face sample not found")
+    
+    return {"message": "Face sample removed", "sample_id": sample_id, "total_samples": remaining}
+
+@router.post("/students/face-data/bulk", response_model=dict)
+async def bulk_upload_face_data(archive: UploadFile = File(...), current_user: dict = Depends(get_current_admin)):
+    """Start a background import of a ZIP laid out as ``<student_id>/<image>`` folders"""
+    bulk_dir = os.path.join(settings.upload_dir, "bulk")
+    os.makedirs(bulk_dir, exist_ok=True)
+    archive_path = os.path.join(bulk_dir, f"{uuid.uuid4().hex}.zip")
+    async with aiofiles.open(archive_path, "wb") as out:
+        while chunk := await archive.read(1024 * 1024):
+            await out.write(chunk)
+
+    if not zipfile.is_zipfile(archive_path):
+        os.remove(archive_path)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Upload must be a ZIP archive")
+
+    job_id = await job_manager.create("bulk_face_import", str(current_user["_id"]), {
+        "archive_path": archive_path,
+        "filename": archive.filename
+    })
+    job_manager.start(job_id, run_bulk_face_import)
+    return {"message": "Bulk face data import started", "job_id": job_id}
+
+@router.get("/jobs/{job_id}", response_model=dict)
+async def get_job(job_id: str, current_user: dict = Depends(get_current_admin)):
+    job = await job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    job = convert_object_ids(job)
+    job["id"] = job["_id"]
+    return job
+
+@router.post("/jobs/{job_id}/resume", response_model=dict)
+async def resume_job(job_id: str, current_user: dict = Depends(get_current_admin)):
+    """Restart an interrupted bulk import or re-encode job from its last checkpoint"""
+    job = await job_manager.get(job_id)
+    if not job or job.get("type") not in RESUMABLE_JOBS:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    # A job left "running" by a server restart has no task behind it and can be resumed
+    if job_manager.is_running(job_id) or job.get("status") in ("pending", "completed"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Job is {job.get('status')}")
+    if job["type"] == "bulk_face_import" and not os.path.exists(job["params"]["archive_path"]):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Archive for this job is no longer available")
+
+    job_manager.start(job_id, RESUMABLE_JOBS[job["type"]])
+    return {
+        "message": "Job resumed",
+        "job_id": job_id,
+        "progress": job.get("progress")
+    }
+
+async def _reencode_job_ids() -> List[str]:
+    db = get_database()
+    jobs = await db.jobs.find({"type": "reencode_faces", "status": {"$in": ["pending", "running"]}}, {"_id": 1}).to_list(length=None)
+    return [str(job["_id"]) for job in jobs]
+
+@router.get("/galleries", response_model=dict)
+async def get_gallery_cache(current_user: dict = Depends(get_current_admin)):
+    """Galleries currently in memory and the last schedule-driven pre-warm"""
+    return {
+        "cache_size": gallery_cache.max_size,
+        "galleries": gallery_cache.snapshot(),
+        "prewarm": {
+            "lead_minutes": settings.prewarm_lead_minutes,
+            "last_run_at": gallery_prewarmer.last_run_at,
+            "last_warmed": gallery_prewarmer.last_warmed
+        }
+    }
+
+@router.get("/presence-matrices", response_model=dict)
+async def get_presence_matrices(current_user: dict = Depends(get_current_admin)):
+    """Class presence matrices currently in memory"""
+    return {
+        "cache_size": presence_matrices.max_size,
+        "max_age_seconds": presence_matrices.max_age,
+        "classes": presence_matrices.snapshot()
+    }
+
+@router.get("/metrics/recognition", response_model=dict)
+async def get_recognition_metrics(reset: bool = Query(False), current_user: dict = Depends(get_current_admin)):
+    """Per-stage frame latency histograms for this node and each live stream"""
+    snapshot = recognition_metrics.snapshot()
+    if reset:
+        recognition_metrics.reset()
+    return snapshot
+
+@router.get("/encoder", response_model=dict)
+async def get_encoder_status(current_user: dict = Depends(get_current_admin)):
+    db = get_database()
+    running = await db.jobs.find_one({"type": "reencode_faces", "status": {"$in": ["pending", "running"]}}, sort=[("created_at", -1)])
+    return {
+        "active_version": encoder_registry.active_version,
+        "profiles": ENCODER_PROFILES,
+        "reencode_job_id": str(running["_id"]) if running else None
+    }
+
+@router.post("/encoder/reencode", response_model=dict)
+async def start_reencode(
+    version: str = Body(..., embed=True),
+    activate: bool = Body(True, embed=True),
+    current_user: dict = Depends(get_current_admin)
+):
+    """Re-encode all stored face images with another encoder profile in the background"""
+    if version not in ENCODER_PROFILES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown encoder version: {version}")
+    if any(job_manager.is_running(job_id) for job_id in await _reencode_job_ids()):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="A re-encode job is already running")
+    
+    job_id = await job_manager.create("reencode_faces", str(current_user["_id"]), {"version": version, "activate": activate})
+    job_manager.start(job_id, run_reencode)
+    return {"message": f"Re-encoding face data with encoder {version}", "job_id": job_id}
+
+@router.post("/encoder/activate", response_model=dict)
+async def activate_encoder(version: str = Body(..., embed=True), current_user: dict = Depends(get_current_admin)):
+    """Switch to a version whose encodings already exist, e.g. to roll back"""
+    db = get_database()
+    if version not in ENCODER_PROFILES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown encoder version: {version}")
+    if version != LEGACY_VERSION and not await db.jobs.find_one({"type": "reencode_faces", "status": "completed", "params.version": version}):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Encodings for this version have not been built yet")
+    
+    await encoder_registry.activate(db, version)
+    gallery_cache.invalidate()
+    return {"message": f"Encoder {version} activated", "active_version": version}
+
 @router.get("/students", response_model=List[dict])
 async def get_students(current_user: dict = Depends(get_current_admin)):
     db = get_database()
@@ -125,19 +265,61 @@ async def get_students(current_user: dict = Depends(get_current_admin)):
 
 @router.get("/students/{student_id}/face-images", response_model=dict)
 async def get_face_images(student_id: str, current_user: dict = Depends(get_current_admin)):
+    """List a student's face samples with thumbnail and full-image URLs (no image data inline)"""
     db = get_database()
     
-    face_data = await db.face_images.find_one({"student_id": student_id})
-    if not face_data:
+    samples = await list_samples(db, student_id)
+    if samples is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No face images found for this student")
+    face_data = await db.face_images.find_one({"student_id": student_id}, {"samples": 0})
     
+    base_url = f"/api/admin/students/{student_id}/face-images"
     return {
         "student_id": student_id,
-        "images": face_data.get("images", []),
+        "samples": [
+            {
+                "sample_id": s["sample_id"],
+                "filename": s.get("filename"),
+                "content_type": s.get("content_type"),
+                "size": s.get("size"),
+                "created_at": s.get("created_at"),
+                "thumbnail_url": f"{base_url}/{s['sample_id']}/thumbnail",
+                "image_url": f"{base_url}/{s['sample_id']}"
+            }
+            for s in samples
+        ],
         "created_at": face_data.get("created_at"),
         "updated_at": face_data.get("updated_at")
     }
 
+async def _get_face_sample(db, student_id: str, sample_id: str) -> dict:
+    face_data = await db.face_images.find_one(
+        {"student_id": student_id, "samples.sample_id": sample_id},
+        {"samples.$": 1}
+    )
+    if not face_data or "blob" not in face_data["samples"][0]:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Face sample not found")
+    return face_data["samples"][0]
+
+@router.get("/students/{student_id}/face-images/{sample_id}")
+async def get_face_image(student_id: str, sample_id: str, request: Request, current_user: dict = Depends(get_current_admin)):
+    """Stream one full-size face image; supports Range, If-None-Match and If-Modified-Since"""
+    db = get_database()
+    sample = await _get_face_sample(db, student_id, sample_id)
+    path = blob_store.path(sample["blob"])
+    if not os.path.exists(path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Face image file is missing")
+    return file_response(request, path, sample["blob"], sample.get("content_type") or "application/octet-stream", BLOB_CACHE_CONTROL)
+
+@router.get("/students/{student_id}/face-images/{sample_id}/thumbnail")
+async def get_face_image_thumbnail(student_id: str, sample_id: str, request: Request, current_user: dict = Depends(get_current_admin)):
+    db = get_database()
+    sample = await _get_face_sample(db, student_id, sample_id)
+    path = blob_store.thumbnail_path(sample["blob"])
+    if not os.path.exists(path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Thumbnail not available")
+    return file_response(request, path, f"{sample['blob']}-thumb", "image/jpeg", BLOB_CACHE_CONTROL)
+
 @router.put("/students/{student_id}/status")
 async def toggle_student_status(
     student_id: str,
@@ -170,14 +352,18 @@ async def delete_student(student_id: str, current_user: dict = Depends(get_curre
     
     await db.users.delete_one({"student_id": student_id, "role": "student"})
     
-    face_data_path = student.get("face_data_path")
-    if face_data_path and os.path.exists(face_data_path):
-        try:
-            os.remove(face_data_path)
-        except Exception as e:
-            logger.error(f"Error deleting face data file: {e}")
+    for version in ENCODER_PROFILES:
+        face_data_path = face_recognition_service.face_data_path(student_id, version)
+        if os.path.exists(face_data_path):
+            try:
+                os.remove(face_data_path)
+            except Exception as e:
+                logger.error(f"Error deleting face data file: {e}")
     
-    await db.face_images.delete_one({"student_id": student_id})
+    face_data = await db.face_images.find_one_and_delete({"student_id": student_id})
+    if face_data:
+        await release_blobs(db, [s["blob"] for s in face_data.get("samples", []) if "blob" in s])
+    gallery_cache.invalidate_student(student_id)
     
     await db.classes.update_many(
         {"enrolled_students": student_id},
@@ -336,6 +522,23 @@ async def update_class(
     
     return {"message": "Class updated successfully"}
 
+@router.put("/classes/{class_id}/cameras", response_model=dict)
+async def set_class_cameras(
+    class_id: str,
+    cameras: Dict[str, str] = Body(...),
+    current_user: dict = Depends(get_current_admin)
+):
+    """Cameras (id -> MJPEG/RTSP/HTTP URL) faculty may start server-side ingestion from"""
+    if not ObjectId.is_valid(class_id):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid class ID")
+    if any(not camera_id or not url for camera_id, url in cameras.items()):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Camera ids and URLs must not be empty")
+    db = get_database()
+    result = await db.classes.update_one({"_id": ObjectId(class_id)}, {"$set": {"cameras": cameras}})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Class not found")
+    return {"message": "Class cameras updated", "cameras": cameras}
+
 @router.delete("/classes/{class_id}", response_model=dict)
 async def delete_class(class_id: str, current_user: dict = Depends(get_current_admin)):
     db = get_database()
@@ -375,51 +578,40 @@ async def delete_class(class_id: str, current_user: dict = Depends(get_current_a
 async def get_attendance_reports(class_id: Optional[str] = None, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, current_user: dict = Depends(get_current_admin)):
     db = get_database()
     
-    query = {}
-    if class_id:
-        query["class_id"] = class_id
-    if start_date or end_date:
-        query["date"] = {}
-        if start_date:
-            query["date"]["$gte"] = start_date
-        if end_date:
-            query["date"]["$lte"] = end_date
-    
     if class_id:
         classes = [await db.classes.find_one({"_id": ObjectId(class_id)})]
     else:
         classes = await db.classes.find().to_list(length=1000)
+    classes = [cls for cls in classes if cls]
+    
+    # Two aggregations and one user lookup for the whole report. As before,
+    # total_classes covers every session of the class and only the present
+    # count is limited to the date range.
+    class_ids = [str(cls["_id"]) for cls in classes]
+    totals = await count_sessions(db, class_ids)
+    presence = await count_presence(db, class_ids, date_filter(start_date, end_date))
+    students = await find_students(db, (sid for cls in classes for sid in cls.get("enrolled_students", [])))
     
     reports = []
     for cls in classes:
-        if not cls:
-            continue
-        
         enrolled_students = cls.get("enrolled_students", [])
+        total_classes = totals.get(str(cls["_id"]), 0)
+        class_presence = presence.get(str(cls["_id"]), {})
         attendance_records = []
         
         for student_id in enrolled_students:
-            student = await db.users.find_one({"student_id": student_id})
+            student = students.get(student_id)
             if not student:
                 continue
             
-            class_query = {"class_id": str(cls["_id"]), "present_students": student_id}
-            if start_date or end_date:
-                class_query["date"] = query.get("date", {})
-            
-            total_classes = await db.attendance.count_documents({"class_id": str(cls["_id"])})
-            present_count = await db.attendance.count_documents(class_query)
-            absent_count = total_classes - present_count
-            
-            attendance_percentage = (present_count / total_classes * 100) if total_classes > 0 else 0
-            
+            present_count = class_presence.get(student_id, 0)
             attendance_records.append(AttendanceReport(
                 student_id=student_id,
                 student_name=student.get("full_name"),
                 total_classes=total_classes,
                 present_count=present_count,
-                absent_count=absent_count,
-                attendance_percentage=round(attendance_percentage, 2)
+                absent_count=total_classes - present_count,
+                attendance_percentage=attendance_percentage(present_count, total_classes)
             ))
         
         reports.append(ClassAttendanceReport(
@@ -431,6 +623,15 @@ async def get_attendance_reports(class_id: Optional[str] = None, start_date: Opt
     
     return reports
 
+@router.post("/attendance-summary/rebuild", response_model=dict)
+async def rebuild_attendance_summary(class_id: Optional[str] = None, current_user: dict = Depends(get_current_admin)):
+    """Recompute the attendance counters from the attendance records in the background"""
+    job_id = await job_manager.create("rebuild_attendance_summary", str(current_user["_id"]), {
+        "class_ids": [class_id] if class_id else None
+    })
+    job_manager.start(job_id, run_summary_rebuild)
+    return {"message": "Attendance summary rebuild started", "job_id": job_id}
+
 @router.get("/reports/download")
 async def download_report(
     report_type: str,
@@ -442,73 +643,22 @@ async def download_report(
 ):
     db = get_database()
     
-    if class_id:
-        classes = [await db.classes.find_one({"_id": ObjectId(class_id)})]
-    else:
-        classes = await db.classes.find().to_list(length=1000)
-    
-    date_query = {}
-    if start_date or end_date:
-        date_query = {}
-        if start_date:
-            date_query["$gte"] = start_date
-        if end_date:
-            date_query["$lte"] = end_date
-    
-    output = StringIO()
-    writer = csv.writer(output)
-    
-    writer.writerow(["Class Name", "Student ID", "Student Name", "Total Classes", "Present", "Absent", "Attendance Percentage"])
-    
-    for cls in classes:
-        if not cls:
-            continue
-        class_name = cls.get("name", "Unknown")
-        enrolled_students = cls.get("enrolled_students", [])
-        
-        for student_id in enrolled_students:
-            student = await db.users.find_one({"student_id": student_id})
-            if not student:
-                continue
-            
-            total_query = {"class_id": str(cls["_id"])}
-            present_query = {
-                "class_id": str(cls["_id"]),
-                "present_students": student_id
-            }
-            
-            if date_query:
-                total_query["date"] = date_query
-                present_query["date"] = date_query
-            
-            total_classes = await db.attendance.count_documents(total_query)
-            present_count = await db.attendance.count_documents(present_query)
-            absent_count = total_classes - present_count
-            attendance_percentage = (present_count / total_classes * 100) if total_classes > 0 else 0
-            
-            writer.writerow([
-                class_name,
-                student_id,
-                student.get("full_name", "Unknown"),
-                total_classes,
-                present_count,
-                absent_count,
-                f"{round(attendance_percentage, 2)}%"
-            ])
-    
-    date_suffix = ""
-    if start_date or end_date:
-        start_str = start_date.strftime("%Y%m%d") if start_date else ""
-        end_str = end_date.strftime("%Y%m%d") if end_date else ""
-        date_suffix = f"_{start_str}_to_{end_str}" if start_str and end_str else f"_{start_str}" if start_str else f"_{end_str}"
-    
-    filename = f"attendance_report_{class_id if class_id else 'all_classes'}{date_suffix}.csv"
-    return Response(
-        content=output.getvalue(),
-        media_type="text/csv",
-        headers={
-            "Content-Disposition": f"attachment; filename={filename}"
-        }
+    if format not in REPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format. Must be 'csv', 'excel' or 'parquet'")
+    
+    class_query = {"_id": ObjectId(class_id)} if class_id else {}
+    # Here both counts are limited to the date range
+    rows = roster_rows(db, class_query, date_filter(start_date, end_date))
+    return await export_response(
+        format,
+        ROSTER_COLUMNS,
+        (
+            [class_name, student_id, name, total, present, total - present, attendance_percentage(present, total)]
+            async for class_name, student_id, name, total, present in rows
+        ),
+        class_id if class_id else "all_classes",
+        start_date,
+        end_date
     )
 
 @router.put("/settings/face-images-count")
@@ -528,93 +678,5 @@ async def update_face_images_count(
 
 @router.get("/stats", response_model=dict)
 async def get_dashboard_stats(start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, current_user: dict = Depends(get_current_admin)):
-    
-    db = get_database()
-    
-    date_query = {}
-    if start_date or end_date:
-        if start_date:
-            date_query["$gte"] = start_date
-        if end_date:
-            date_query["$lte"] = end_date
-    
-    total_students = await db.users.count_documents({"role": "student"})
-    total_faculties = await db.users.count_documents({"role": "faculty"})
-    total_classes = await db.classes.count_documents({})
-    
-    total_attendance_query = {}
-    if date_query:
-        total_attendance_query["date"] = date_query
-    total_attendance = await db.attendance.count_documents(total_attendance_query)
-    
-    active_students = await db.users.count_documents({"role": "student", "status": "active"})
-    
-    if start_date and end_date:
-        attendance_last_7_days = total_attendance
-    else:
-        seven_days_ago = datetime.utcnow() - timedelta(days=7)
-        attendance_last_7_days = await db.attendance.count_documents({"date": {"$gte": seven_days_ago}})
-    
-    attendance_by_day = []
-    if start_date and end_date:
-        current_date = start_date
-        while current_date <= end_date:
-            day_start = current_date.replace(hour=0, minute=0, second=0, microsecond=0)
-            day_end = current_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-            count = await db.attendance.count_documents({
-                "date": {"$gte": day_start, "$lte": day_end}
-            })
-            attendance_by_day.append({
-                "date": current_date.strftime("%Y-%m-%d"),
-                "day": current_date.strftime("%a"),
-                "count": count
-            })
-            current_date += timedelta(days=1)
-    else:
-        for i in range(6, -1, -1):
-            day = datetime.utcnow() - timedelta(days=i)
-            day_start = day.replace(hour=0, minute=0, second=0, microsecond=0)
-            day_end = day.replace(hour=23, minute=59, second=59, microsecond=999999)
-            count = await db.attendance.count_documents({
-                "date": {"$gte": day_start, "$lte": day_end}
-            })
-            attendance_by_day.append({
-                "date": day.strftime("%Y-%m-%d"),
-                "day": day.strftime("%a"),
-                "count": count
-            })
-    
-    classes = await db.classes.find().to_list(length=1000)
-    class_enrollments = []
-    for cls in classes:
-        enrolled_count = len(cls.get("enrolled_students", []))
-        class_enrollments.append({
-            "class_name": cls.get("name", "Unknown"),
-            "students": enrolled_count
-        })
-    class_enrollments.sort(key=lambda x: x["students"], reverse=True)
-    top_classes = class_enrollments[:5]
-    
-    attendance_by_class = []
-    for cls in classes[:10]:
-        attendance_query = {"class_id": str(cls["_id"])}
-        if date_query:
-            attendance_query["date"] = date_query
-        attendance_count = await db.attendance.count_documents(attendance_query)
-        attendance_by_class.append({
-            "class_name": cls.get("name", "Unknown"),
-            "attendance_count": attendance_count
-        })
-    attendance_by_class.sort(key=lambda x: x["attendance_count"], reverse=True)
-    
-    return {
-        "total_students": total_students,
-        "active_students": active_students,
-        "total_faculties": total_faculties,
-        "total_classes": total_classes,
-        "total_attendance": total_attendance,
-        "attendance_last_7_days": attendance_last_7_days,
-        "attendance_by_day": attendance_by_day,
-        "top_classes": top_classes,
-        "attendance_by_class": attendance_by_class[:5]
-    }
\ No newline at end of file
+    """Dashboard counts and charts, cached for a few seconds (see services/admin_dashboard)"""
+    return await compute_dashboard_stats(get_database(), start_date, end_date)
\ No newline at end of file
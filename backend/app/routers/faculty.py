@@ -1,7 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, Body
+from fastapi import APIRouter, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, Body, UploadFile, File, Form
+from fastapi.encoders import jsonable_encoder
 from typing import List, Optional, Dict, Any
-from datetime import datetime
+from datetime import datetime, timezone
 import json
+import math
+import shutil
 import cv2
 import numpy as np
 import base64
@@ -9,18 +12,54 @@ import os
 import asyncio
 import logging
 import uuid
-from app.models import AttendanceCreate, Attendance, AttendanceReport, MessageCreate
+import time
+import aiofiles
+from app.models import AttendanceCreate, Attendance, AttendanceMode, AttendanceReport, MessageCreate
 from app.auth import get_current_faculty, get_websocket_user
 from app.database import get_database
-from app.services.face_recognition import face_recognition_service
+from app.services.attendance_session import attendance_session_manager
+from app.services.attendance_writes import insert_attendance, upsert_session_attendance
+from app.services.attendance_stats import attendance_percentage, count_presence, count_sessions, date_filter, find_students
+from app.services.camera_ingestion import camera_ingestion_manager, resolve_source
+from app.services.presence_matrix import presence_matrices
+from app.services.report_export import FACULTY_ROSTER_COLUMNS, REPORT_FORMATS, export_response, roster_rows
+from app.services.batch_attendance import is_video_upload, run_batch_attendance
+from app.services.jobs import job_manager
+from app.utils.serialization import convert_object_ids
 from app.config import settings
 from app.utils.websocket_manager import connection_manager
+from app.utils.stream_delta import StreamDeltaEncoder
+from app.utils.metrics import recognition_metrics, timed
+from app.utils.schedule import current_session_key
 from bson import ObjectId
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+async def _get_faculty_class(db, class_id: str, current_user: dict) -> dict:
+    if not ObjectId.is_valid(class_id):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid class_id format: {class_id}")
+    cls = await db.classes.find_one({"_id": ObjectId(class_id)})
+    if not cls:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Class not found")
+    if current_user.get("role") != "admin" and str(cls.get("faculty_id")) != str(current_user["_id"]):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized for this class")
+    return cls
+
+def _live_session_key(cls: dict, date: Optional[datetime] = None) -> Optional[str]:
+    """Key of the class's scheduled session in progress, if ``date`` (when given) falls in it.
+
+    Writes for the running session share its record with self check-ins and
+    cameras; a date in another session (a backfill) gets a record of its own.
+    """
+    key = current_session_key(cls)
+    if key is None or date is None:
+        return key
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return key if current_session_key(cls, date) == key else None
+
 @router.get("/classes", response_model=List[dict])
 async def get_faculty_classes(current_user: dict = Depends(get_current_faculty)):
     
@@ -29,27 +68,33 @@ async def get_faculty_classes(current_user: dict = Depends(get_current_faculty))
         classes = await db.classes.find().to_list(length=1000)
     else:
         classes = await db.classes.find({"faculty_id": str(current_user["_id"])}).to_list(length=1000)
+    
+    # Set-based: one aggregation per count and one user query for every roster
+    class_ids = [str(cls["_id"]) for cls in classes]
+    totals = await count_sessions(db, class_ids)
+    presence = await count_presence(db, class_ids)
+    students = await find_students(
+        db,
+        (student_id for cls in classes for student_id in cls.get("enrolled_students", [])),
+        {"student_id": 1, "full_name": 1, "email": 1}
+    )
+    
     result = []
     for cls in classes:
-
-        enrolled_students = cls.get("enrolled_students", [])
-        students_with_attendance = [] 
-        for student_id in enrolled_students:
-            student = await db.users.find_one({"student_id": student_id})
+        total_classes = totals.get(str(cls["_id"]), 0)
+        class_presence = presence.get(str(cls["_id"]), {})
+        students_with_attendance = []
+        for student_id in cls.get("enrolled_students", []):
+            student = students.get(student_id)
             if not student:
-                continue    
-            total_classes = await db.attendance.count_documents({"class_id": str(cls["_id"])})
-            present_count = await db.attendance.count_documents({
-                "class_id": str(cls["_id"]),
-                "present_students": student_id
-            })
-            attendance_percentage = (present_count / total_classes * 100) if total_classes > 0 else 0
+                continue
+            present_count = class_presence.get(student_id, 0)
             students_with_attendance.append({
                 "student_id": student_id,
                 "user_id": str(student["_id"]),
                 "name": student.get("full_name"),
                 "email": student.get("email"),
-                "attendance_percentage": round(attendance_percentage, 2),
+                "attendance_percentage": attendance_percentage(present_count, total_classes),
                 "total_classes": total_classes,
                 "present_count": present_count
             })
@@ -86,10 +131,18 @@ async def take_manual_attendance(attendance_data: AttendanceCreate, current_user
     attendance_dict["created_at"] = now
     if "date" not in attendance_dict or not attendance_dict["date"]:
         attendance_dict["date"] = now
-    result = await db.attendance.insert_one(attendance_dict)
+    key = _live_session_key(cls, attendance_dict["date"])
+    if key:
+        attendance_id = await upsert_session_attendance(
+            db, attendance_data.class_id, key, str(current_user["_id"]),
+            {"present_students": attendance_dict.get("present_students") or []},
+            mode="manual"
+        )
+    else:
+        attendance_id = await insert_attendance(db, attendance_dict)
     return {
         "message": "Attendance recorded successfully",
-        "attendance_id": str(result.inserted_id)
+        "attendance_id": attendance_id
     }
 
 @router.post("/attendance/auto", response_model=dict)
@@ -102,8 +155,11 @@ async def take_auto_attendance(
     recognized_students = attendance_data.get("recognized_students", [])
     total_faces_detected = attendance_data.get("total_faces_detected", 0)
     total_faces_recognized = attendance_data.get("total_faces_recognized", 0)
+    mode = attendance_data.get("mode", AttendanceMode.AUTO.value)
     if not class_id:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="class_id is required")
+    if mode not in (AttendanceMode.AUTO.value, AttendanceMode.QR.value):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid mode. Must be 'auto' or 'qr'")
     if not recognized_students:
         recognized_students = []
     try:
@@ -122,28 +178,205 @@ async def take_auto_attendance(
         invalid_students = [s for s in recognized_students if s not in enrolled_students]
         logger.warning(f"Some recognized students are not enrolled: {invalid_students}")
 
+    # Cameras streaming this class share a live session; merge into its single record.
+    # A closed or stale session (an earlier period) gets a new record instead.
+    # The submitted list is the faculty's validated result: students left out are not re-added.
+    session = attendance_session_manager.get(class_id)
+    live = session is not None and not session.closed and (
+        session.active_cameras
+        or (session.session_key is not None and session.session_key == current_session_key(cls))
+    )
+    if live:
+        session.apply_validation(valid_students)
+        attendance_id = await session.commit(db, str(current_user["_id"]), total_faces_detected)
+        students_list = sorted(session.recognized)
+        logger.info(f"Attendance session committed: {len(students_list)} students for class {class_id}")
+        return {
+            "message": "Attendance recorded successfully",
+            "attendance_id": attendance_id,
+            "total_faces_detected": max(total_faces_detected, session.total_faces_detected),
+            "total_faces_recognized": len(students_list),
+            "students_marked": len(students_list),
+            "students_list": students_list
+        }
+
+    key = _live_session_key(cls)
+    if key:
+        attendance_id = await upsert_session_attendance(
+            db, class_id, key, str(current_user["_id"]),
+            {"present_students": valid_students, "recognized_students": valid_students},
+            {"total_faces_detected": total_faces_detected, "total_faces_recognized": total_faces_recognized},
+            mode=mode
+        )
+    else:
+        now = datetime.utcnow()
+        attendance_id = await insert_attendance(db, {
+            "class_id": class_id,
+            "date": now,
+            "timestamp": now.isoformat(),
+            "mode": mode,
+            "present_students": valid_students,
+            "recognized_students": valid_students,
+            "total_faces_detected": total_faces_detected,
+            "total_faces_recognized": total_faces_recognized,
+            "created_by": str(current_user["_id"]),
+            "created_at": now
+        })
+    logger.info(f"Attendance recorded: {len(valid_students)} students for class {class_id}")
+    
+    return {
+        "message": "Attendance recorded successfully",
+        "attendance_id": attendance_id,
+        "total_faces_detected": total_faces_detected,
+        "total_faces_recognized": total_faces_recognized,
+        "students_marked": len(valid_students),
+        "students_list": valid_students
+    }
+
+@router.post("/attendance/qr/scan", response_model=dict)
+async def scan_qr_attendance(
+    class_id: str = Form(...),
+    images: List[UploadFile] = File(...),
+    current_user: dict = Depends(get_current_faculty)
+):
+    """Scan student QR codes in uploaded photos into the class's live session.
+
+    The photos join the session as an ``upload`` camera, so the result is
+    saved with the same commit path as the QR/face streams.
+    """
+    db = get_database()
+    cls = await _get_faculty_class(db, class_id, current_user)
+    if len(images) == 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="At least one image is required")
+
+    session = attendance_session_manager.attach(
+        class_id, cls.get("enrolled_students", []), "upload", current_session_key(cls), AttendanceMode.QR.value
+    )
+    loop = asyncio.get_event_loop()
+    new_students = []
+    try:
+        for image in images:
+            content = await image.read()
+            frame = cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                continue
+            recognized_ids, total_detected, _, _ = await loop.run_in_executor(None, session.identify, frame, AttendanceMode.QR.value)
+            new_students.extend(session.record_frame("upload", recognized_ids, total_detected))
+    finally:
+        attendance_session_manager.detach(class_id, "upload")
+
+    return {"new_students": new_students, "session": session.summary()}
+
+@router.post("/attendance/auto/batch", response_model=dict)
+async def take_batch_attendance(
+    class_id: str = Form(...),
+    files: List[UploadFile] = File(...),
+    current_user: dict = Depends(get_current_faculty)
+):
+    """Start a background job that takes attendance from classroom photos or a recorded video"""
+    db = get_database()
+    cls = await _get_faculty_class(db, class_id, current_user)
+    if len(files) == 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="At least one image or video is required")
+
+    job_id = await job_manager.create("batch_attendance", str(current_user["_id"]), {
+        "class_id": class_id,
+        "files": [f.filename for f in files]
+    })
+    job_dir = os.path.join(settings.upload_dir, "batch", job_id)
+    os.makedirs(job_dir, exist_ok=True)
+
+    saved = []
+    try:
+        for i, upload in enumerate(files):
+            path = os.path.join(job_dir, f"{i}{os.path.splitext(upload.filename or '')[1].lower()}")
+            async with aiofiles.open(path, "wb") as out:
+                while chunk := await upload.read(1024 * 1024):
+                    await out.write(chunk)
+            saved.append({
+                "path": path,
+                "filename": upload.filename or f"file_{i}",
+                "kind": "video" if is_video_upload(upload.filename, upload.content_type) else "image"
+            })
+    except Exception as e:
+        # The job never starts; record why instead of leaving it pending
+        logger.error(f"Saving uploads for batch job {job_id} failed: {e}")
+        await job_manager.update(job_id, status="failed", error=f"Upload failed: {e}", finished_at=datetime.utcnow())
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not save the uploaded files")
+
+    enrolled_students = cls.get("enrolled_students", [])
+    job_manager.start(job_id, lambda jid: run_batch_attendance(jid, class_id, enrolled_students, saved, job_dir))
+    return {"message": "Batch attendance started", "job_id": job_id}
+
+@router.get("/attendance/auto/batch/{job_id}", response_model=dict)
+async def get_batch_attendance(job_id: str, current_user: dict = Depends(get_current_faculty)):
+    """Poll a batch attendance job; the draft and evidence are in ``result`` once completed"""
+    job = await job_manager.get(job_id)
+    if not job or job.get("type") != "batch_attendance":
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    if current_user.get("role") != "admin" and job.get("created_by") != str(current_user["_id"]):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized for this job")
+    job = convert_object_ids(job)
+    job["id"] = job["_id"]
+    return job
+
+@router.post("/attendance/auto/batch/{job_id}/commit", response_model=dict)
+async def commit_batch_attendance(
+    job_id: str,
+    commit_data: Dict[str, Any] = Body(default={}),
+    current_user: dict = Depends(get_current_faculty)
+):
+    """Save a batch job's draft, optionally with the faculty's corrections to present_students"""
+    db = get_database()
+    job = await job_manager.get(job_id)
+    if not job or job.get("type") != "batch_attendance":
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    if current_user.get("role") != "admin" and job.get("created_by") != str(current_user["_id"]):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized for this job")
+    if job.get("status") != "completed":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job is {job.get('status')}")
+    if job["result"].get("attendance_id"):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Draft already committed")
+
+    draft = job["result"]["draft"]
+    cls = await _get_faculty_class(db, draft["class_id"], current_user)
+    # Claim the draft with the new record's id before writing, so concurrent commits cannot both insert
+    record_id = ObjectId()
+    if not await job_manager.claim(job_id, "result.attendance_id", str(record_id)):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Draft already committed")
+    enrolled_students = cls.get("enrolled_students", [])
+    present_students = commit_data.get("present_students", draft["present_students"])
+    valid_students = [s for s in dict.fromkeys(present_students) if s in enrolled_students]
+
     now = datetime.utcnow()
     attendance_dict = {
-        "class_id": class_id,
+        "_id": record_id,
+        "class_id": draft["class_id"],
         "date": now,
         "timestamp": now.isoformat(),
         "mode": "auto",
         "present_students": valid_students,
-        "recognized_students": valid_students,
-        "total_faces_detected": total_faces_detected,
-        "total_faces_recognized": total_faces_recognized,
+        "recognized_students": [s for s in draft["recognized_students"] if s in enrolled_students],
+        "total_faces_detected": draft["total_faces_detected"],
+        "total_faces_recognized": draft["total_faces_recognized"],
+        "batch_job_id": job_id,
         "created_by": str(current_user["_id"]),
         "created_at": now
     }
-    
-    result = await db.attendance.insert_one(attendance_dict)
-    logger.info(f"Attendance recorded: {len(valid_students)} students for class {class_id}")
-    
+    try:
+        attendance_id = await insert_attendance(db, attendance_dict)
+    except Exception:
+        # Counter updates can fail after the record is saved; only a failed insert frees the draft
+        if await db.attendance.find_one({"_id": record_id}, {"_id": 1}) is None:
+            await job_manager.update(job_id, **{"result.attendance_id": None})
+        raise
+
     return {
         "message": "Attendance recorded successfully",
-        "attendance_id": str(result.inserted_id),
-        "total_faces_detected": total_faces_detected,
-        "total_faces_recognized": total_faces_recognized,
+        "attendance_id": attendance_id,
+        "total_faces_detected": draft["total_faces_detected"],
+        "total_faces_recognized": draft["total_faces_recognized"],
         "students_marked": len(valid_students),
         "students_list": valid_students
     }
@@ -181,17 +414,41 @@ async def attendance_stream(websocket: WebSocket, class_id: str):
             pass
         return
     
-    # Get enrolled students and load their face encodings
+    # Get enrolled students and attach to the class session (shared gallery and accumulator)
     enrolled_students = cls.get("enrolled_students", [])
     
     if not enrolled_students:
         logger.warning(f"No students enrolled in class {class_id}")
     
-    known_encodings = face_recognition_service.load_all_face_encodings(enrolled_students)
-    logger.info(f"Loaded face encodings for {len(known_encodings)} students")
+    # ?mode=qr scans student QR codes instead of recognizing faces
+    camera_mode = websocket.query_params.get("mode", AttendanceMode.AUTO.value)
+    if camera_mode not in (AttendanceMode.AUTO.value, AttendanceMode.QR.value):
+        try:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid mode")
+        except:
+            pass
+        return
     
-    if len(known_encodings) == 0:
-        logger.warning(f"No face encodings loaded for class {class_id}")
+    camera_id = websocket.query_params.get("camera_id") or uuid.uuid4().hex[:8]
+    session = attendance_session_manager.attach(class_id, enrolled_students, camera_id, current_session_key(cls), camera_mode)
+    if camera_mode == AttendanceMode.AUTO.value:
+        logger.info(f"Using face encodings for {len(session.gallery)} students")
+        if len(session.gallery) == 0:
+            logger.warning(f"No face encodings loaded for class {class_id}")
+    
+    # Optional delta mode: ?delta=true[&keyframe_interval=N]
+    delta_encoder = None
+    if websocket.query_params.get("delta", "").lower() in ("1", "true", "yes"):
+        try:
+            keyframe_interval = int(websocket.query_params.get("keyframe_interval", settings.stream_keyframe_interval))
+        except ValueError:
+            keyframe_interval = settings.stream_keyframe_interval
+        delta_encoder = StreamDeltaEncoder(keyframe_interval=keyframe_interval)
+        logger.info(f"Delta mode enabled for class_id: {class_id} (keyframe every {keyframe_interval} frames)")
+    
+    # Per-stage histograms for this stream; ?timings=true also echoes each frame's timings
+    stream_timings = recognition_metrics.open_session(class_id, camera_id)
+    echo_timings = websocket.query_params.get("timings", "").lower() in ("1", "true", "yes")
     
     frame_count = last_sent_time = frames_received = frames_processed = frames_with_faces = 0
     
@@ -205,6 +462,8 @@ async def attendance_stream(websocket: WebSocket, class_id: str):
                 
                 try:
                     message = await asyncio.wait_for(websocket.receive(), timeout=0.01)
+                    frame_started = time.perf_counter()
+                    timings = {}
                     
                     # Check message type and extract data
                     if "text" in message:
@@ -235,13 +494,20 @@ async def attendance_stream(websocket: WebSocket, class_id: str):
                 except json.JSONDecodeError as json_error:
                     logger.error(f"JSON decode error (message {frames_received}): {json_error}")
                     continue
+                timings["receive"] = (time.perf_counter() - frame_started) * 1000
                 
                 # Check if this is a stop message from client
                 if isinstance(frame_data, dict) and frame_data.get("action") == "stop":
                     logger.info(f"Stop message received. Stats: {frames_received} received, {frames_processed} processed, {frames_with_faces} with faces")
                     should_stop = True
+                    attendance_session_manager.detach(class_id, camera_id)
                     try:
-                        await websocket.send_json({"status": "stopped", "message": "Processing stopped"})
+                        await websocket.send_json({
+                            "status": "stopped",
+                            "message": "Processing stopped",
+                            "session": jsonable_encoder(session.summary()),
+                            "timings": recognition_metrics.snapshot_session(stream_timings)
+                        })
                     except Exception as ack_error:
                         logger.warning(f"Could not send stop acknowledgment: {ack_error}")
                     
@@ -252,6 +518,12 @@ async def attendance_stream(websocket: WebSocket, class_id: str):
                     
                     break
                 
+                # Client lost sync in delta mode and asks for a full state
+                if isinstance(frame_data, dict) and frame_data.get("action") == "keyframe":
+                    if delta_encoder is not None:
+                        delta_encoder.request_keyframe()
+                    continue
+                
                 # If stop flag is set, skip this frame entirely
                 if should_stop:
                     try:
@@ -296,7 +568,8 @@ async def attendance_stream(websocket: WebSocket, class_id: str):
                     
                     # Decode base64 to bytes
                     try:
-                        image_data = base64.b64decode(image_base64, validate=True)
+                        with timed(timings, "b64_decode"):
+                            image_data = base64.b64decode(image_base64, validate=True)
                     except Exception as b64_error:
                         logger.error(f"Base64 decode error (frame {frame_count}): {b64_error}")
                         continue
@@ -319,7 +592,8 @@ async def attendance_stream(websocket: WebSocket, class_id: str):
                     
                     # Decode JPEG/PNG image
                     try:
-                        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                        with timed(timings, "imdecode"):
+                            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
                     except Exception as cv_error:
                         logger.error(f"OpenCV decode error (frame {frame_count}): {cv_error}")
                         continue
@@ -357,12 +631,11 @@ async def attendance_stream(websocket: WebSocket, class_id: str):
                         if should_stop:
                             break
                         
-                        recognized_ids, total_detected, total_recognized, face_detections = face_recognition_service.recognize_faces_in_frame(
-                            frame, known_encodings
-                        )
+                        recognized_ids, total_detected, total_recognized, face_detections = session.identify(frame, camera_mode, timings)
                         
                         # Save debug frame if faces detected (first 5 frames or when faces found)
                         if total_detected > 0 and (frame_count <= 5 or len(face_detections) > 0):
+                            debug_started = time.perf_counter()
                             debug_frame = frame.copy()
                             for det in face_detections:
                                 x, y, w, h = det['x'], det['y'], det['width'], det['height']
@@ -375,6 +648,7 @@ async def attendance_stream(websocket: WebSocket, class_id: str):
                             os.makedirs(debug_dir, exist_ok=True)
                             debug_path = os.path.join(debug_dir, f"frame_{frame_count}_detected_{class_id}.jpg")
                             cv2.imwrite(debug_path, debug_frame)
+                            timings["debug_frame"] = (time.perf_counter() - debug_started) * 1000
                 except Exception as recognition_error:
                     logger.error(f"Error recognizing faces (frame {frame_count}): {recognition_error}", exc_info=True)
                     recognized_ids = []
@@ -385,9 +659,12 @@ async def attendance_stream(websocket: WebSocket, class_id: str):
                 if total_detected > 0:
                     frames_with_faces += 1
                 
+                session.record_frame(camera_id, recognized_ids, total_detected)
+                
                 # Create annotated frame for video stream
                 annotated_frame = None
                 if frame is not None:
+                    annotate_started = time.perf_counter()
                     annotated_frame = frame.copy()
                     if len(face_detections) > 0:
                         for det in face_detections:
@@ -396,13 +673,15 @@ async def attendance_stream(websocket: WebSocket, class_id: str):
                             cv2.rectangle(annotated_frame, (x, y), (x + w, y + h), color, 2)
                             label = det['student_id'] if det['recognized'] else "Unknown"
                             cv2.putText(annotated_frame, label, (x, max(y - 10, 20)), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+                    timings["annotate"] = (time.perf_counter() - annotate_started) * 1000
                 
                 # Encode annotated frame to base64 for video stream
                 frame_base64 = None
                 if annotated_frame is not None:
                     try:
-                        _, buffer = cv2.imencode('.jpg', annotated_frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-                        frame_base64 = base64.b64encode(buffer).decode('utf-8')
+                        with timed(timings, "jpeg_encode"):
+                            _, buffer = cv2.imencode('.jpg', annotated_frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+                            frame_base64 = base64.b64encode(buffer).decode('utf-8')
                     except Exception as encode_error:
                         logger.error(f"Error encoding frame for stream (frame {frame_count}): {encode_error}")
                 
@@ -411,17 +690,25 @@ async def attendance_stream(websocket: WebSocket, class_id: str):
                 
                 # Send recognition result with annotated frame
                 try:
-                    response_data = {
-                        "recognized_students": recognized_ids,
-                        "total_faces_detected": total_detected,
-                        "total_faces_recognized": total_recognized,
-                        "face_detections": face_detections
-                    }
+                    if delta_encoder is not None:
+                        response_data = delta_encoder.encode(recognized_ids, total_detected, total_recognized, face_detections)
+                    else:
+                        response_data = {
+                            "recognized_students": recognized_ids,
+                            "total_faces_detected": total_detected,
+                            "total_faces_recognized": total_recognized,
+                            "face_detections": face_detections
+                        }
                     if frame_base64:
                         response_data["annotated_frame"] = frame_base64
+                    if echo_timings:
+                        response_data["timings"] = {stage: round(ms, 3) for stage, ms in timings.items()}
                     
-                    await websocket.send_json(response_data)
+                    with timed(timings, "send"):
+                        await websocket.send_json(response_data)
                     last_sent_time = frame_count
+                    timings["total"] = (time.perf_counter() - frame_started) * 1000
+                    recognition_metrics.record_frame("stream", timings, stream_timings)
                 except Exception as send_error:
                     logger.error(f"Error sending recognition result (frame {frame_count}): {send_error}")
                     if "closed" in str(send_error).lower() or "disconnect" in str(send_error).lower():
@@ -442,6 +729,103 @@ async def attendance_stream(websocket: WebSocket, class_id: str):
             await websocket.close()
         except:
             pass
+    finally:
+        attendance_session_manager.detach(class_id, camera_id)
+        recognition_metrics.close_session(class_id, camera_id)
+        frame_totals = stream_timings.stages.get("total")
+        if frame_totals is not None and frame_totals.count:
+            logger.info(f"Stream {class_id}/{camera_id} frame latency: p50 {frame_totals.percentile(0.5)} ms, p99 {frame_totals.percentile(0.99)} ms over {frame_totals.count} frames")
+
+@router.get("/attendance/auto/session/{class_id}", response_model=dict)
+async def get_attendance_session(class_id: str, current_user: dict = Depends(get_current_faculty)):
+    """Merged state of all cameras streaming a class"""
+    db = get_database()
+    await _get_faculty_class(db, class_id, current_user)
+    session = attendance_session_manager.get(class_id)
+    if session is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No active attendance session")
+    return session.summary()
+
+@router.post("/attendance/auto/session/{class_id}/commit", response_model=dict)
+async def commit_attendance_session(class_id: str, current_user: dict = Depends(get_current_faculty)):
+    """Write the merged multi-camera result to the session's attendance record"""
+    db = get_database()
+    await _get_faculty_class(db, class_id, current_user)
+    session = attendance_session_manager.get(class_id)
+    if session is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No active attendance session")
+    attendance_id = await session.commit(db, str(current_user["_id"]))
+    summary = session.summary()
+    return {
+        "message": "Attendance recorded successfully",
+        "attendance_id": attendance_id,
+        "total_faces_detected": summary["total_faces_detected"],
+        "total_faces_recognized": summary["total_faces_recognized"],
+        "students_marked": len(summary["recognized_students"]),
+        "students_list": summary["recognized_students"]
+    }
+
+@router.post("/attendance/auto/ingest/{class_id}", response_model=dict)
+async def start_camera_ingestion(
+    class_id: str,
+    ingest_data: Dict[str, Any] = Body(default={}),
+    current_user: dict = Depends(get_current_faculty)
+):
+    """Recognize faces from a configured camera or a video file on the server instead of a browser tab
+
+    ``camera_id`` picks one of the cameras an admin set for the class;
+    ``video`` names a file inside the configured videos directory.
+    """
+    db = get_database()
+    cls = await _get_faculty_class(db, class_id, current_user)
+    try:
+        camera_id, source = resolve_source(cls, ingest_data.get("camera_id"), ingest_data.get("video"))
+    except PermissionError as e:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    sample_fps = ingest_data.get("sample_fps")
+    if sample_fps is not None:
+        try:
+            sample_fps = float(sample_fps)
+        except (TypeError, ValueError):
+            sample_fps = None
+        if sample_fps is None or not math.isfinite(sample_fps) or sample_fps <= 0:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="sample_fps must be a positive number")
+    mode = ingest_data.get("mode", AttendanceMode.AUTO.value)
+    if mode not in (AttendanceMode.AUTO.value, AttendanceMode.QR.value):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid mode. Must be 'auto' or 'qr'")
+    try:
+        worker = camera_ingestion_manager.start(
+            class_id, cls.get("enrolled_students", []), camera_id, source,
+            sample_fps,
+            current_session_key(cls),
+            mode
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return {"message": "Camera ingestion started", **worker.summary()}
+
+@router.get("/attendance/auto/ingest/{class_id}", response_model=dict)
+async def get_camera_ingestion(class_id: str, current_user: dict = Depends(get_current_faculty)):
+    db = get_database()
+    await _get_faculty_class(db, class_id, current_user)
+    session = attendance_session_manager.get(class_id)
+    return {
+        "workers": [worker.summary() for worker in camera_ingestion_manager.for_class(class_id)],
+        "session": session.summary() if session else None
+    }
+
+@router.delete("/attendance/auto/ingest/{class_id}/{camera_id}", response_model=dict)
+async def stop_camera_ingestion(class_id: str, camera_id: str, current_user: dict = Depends(get_current_faculty)):
+    db = get_database()
+    await _get_faculty_class(db, class_id, current_user)
+    worker = camera_ingestion_manager.stop(class_id, camera_id)
+    if worker is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Camera not found")
+    if worker.task is not None:
+        await asyncio.wait({worker.task}, timeout=settings.camera_reconnect_seconds)
+    return {"message": "Camera ingestion stopped", **worker.summary()}
 
 @router.get("/attendance/history", response_model=List[dict])
 async def get_attendance_history(
@@ -516,54 +900,34 @@ async def get_reports(
         else:
             classes = await db.classes.find({"faculty_id": str(current_user["_id"])}).to_list(length=1000)
     
-    # Build date filter query
-    date_query = {}
-    if start_date or end_date:
-        date_query = {}
-        if start_date:
-            date_query["$gte"] = start_date
-        if end_date:
-            date_query["$lte"] = end_date
-    
     # Validate mode if provided
-    if mode and mode not in ["manual", "auto"]:
-        raise HTTPException(status_code=400, detail="Invalid mode. Must be 'manual' or 'auto'")
+    if mode and mode not in [m.value for m in AttendanceMode]:
+        raise HTTPException(status_code=400, detail="Invalid mode. Must be 'manual', 'auto' or 'qr'")
+    
+    date_range = date_filter(start_date, end_date)
+    class_ids = [str(cls["_id"]) for cls in classes]
+    totals = await count_sessions(db, class_ids, date_range, mode)
+    presence = await count_presence(db, class_ids, date_range, mode)
+    students = await find_students(db, (sid for cls in classes for sid in cls.get("enrolled_students", [])))
     
     reports = []
     for cls in classes:
-        enrolled_students = cls.get("enrolled_students", [])
+        total_classes = totals.get(str(cls["_id"]), 0)
+        class_presence = presence.get(str(cls["_id"]), {})
         attendance_data = []
         
-        for student_id in enrolled_students:
-            student = await db.users.find_one({"student_id": student_id})
+        for student_id in cls.get("enrolled_students", []):
+            student = students.get(student_id)
             if not student:
                 continue
             
-            # Build queries with date and mode filters
-            total_query = {"class_id": str(cls["_id"])}
-            present_query = {
-                "class_id": str(cls["_id"]),
-                "present_students": student_id
-            }
-            
-            if date_query:
-                total_query["date"] = date_query
-                present_query["date"] = date_query
-            
-            if mode:
-                total_query["mode"] = mode
-                present_query["mode"] = mode
-            
-            total_classes = await db.attendance.count_documents(total_query)
-            present_count = await db.attendance.count_documents(present_query)
-            attendance_percentage = (present_count / total_classes * 100) if total_classes > 0 else 0
-            
+            present_count = class_presence.get(student_id, 0)
             attendance_data.append({
                 "student_id": student_id,
                 "student_name": student.get("full_name"),
                 "total_classes": total_classes,
                 "present_count": present_count,
-                "attendance_percentage": round(attendance_percentage, 2)
+                "attendance_percentage": attendance_percentage(present_count, total_classes)
             })
         
         reports.append({
@@ -574,6 +938,39 @@ async def get_reports(
     
     return reports
 
+@router.get("/classes/{class_id}/analytics", response_model=dict)
+async def get_class_analytics(
+    class_id: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    mode: Optional[str] = None,
+    threshold: float = 75.0,
+    recent_sessions: int = 20,
+    current_user: dict = Depends(get_current_faculty)
+):
+    """Percentages, streaks, at-risk students and recent absentees from the class presence matrix"""
+    db = get_database()
+    cls = await _get_faculty_class(db, class_id, current_user)
+    
+    if mode and mode not in [m.value for m in AttendanceMode]:
+        raise HTTPException(status_code=400, detail="Invalid mode. Must be 'manual', 'auto' or 'qr'")
+    if recent_sessions < 0:
+        raise HTTPException(status_code=400, detail="recent_sessions must not be negative")
+    
+    roster = cls.get("enrolled_students", [])
+    presence = await presence_matrices.get(db, class_id)
+    analytics = presence.analytics(roster, start_date, end_date, mode, threshold, recent_sessions)
+    students = await find_students(db, roster)
+    for row in analytics["students"]:
+        row["student_name"] = students.get(row["student_id"], {}).get("full_name")
+    
+    return {
+        "class_id": class_id,
+        "class_name": cls.get("name"),
+        "threshold": threshold,
+        **analytics
+    }
+
 @router.get("/reports/download")
 async def download_report(
     class_id: Optional[str] = None, 
@@ -584,88 +981,35 @@ async def download_report(
     current_user: dict = Depends(get_current_faculty)
 ):
 
-    from fastapi.responses import Response
-    from io import StringIO
-    import csv
-    
     db = get_database()
     
     if class_id:
-        cls = await db.classes.find_one({"_id": ObjectId(class_id)})
+        cls = await db.classes.find_one({"_id": ObjectId(class_id)}, {"_id": 1})
         if not cls:
             raise HTTPException(status_code=404, detail="Class not found")
-        classes = [cls]
+        class_query = {"_id": cls["_id"]}
+    elif current_user.get("role") == "admin":
+        class_query = {}
     else:
-        if current_user.get("role") == "admin":
-            classes = await db.classes.find().to_list(length=1000)
-        else:
-            classes = await db.classes.find({"faculty_id": str(current_user["_id"])}).to_list(length=1000)
-    
-    date_query = {}
-    if start_date or end_date:
-        date_query = {}
-        if start_date:
-            date_query["$gte"] = start_date
-        if end_date:
-            date_query["$lte"] = end_date
+        class_query = {"faculty_id": str(current_user["_id"])}
     
     # Validate mode if provided
-    if mode and mode not in ["manual", "auto"]:
-        raise HTTPException(status_code=400, detail="Invalid mode. Must be 'manual' or 'auto'")
-    
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Class Name", "Student ID", "Student Name", "Total Classes", "Present", "Attendance Percentage"])
-    
-    for cls in classes:
-        class_name = cls.get("name", "Unknown")
-        enrolled_students = cls.get("enrolled_students", [])
-        
-        for student_id in enrolled_students:
-            student = await db.users.find_one({"student_id": student_id})
-            if not student:
-                continue
-            
-            total_query = {"class_id": str(cls["_id"])}
-            present_query = {
-                "class_id": str(cls["_id"]),
-                "present_students": student_id
-            }
-            
-            if date_query:
-                total_query["date"] = date_query
-                present_query["date"] = date_query
-            
-            if mode:
-                total_query["mode"] = mode
-                present_query["mode"] = mode
-            
-            total_classes = await db.attendance.count_documents(total_query)
-            present_count = await db.attendance.count_documents(present_query)
-            attendance_percentage = (present_count / total_classes * 100) if total_classes > 0 else 0
-            
-            writer.writerow([
-                class_name,
-                student_id,
-                student.get("full_name", "Unknown"),
-                total_classes,
-                present_count,
-                f"{round(attendance_percentage, 2)}%"
-            ])
-    
-    date_suffix = ""
-    if start_date or end_date:
-        start_str = start_date.strftime("%Y%m%d") if start_date else ""
-        end_str = end_date.strftime("%Y%m%d") if end_date else ""
-        date_suffix = f"_{start_str}_to_{end_str}" if start_str and end_str else f"_{start_str}" if start_str else f"_{end_str}"
-    
-    filename = f"attendance_report_{class_id if class_id else 'all_classes'}{date_suffix}.csv"
-    return Response(
-        content=output.getvalue(),
-        media_type="text/csv",
-        headers={
-            "Content-Disposition": f"attachment; filename={filename}"
-        }
+    if mode and mode not in [m.value for m in AttendanceMode]:
+        raise HTTPException(status_code=400, detail="Invalid mode. Must be 'manual', 'auto' or 'qr'")
+    if format not in REPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format. Must be 'csv', 'excel' or 'parquet'")
+    
+    rows = roster_rows(db, class_query, date_filter(start_date, end_date), mode)
+    return await export_response(
+        format,
+        FACULTY_ROSTER_COLUMNS,
+        (
+            [class_name, student_id, name, total, present, attendance_percentage(present, total)]
+            async for class_name, student_id, name, total, present in rows
+        ),
+        class_id if class_id else "all_classes",
+        start_date,
+        end_date
     )
 
 @router.post("/notifications/send")
@@ -1,23 +1,35 @@
-from fastapi import APIRouter, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
-from fastapi.responses import Response
+from fastapi import APIRouter, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, UploadFile, File, Request
+from fastapi.responses import Response, JSONResponse
 from typing import List, Optional
 from datetime import datetime, timedelta
-import qrcode
-import io
 import base64
-import csv
 import uuid
+import asyncio
 import logging
 from app.models import UserUpdate, Enrollment, MessageCreate, Message
 from app.auth import get_current_student, get_websocket_user
 from app.database import get_database
+from app.config import settings
+from app.services.face_recognition import face_recognition_service
+from app.services.encoder_profiles import encoder_registry
+from app.services.attendance_session import attendance_session_manager
+from app.services.attendance_stats import attendance_percentage, count_presence, count_sessions, date_filter
+from app.services.attendance_writes import upsert_session_attendance
+from app.services.student_stats import get_student_stats as compute_student_stats
+from app.services.report_export import REPORT_FORMATS, STUDENT_RECORD_COLUMNS, class_names_for, export_response, student_record_rows
+from app.services.qr_cache import qr_code_cache
 from app.utils.serialization import convert_object_ids
 from app.utils.websocket_manager import connection_manager
+from app.utils.rate_limit import SlidingWindowRateLimiter
+from app.utils.schedule import current_window, session_key
+from app.utils.http_cache import etag_matches
 from bson import ObjectId
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+check_in_limiter = SlidingWindowRateLimiter(settings.check_in_max_attempts, settings.check_in_attempt_window_seconds)
+
 @router.get("/profile", response_model=dict)
 async def get_profile(current_user: dict = Depends(get_current_student)):
     user_data = {k: v for k, v in current_user.items() if k != "password"}
@@ -135,18 +147,19 @@ async def get_enrolled_classes(current_user: dict = Depends(get_current_student)
     
     classes = await db.classes.find({"enrolled_students": student_id}).to_list(length=1000)
     
+    class_ids = [str(cls["_id"]) for cls in classes]
+    totals = await count_sessions(db, class_ids)
+    presence = await count_presence(db, class_ids, student_ids=[student_id])
+    faculty_ids = {cls.get("faculty_id") for cls in classes if cls.get("faculty_id") and ObjectId.is_valid(cls.get("faculty_id"))}
+    faculty_names = {
+        str(user["_id"]): user.get("full_name")
+        async for user in db.users.find({"_id": {"$in": [ObjectId(fid) for fid in faculty_ids]}}, {"full_name": 1})
+    }
+    
     result = []
     for cls in classes:
-        # Get attendance stats
-        total_classes = await db.attendance.count_documents({"class_id": str(cls["_id"])})
-        present_count = await db.attendance.count_documents({
-            "class_id": str(cls["_id"]),
-            "present_students": student_id
-        })
-        attendance_percentage = (present_count / total_classes * 100) if total_classes > 0 else 0
-        
-        # Get faculty info
-        faculty = await db.users.find_one({"_id": ObjectId(cls.get("faculty_id"))})
+        total_classes = totals.get(str(cls["_id"]), 0)
+        present_count = presence.get(str(cls["_id"]), {}).get(student_id, 0)
         
         cls_dict = {
             "id": str(cls["_id"]),
@@ -154,15 +167,89 @@ async def get_enrolled_classes(current_user: dict = Depends(get_current_student)
             "code": cls.get("code"),
             "description": cls.get("description"),
             "schedule": cls.get("schedule"),
-            "faculty_name": faculty.get("full_name") if faculty else "Unknown",
+            "faculty_name": faculty_names.get(str(cls.get("faculty_id")), "Unknown"),
             "total_classes": total_classes,
             "present_count": present_count,
-            "attendance_percentage": round(attendance_percentage, 2)
+            "attendance_percentage": attendance_percentage(present_count, total_classes)
         }
         result.append(cls_dict)
     
     return result
 
+@router.post("/classes/{class_id}/check-in", response_model=dict)
+async def self_check_in(
+    class_id: str,
+    selfie: UploadFile = File(...),
+    current_user: dict = Depends(get_current_student)
+):
+    """Mark yourself present by verifying a selfie against your own face data (1:1)"""
+    db = get_database()
+    
+    student_id = current_user.get("student_id")
+    if not student_id:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Student ID not found")
+    
+    if not ObjectId.is_valid(class_id):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid class ID")
+    cls = await db.classes.find_one({"_id": ObjectId(class_id)})
+    if not cls:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Class not found")
+    if student_id not in cls.get("enrolled_students", []):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enrolled in this class")
+    
+    window = current_window(cls.get("schedule"), datetime.utcnow(), timedelta(minutes=settings.session_open_before_minutes))
+    if not window:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Check-in is only open during the scheduled class time")
+    
+    allowed, retry_after = check_in_limiter.hit(student_id)
+    if not allowed:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many check-in attempts. Please try again later",
+            headers={"Retry-After": str(retry_after)}
+        )
+    
+    content = await selfie.read()
+    loop = asyncio.get_event_loop()
+    # Resolve the encoder version once so the selfie and the stored encodings match
+    version = encoder_registry.active_version
+    known_encodings = await loop.run_in_executor(None, face_recognition_service.load_face_encodings, student_id, version)
+    if not known_encodings:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No face data registered for this student")
+    
+    try:
+        encoding = await loop.run_in_executor(None, face_recognition_service.encode_face_from_bytes, content, version)
+    except Exception as e:
+        logger.warning(f"Could not read check-in selfie for {student_id}: {e}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid image")
+    if encoding is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No face detected in the selfie")
+    
+    matched_id, distance = face_recognition_service.match_face(
+        encoding, {student_id: known_encodings}, tolerance=settings.check_in_tolerance
+    )
+    if matched_id != student_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Face did not match your registered face data")
+    
+    attendance_id = await upsert_session_attendance(
+        db, class_id, session_key(class_id, window[0]), str(current_user["_id"]),
+        {"present_students": [student_id], "self_checked_in": [student_id]}
+    )
+    
+    # Show the check-in on any camera session running for this lecture
+    session = attendance_session_manager.get(class_id)
+    if session is not None and not session.closed:
+        session.mark_present([student_id], source="self_check_in")
+    
+    return {
+        "message": "Checked in successfully",
+        "attendance_id": attendance_id,
+        "class_id": class_id,
+        "distance": round(distance, 4),
+        "session_start": window[0],
+        "session_end": window[1]
+    }
+
 @router.get("/attendance/reports", response_model=List[dict])
 async def get_attendance_reports(
     class_id: Optional[str] = None,
@@ -230,122 +317,8 @@ async def get_student_stats(
             "recent_attendance": []
         }
     
-    # Build date filter query
-    date_query = {}
-    if start_date or end_date:
-        if start_date:
-            date_query["$gte"] = start_date
-        if end_date:
-            date_query["$lte"] = end_date
-    
-    # Get enrolled classes
-    classes = await db.classes.find({"enrolled_students": student_id}).to_list(length=1000)
-    total_classes_count = len(classes)
-    
-    # Get total attendance
-    class_ids = [str(cls["_id"]) for cls in classes]
-    total_attendance_query = {
-        "class_id": {"$in": class_ids},
-        "present_students": student_id
-    }
-    if date_query:
-        total_attendance_query["date"] = date_query
-    
-    total_attendance = await db.attendance.count_documents(total_attendance_query)
-    
-    # Calculate overall attendance percentage
-    total_possible_query = {"class_id": {"$in": class_ids}}
-    if date_query:
-        total_possible_query["date"] = date_query
-    total_possible_attendance = await db.attendance.count_documents(total_possible_query)
-    overall_percentage = (total_attendance / total_possible_attendance * 100) if total_possible_attendance > 0 else 0
-    
-    # Get attendance by class
-    attendance_by_class = []
-    for cls in classes:
-        class_total_query = {"class_id": str(cls["_id"])}
-        class_present_query = {
-            "class_id": str(cls["_id"]),
-            "present_students": student_id
-        }
-        if date_query:
-            class_total_query["date"] = date_query
-            class_present_query["date"] = date_query
-        
-        class_total = await db.attendance.count_documents(class_total_query)
-        class_present = await db.attendance.count_documents(class_present_query)
-        class_percentage = (class_present / class_total * 100) if class_total > 0 else 0
-        
-        attendance_by_class.append({
-            "class_name": cls.get("name", "Unknown"),
-            "total_classes": class_total,
-            "present_count": class_present,
-            "attendance_percentage": round(class_percentage, 2)
-        })
-    
-    # Get attendance by day - use date range if provided, otherwise last 7 days
-    attendance_by_day = []
-    if start_date and end_date:
-        # Use provided date range
-        current_date = start_date
-        while current_date <= end_date:
-            day_start = current_date.replace(hour=0, minute=0, second=0, microsecond=0)
-            day_end = current_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-            count = await db.attendance.count_documents({
-                "class_id": {"$in": class_ids},
-                "present_students": student_id,
-                "date": {"$gte": day_start, "$lte": day_end}
-            })
-            attendance_by_day.append({
-                "date": current_date.strftime("%Y-%m-%d"),
-                "day": current_date.strftime("%a"),
-                "count": count
-            })
-            current_date += timedelta(days=1)
-    else:
-        # Default to last 7 days
-        for i in range(6, -1, -1):
-            day = datetime.utcnow() - timedelta(days=i)
-            day_start = day.replace(hour=0, minute=0, second=0, microsecond=0)
-            day_end = day.replace(hour=23, minute=59, second=59, microsecond=999999)
-            count = await db.attendance.count_documents({
-                "class_id": {"$in": class_ids},
-                "present_students": student_id,
-                "date": {"$gte": day_start, "$lte": day_end}
-            })
-            attendance_by_day.append({
-                "date": day.strftime("%Y-%m-%d"),
-                "day": day.strftime("%a"),
-                "count": count
-            })
-    
-    # Get recent attendance (last 10)
-    recent_query = {
-        "class_id": {"$in": class_ids},
-        "present_students": student_id
-    }
-    if date_query:
-        recent_query["date"] = date_query
-    recent_records = await db.attendance.find(recent_query).sort("date", -1).limit(10).to_list(length=10)
-    
-    recent_attendance = []
-    for record in recent_records:
-        cls = await db.classes.find_one({"_id": ObjectId(record["class_id"])})
-        recent_attendance.append({
-            "class_name": cls.get("name") if cls else "Unknown",
-            "date": record["date"],
-            "mode": record.get("mode", "manual")
-        })
-    
-    return {
-        "total_classes": total_classes_count,
-        "total_attendance": total_attendance,
-        "total_possible_attendance": total_possible_attendance,
-        "attendance_percentage": round(overall_percentage, 2),
-        "attendance_by_class": attendance_by_class,
-        "attendance_by_day": attendance_by_day,
-        "recent_attendance": recent_attendance
-    }
+    classes = await db.classes.find({"enrolled_students": student_id}, {"name": 1}).to_list(length=1000)
+    return await compute_student_stats(db, student_id, classes, start_date, end_date)
 
 @router.get("/attendance/reports/download")
 async def download_attendance_report(
@@ -363,65 +336,24 @@ async def download_attendance_report(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Student ID not found"
         )
+    if format not in REPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format. Must be 'csv', 'excel' or 'parquet'")
     
     query = {"present_students": student_id}
     if class_id:
         query["class_id"] = class_id
+        class_names = await class_names_for(db, [class_id])
     else:
-        classes = await db.classes.find({"enrolled_students": student_id}).to_list(length=1000)
-        class_ids = [str(cls["_id"]) for cls in classes]
-        query["class_id"] = {"$in": class_ids}
-    
-    # Add date filters
-    if start_date or end_date:
-        query["date"] = {}
-        if start_date:
-            query["date"]["$gte"] = start_date
-        if end_date:
-            query["date"]["$lte"] = end_date
-    
-    attendance_records = await db.attendance.find(query).sort("date", -1).to_list(length=1000)
-    
-    # Generate CSV content
-    from io import StringIO
+        classes = await db.classes.find({"enrolled_students": student_id}, {"name": 1}).to_list(length=1000)
+        class_names = {str(cls["_id"]): cls.get("name", "Unknown") for cls in classes}
+        query["class_id"] = {"$in": list(class_names)}
     
-    output = StringIO()
-    writer = csv.writer(output)
+    date_range = date_filter(start_date, end_date)
+    if date_range:
+        query["date"] = date_range
     
-    # Write header
-    writer.writerow(["Date", "Time", "Class Name", "Mode", "Status"])
-    
-    # Write data
-    for record in attendance_records:
-        cls = await db.classes.find_one({"_id": ObjectId(record["class_id"])})
-        class_name = cls.get("name") if cls else "Unknown"
-        date_obj = record.get("date") or record.get("created_at")
-        if isinstance(date_obj, str):
-            date_obj = datetime.fromisoformat(date_obj.replace('Z', '+00:00'))
-        date_str = date_obj.strftime("%Y-%m-%d") if isinstance(date_obj, datetime) else str(date_obj)
-        time_str = date_obj.strftime("%H:%M:%S") if isinstance(date_obj, datetime) else ""
-        writer.writerow([
-            date_str,
-            time_str,
-            class_name,
-            record.get("mode", "manual"),
-            "Present"
-        ])
-    
-    # Build filename with date range if provided
-    date_suffix = ""
-    if start_date or end_date:
-        start_str = start_date.strftime("%Y%m%d") if start_date else ""
-        end_str = end_date.strftime("%Y%m%d") if end_date else ""
-        date_suffix = f"_{start_str}_to_{end_str}" if start_str and end_str else f"_{start_str}" if start_str else f"_{end_str}"
-    
-    filename = f"attendance_report_{student_id}{date_suffix}.csv"
-    return Response(
-        content=output.getvalue(),
-        media_type="text/csv",
-        headers={
-            "Content-Disposition": f"attachment; filename={filename}"
-        }
+    return await export_response(
+        format, STUDENT_RECORD_COLUMNS, student_record_rows(db, query, class_names), student_id, start_date, end_date
     )
 
 @router.get("/enrollment/history", response_model=List[dict])
@@ -746,8 +678,12 @@ async def get_faculties(current_user: dict = Depends(get_current_student)):
     
     return result
 
+def _qr_cache_headers(etag: str) -> dict:
+    # Private: the response sits behind the student's bearer token
+    return {"ETag": f'"{etag}"', "Cache-Control": "private, max-age=86400"}
+
 @router.get("/qr-code", response_model=dict)
-async def get_qr_code(current_user: dict = Depends(get_current_student)):
+async def get_qr_code(request: Request, current_user: dict = Depends(get_current_student)):
     student_id = current_user.get("student_id")
     if not student_id:
         raise HTTPException(
@@ -755,21 +691,37 @@ async def get_qr_code(current_user: dict = Depends(get_current_student)):
             detail="Student ID not found"
         )
     
-    # Generate QR code
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(student_id)
-    qr.make(fit=True)
+    etag = qr_code_cache.etag_for(student_id)
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_qr_cache_headers(etag))
     
-    img = qr.make_image(fill_color="black", back_color="white")
+    png, etag = await asyncio.get_event_loop().run_in_executor(None, qr_code_cache.get_png, student_id)
+    img_str = base64.b64encode(png).decode()
     
-    # Convert to base64
-    buffer = io.BytesIO()
-    img.save(buffer, format="PNG")
-    img_str = base64.b64encode(buffer.getvalue()).decode()
+    return JSONResponse(
+        content={
+            "student_id": student_id,
+            "qr_code": f"data:image/png;base64,{img_str}",
+            "qr_code_url": "/api/student/qr-code.png"
+        },
+        headers=_qr_cache_headers(etag)
+    )
+
+@router.get("/qr-code.png")
+async def get_qr_code_png(request: Request, current_user: dict = Depends(get_current_student)):
+    """Raw QR code image with a strong ETag, cacheable with normal HTTP semantics"""
+    student_id = current_user.get("student_id")
+    if not student_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Student ID not found"
+        )
     
-    return {
-        "student_id": student_id,
-        "qr_code": f"data:image/png;base64,{img_str}"
-    }
+    etag = qr_code_cache.etag_for(student_id)
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_qr_cache_headers(etag))
+    
+    png, etag = await asyncio.get_event_loop().run_in_executor(None, qr_code_cache.get_png, student_id)
+    return Response(content=png, media_type="image/png", headers=_qr_cache_headers(etag))
 
 
@@ -0,0 +1,150 @@
+"""Admin dashboard statistics in a handful of aggregations.
+
+One ``$facet`` aggregation per collection (users, classes, attendance) and
+one read of the daily rollups, all issued concurrently, replace the dozen
+counts and per-class queries the dashboard used to run. ``$facet`` cannot
+use indexes, so each aggregation first narrows its input with an indexed
+``$match``; undated attendance totals come from the ``attendance_summary``
+class rows instead of the whole history. Results are cached for
+``settings.dashboard_cache_seconds``.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+
+from app.config import settings
+from app.services.attendance_daily import attendance_daily
+from app.services.attendance_stats import date_filter
+from app.services.attendance_summary import attendance_summary
+from app.utils.ttl_cache import TTLCache
+
+dashboard_cache = TTLCache(settings.dashboard_cache_seconds, max_size=64)
+
+
+def _count(facet: list) -> int:
+    return facet[0]["count"] if facet else 0
+
+
+async def _user_counts(db) -> dict:
+    pipeline = [
+        {"$match": {"role": {"$in": ["student", "faculty"]}}},
+        {"$facet": {
+            "students": [{"$match": {"role": "student"}}, {"$count": "count"}],
+            "active_students": [{"$match": {"role": "student", "status": "active"}}, {"$count": "count"}],
+            "faculties": [{"$match": {"role": "faculty"}}, {"$count": "count"}]
+        }}
+    ]
+    result = (await db.users.aggregate(pipeline).to_list(length=1))[0]
+    return {
+        "total_students": _count(result["students"]),
+        "active_students": _count(result["active_students"]),
+        "total_faculties": _count(result["faculties"])
+    }
+
+
+async def _class_stats(db) -> dict:
+    pipeline = [
+        {"$facet": {
+            "total": [{"$count": "count"}],
+            "top_classes": [
+                {"$project": {"_id": 0, "class_name": {"$ifNull": ["$name", "Unknown"]}, "students": {"$size": {"$ifNull": ["$enrolled_students", []]}}}},
+                {"$sort": {"students": -1}},
+                {"$limit": 5}
+            ]
+        }}
+    ]
+    result = (await db.classes.aggregate(pipeline).to_list(length=1))[0]
+    return {"total_classes": _count(result["total"]), "top_classes": result["top_classes"]}
+
+
+def _top_classes(count_field: str) -> list:
+    """Stages turning per-class ``{_id: class_id, <count_field>}`` rows into the top five with names"""
+    return [
+        {"$sort": {count_field: -1}},
+        {"$limit": 5},
+        # Convert on this side so the lookup is an equality match on the classes _id index
+        {"$addFields": {"oid": {"$convert": {"input": "$_id", "to": "objectId", "onError": None, "onNull": None}}}},
+        {"$lookup": {"from": "classes", "localField": "oid", "foreignField": "_id", "as": "class"}},
+        {"$project": {
+            "_id": 0,
+            "class_name": {"$ifNull": [{"$arrayElemAt": ["$class.name", 0]}, "Unknown"]},
+            "attendance_count": f"${count_field}"
+        }}
+    ]
+
+
+async def _attendance_from_summary(db) -> dict:
+    """Undated totals from the class rows of attendance_summary, O(classes) via the (student_id, class_id) index"""
+    pipeline = [
+        {"$match": {"student_id": None}},
+        {"$facet": {
+            "total": [{"$group": {"_id": None, "count": {"$sum": "$total_sessions"}}}],
+            "by_class": [{"$project": {"_id": "$class_id", "total_sessions": 1}}] + _top_classes("total_sessions")
+        }}
+    ]
+    result = (await db.attendance_summary.aggregate(pipeline).to_list(length=1))[0]
+    return {"total_attendance": _count(result["total"]), "attendance_by_class": result["by_class"]}
+
+
+async def _attendance_stats(db, start_date: Optional[datetime], end_date: Optional[datetime]) -> dict:
+    date_range = date_filter(start_date, end_date)
+    last_week = {"$gte": datetime.utcnow() - timedelta(days=7)}
+    if start_date and end_date:
+        # The chart range doubles as "last 7 days"
+        last_week = None
+
+    if date_range is None and await attendance_summary.is_ready(db):
+        stats, last_7_days = await asyncio.gather(
+            _attendance_from_summary(db),
+            db.attendance.count_documents({"date": last_week})
+        )
+        return {**stats, "attendance_last_7_days": last_7_days}
+
+    facets = {
+        "total": [{"$count": "count"}],
+        "by_class": [{"$group": {"_id": "$class_id", "attendance_count": {"$sum": 1}}}] + _top_classes("attendance_count")
+    }
+    pipeline = []
+    if date_range and last_week:
+        # Both windows come from one indexed scan; each facet keeps its own
+        pipeline.append({"$match": {"$or": [{"date": date_range}, {"date": last_week}]}})
+        in_range = [{"$match": {"date": date_range}}]
+        facets = {name: in_range + stages for name, stages in facets.items()}
+    elif date_range:
+        pipeline.append({"$match": {"date": date_range}})
+    if last_week:
+        facets["last_7_days"] = [{"$match": {"date": last_week}}, {"$count": "count"}]
+    pipeline.append({"$facet": facets})
+
+    result = (await db.attendance.aggregate(pipeline).to_list(length=1))[0]
+    total = _count(result["total"])
+    return {
+        "total_attendance": total,
+        "attendance_last_7_days": _count(result["last_7_days"]) if last_week else total,
+        "attendance_by_class": result["by_class"]
+    }
+
+
+async def _compute(db, start_date: Optional[datetime], end_date: Optional[datetime]) -> dict:
+    first_day, last_day = attendance_daily.day_range(start_date, end_date)
+    users, classes, attendance, sessions_by_day = await asyncio.gather(
+        _user_counts(db),
+        _class_stats(db),
+        _attendance_stats(db, start_date, end_date),
+        attendance_daily.sessions_by_day(db, first_day, last_day)
+    )
+    return {
+        "total_students": users["total_students"],
+        "active_students": users["active_students"],
+        "total_faculties": users["total_faculties"],
+        "total_classes": classes["total_classes"],
+        "total_attendance": attendance["total_attendance"],
+        "attendance_last_7_days": attendance["attendance_last_7_days"],
+        "attendance_by_day": attendance_daily.series(sessions_by_day, first_day, last_day),
+        "top_classes": classes["top_classes"],
+        "attendance_by_class": attendance["attendance_by_class"]
+    }
+
+
+async def get_dashboard_stats(db, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> dict:
+    return await dashboard_cache.get_or_set((start_date, end_date), lambda: _compute(db, start_date, end_date))
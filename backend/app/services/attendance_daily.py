@@ -0,0 +1,213 @@
+"""Daily attendance rollups for time-series charts.
+
+``attendance_daily`` holds one row per calendar day in
+``settings.report_timezone``:
+
+- ``class_id: None, student_id: None``: ``sessions`` recorded that day
+- ``class_id, student_id: None``: ``sessions`` of that class
+- ``class_id, student_id``: ``present``, sessions the student attended
+
+Rows are updated by ``app.services.attendance_writes`` together with
+``attendance_summary`` and rebuilt by the same command. A chart over any
+range is then one indexed range query. The timezone used for bucketing is
+recorded with the build; after changing ``REPORT_TIMEZONE`` the rollups are
+ignored (and days are counted from the records) until they are rebuilt.
+"""
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+from zoneinfo import ZoneInfo
+
+from pymongo import ReplaceOne, UpdateOne
+
+from app.config import settings
+from app.services.build_state import BuildState
+
+logger = logging.getLogger(__name__)
+
+DAILY_STATE_ID = "attendance_daily"
+
+
+class AttendanceDaily:
+    def __init__(self, timezone_name: str):
+        self.timezone_name = timezone_name
+        self.tz = ZoneInfo(timezone_name)
+        # Rollups bucketed in another timezone are ignored until rebuilt
+        self.state = BuildState(
+            DAILY_STATE_ID,
+            "Daily attendance rollups have not been built; charts count attendance records until "
+            "`python -m app.services.attendance_summary` runs",
+            timezone=timezone_name
+        )
+
+    def day_of(self, moment: datetime) -> str:
+        """Calendar day (YYYY-MM-DD) in the report timezone; naive datetimes are UTC"""
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return moment.astimezone(self.tz).strftime("%Y-%m-%d")
+
+    def today(self) -> date:
+        return datetime.now(self.tz).date()
+
+    def _utc_start_of(self, day: date) -> datetime:
+        return datetime.combine(day, datetime.min.time(), self.tz).astimezone(timezone.utc).replace(tzinfo=None)
+
+    def utc_window(self, first_day: date, last_day: date) -> dict:
+        """``date`` condition (naive UTC) covering whole calendar days in the report timezone"""
+        return {"$gte": self._utc_start_of(first_day), "$lt": self._utc_start_of(last_day + timedelta(days=1))}
+
+    def day_expression(self, field: str = "$date") -> dict:
+        """Aggregation expression for a date's calendar day in the report timezone"""
+        return {"$dateToString": {"format": "%Y-%m-%d", "date": field, "timezone": self.timezone_name}}
+
+    async def load(self, db):
+        await self.state.load(db)
+
+    async def is_ready(self, db) -> bool:
+        return await self.state.is_ready(db)
+
+    async def apply(
+        self,
+        db,
+        class_id: str,
+        moment: Optional[datetime],
+        sessions: int = 0,
+        added: Iterable[str] = (),
+        removed: Iterable[str] = ()
+    ):
+        """Same deltas as ``AttendanceSummary.apply``, bucketed by the record's day"""
+        if moment is None:
+            return
+        day = self.day_of(moment)
+        operations = []
+        if sessions:
+            for row_class_id in (None, class_id):
+                operations.append(UpdateOne(
+                    {"day": day, "class_id": row_class_id, "student_id": None},
+                    {"$inc": {"sessions": sessions}},
+                    upsert=True
+                ))
+        for student_id, change in [(s, 1) for s in dict.fromkeys(added)] + [(s, -1) for s in dict.fromkeys(removed)]:
+            operations.append(UpdateOne(
+                {"day": day, "class_id": class_id, "student_id": student_id},
+                {"$inc": {"present": change}},
+                upsert=True
+            ))
+        if operations:
+            await db.attendance_daily.bulk_write(operations, ordered=False)
+
+    async def sessions_by_day(self, db, first_day: date, last_day: date, class_ids: Optional[List[str]] = None) -> Dict[str, int]:
+        """Attendance records per day, over all classes or the given ones"""
+        first, last = first_day.isoformat(), last_day.isoformat()
+        if await self.is_ready(db):
+            query = {"day": {"$gte": first, "$lte": last}, "student_id": None}
+            query["class_id"] = {"$in": class_ids} if class_ids is not None else None
+            counts: Dict[str, int] = {}
+            async for row in db.attendance_daily.find(query, {"day": 1, "sessions": 1}):
+                counts[row["day"]] = counts.get(row["day"], 0) + row.get("sessions", 0)
+            return counts
+        match = {"date": self.utc_window(first_day, last_day)}
+        if class_ids is not None:
+            match["class_id"] = {"$in": class_ids}
+        return await self._count_records(db, match)
+
+    async def presence_by_day(self, db, student_id: str, first_day: date, last_day: date, class_ids: Optional[List[str]] = None) -> Dict[str, int]:
+        """Records per day in which the student is present"""
+        first, last = first_day.isoformat(), last_day.isoformat()
+        if await self.is_ready(db):
+            query = {"student_id": student_id, "day": {"$gte": first, "$lte": last}}
+            if class_ids is not None:
+                query["class_id"] = {"$in": class_ids}
+            counts: Dict[str, int] = {}
+            async for row in db.attendance_daily.find(query, {"day": 1, "present": 1}):
+                counts[row["day"]] = counts.get(row["day"], 0) + row.get("present", 0)
+            return counts
+        match = {
+            "present_students": student_id,
+            "date": self.utc_window(first_day, last_day)
+        }
+        if class_ids is not None:
+            match["class_id"] = {"$in": class_ids}
+        return await self._count_records(db, match)
+
+    async def _count_records(self, db, match: dict) -> Dict[str, int]:
+        pipeline = [
+            {"$match": match},
+            {"$group": {"_id": self.day_expression(), "count": {"$sum": 1}}}
+        ]
+        return {doc["_id"]: doc["count"] async for doc in db.attendance.aggregate(pipeline)}
+
+    def day_range(self, start_date: Optional[datetime], end_date: Optional[datetime], default_days: int = 7):
+        """First and last calendar day of a chart: the given dates, or the last ``default_days`` days"""
+        if start_date and end_date:
+            return start_date.date(), end_date.date()
+        last_day = self.today()
+        return last_day - timedelta(days=default_days - 1), last_day
+
+    def series(self, counts: Dict[str, int], first_day: date, last_day: date) -> List[dict]:
+        """``[{"date", "day", "count"}]`` for every day of the range, zeros included"""
+        result = []
+        day = first_day
+        while day <= last_day:
+            result.append({"date": day.isoformat(), "day": day.strftime("%a"), "count": counts.get(day.isoformat(), 0)})
+            day += timedelta(days=1)
+        return result
+
+    async def rebuild(self, db, class_ids: Optional[List[str]] = None) -> int:
+        """Recompute the rollups of the given classes (all when None); returns rows written"""
+        full = class_ids is None
+        if full:
+            class_ids = await db.attendance.distinct("class_id")
+            class_ids += [cid for cid in await db.attendance_daily.distinct("class_id") if cid and cid not in class_ids]
+        day = self.day_expression()
+        rows_written = 0
+        for class_id in class_ids:
+            rows = []
+            async for doc in db.attendance.aggregate([
+                {"$match": {"class_id": class_id, "date": {"$type": "date"}}},
+                {"$group": {"_id": day, "sessions": {"$sum": 1}}}
+            ]):
+                rows.append({"day": doc["_id"], "class_id": class_id, "student_id": None, "sessions": doc["sessions"]})
+            async for doc in db.attendance.aggregate([
+                {"$match": {"class_id": class_id, "date": {"$type": "date"}}},
+                {"$project": {"day": day, "present": {"$setUnion": [{"$ifNull": ["$present_students", []]}, []]}}},
+                {"$unwind": "$present"},
+                {"$group": {"_id": {"day": "$day", "student_id": "$present"}, "present": {"$sum": 1}}}
+            ]):
+                rows.append({"day": doc["_id"]["day"], "class_id": class_id, "student_id": doc["_id"]["student_id"], "present": doc["present"]})
+            await db.attendance_daily.delete_many({"class_id": class_id})
+            if rows:
+                await db.attendance_daily.bulk_write(
+                    [ReplaceOne({"day": r["day"], "class_id": class_id, "student_id": r["student_id"]}, r, upsert=True) for r in rows],
+                    ordered=False
+                )
+            rows_written += len(rows)
+
+        # Day totals over every class, from the class rows just written
+        if full:
+            await db.attendance_daily.delete_many({"class_id": None})
+            totals = [doc async for doc in db.attendance_daily.aggregate([
+                {"$match": {"student_id": None}},
+                {"$group": {"_id": "$day", "sessions": {"$sum": "$sessions"}}}
+            ])]
+        else:
+            affected = await db.attendance_daily.distinct("day", {"class_id": {"$in": class_ids}})
+            totals = [doc async for doc in db.attendance_daily.aggregate([
+                {"$match": {"student_id": None, "class_id": {"$ne": None}, "day": {"$in": affected}}},
+                {"$group": {"_id": "$day", "sessions": {"$sum": "$sessions"}}}
+            ])]
+        if totals:
+            await db.attendance_daily.bulk_write([
+                ReplaceOne({"day": doc["_id"], "class_id": None, "student_id": None},
+                           {"day": doc["_id"], "class_id": None, "student_id": None, "sessions": doc["sessions"]}, upsert=True)
+                for doc in totals
+            ], ordered=False)
+        rows_written += len(totals)
+
+        if full:
+            await self.state.mark_built(db, rows=rows_written)
+        logger.info(f"Rebuilt daily attendance rollups for {len(class_ids)} classes ({rows_written} rows, {self.timezone_name})")
+        return rows_written
+
+
+attendance_daily = AttendanceDaily(settings.report_timezone)
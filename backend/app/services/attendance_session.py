@@ -0,0 +1,237 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from app.config import settings
+from app.services.attendance_writes import insert_attendance, merge_into_attendance, upsert_session_attendance
+from app.services.face_recognition import face_recognition_service
+from app.services.gallery_cache import ClassGallery, gallery_cache
+from app.services.qr_scanner import scan_qr_codes
+from app.utils.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+
+class AttendanceSession:
+    """Live auto-attendance session for one class.
+
+    All cameras streaming the same class attach to a single session. They
+    share one gallery (loaded only once a face-recognition camera joins; QR
+    cameras need none) and one accumulator, so a student seen by several
+    cameras is counted once and the session is written to one attendance
+    record no matter how many cameras or commits there are.
+    """
+
+    def __init__(
+        self,
+        class_id: str,
+        enrolled_students: List[str],
+        gallery: Optional[ClassGallery],
+        session_key: Optional[str] = None,
+        mode: str = "auto"
+    ):
+        self.class_id = class_id
+        self.session_key = session_key
+        self.mode = mode
+        self.enrolled = set(enrolled_students)
+        self.gallery = gallery
+        self.cameras: Dict[str, dict] = {}
+        self.recognized: Dict[str, dict] = {}
+        self.attendance_id: Optional[str] = None
+        self.closed = False
+        self.started_at = datetime.utcnow()
+        self.last_activity = self.started_at
+        self._commit_lock = asyncio.Lock()
+
+    def attach_camera(self, camera_id: str):
+        self.cameras.setdefault(camera_id, {
+            "connected": True,
+            "frames": 0,
+            "max_faces_detected": 0,
+            "attached_at": datetime.utcnow()
+        })["connected"] = True
+        self.last_activity = datetime.utcnow()
+
+    def detach_camera(self, camera_id: str):
+        if camera_id in self.cameras:
+            self.cameras[camera_id]["connected"] = False
+        self.last_activity = datetime.utcnow()
+
+    @property
+    def active_cameras(self) -> List[str]:
+        return [cid for cid, cam in self.cameras.items() if cam["connected"]]
+
+    def record_frame(self, camera_id: str, recognized_ids: Iterable[str], total_detected: int) -> List[str]:
+        """Merge one frame's results into the session and return newly recognized students"""
+        now = datetime.utcnow()
+        self.last_activity = now
+        camera = self.cameras.get(camera_id)
+        if camera is not None:
+            camera["frames"] += 1
+            camera["max_faces_detected"] = max(camera["max_faces_detected"], total_detected)
+        return self.mark_present(recognized_ids, source=camera_id, seen_at=now)
+
+    def mark_present(self, student_ids: Iterable[str], source: str, seen_at: Optional[datetime] = None) -> List[str]:
+        seen_at = seen_at or datetime.utcnow()
+        new_students = []
+        for student_id in student_ids:
+            if student_id not in self.enrolled:
+                continue
+            entry = self.recognized.get(student_id)
+            if entry is None:
+                self.recognized[student_id] = {"first_seen": seen_at, "sources": {source}}
+                new_students.append(student_id)
+            else:
+                entry["sources"].add(source)
+        return new_students
+
+    def apply_validation(self, student_ids: Iterable[str]) -> List[str]:
+        """Replace the accumulator with a list the faculty has reviewed.
+
+        The submitted students are kept, as are students seen only by cameras
+        that are still streaming (the client could not review those). Anyone
+        else the client left out is dropped, so no later commit writes them
+        back. Returns the resulting present list.
+        """
+        active = set(self.active_cameras)
+        submitted = {student_id for student_id in student_ids if student_id in self.enrolled}
+        for student_id, entry in list(self.recognized.items()):
+            if student_id not in submitted and not entry["sources"] <= active:
+                del self.recognized[student_id]
+        self.mark_present(submitted, source="client")
+        return sorted(self.recognized)
+
+    def identify(self, frame, camera_mode: Optional[str] = None, timings: Optional[Dict[str, float]] = None):
+        """Identify students in a frame by face (gallery) or by QR code, depending on the camera's mode.
+
+        Returns the (recognized_ids, total_detected, total_recognized, detections)
+        tuple; pass it to ``record_frame`` to merge it into the session.
+        """
+        if (camera_mode or self.mode) == "qr":
+            with timed(timings, "detect"):
+                return scan_qr_codes(frame, self.enrolled)
+        if self.gallery is None:
+            return face_recognition_service.recognize_faces_in_frame(frame, {}, timings=timings)
+        gallery = self.gallery
+        return face_recognition_service.recognize_faces_in_frame(frame, gallery.encodings, gallery.version, gallery.index, timings)
+
+    @property
+    def total_faces_detected(self) -> int:
+        # Cameras overlap, so the busiest single frame is the best lower bound
+        return max((cam["max_faces_detected"] for cam in self.cameras.values()), default=0)
+
+    def summary(self) -> dict:
+        return {
+            "class_id": self.class_id,
+            "attendance_id": self.attendance_id,
+            "session_key": self.session_key,
+            "mode": self.mode,
+            "closed": self.closed,
+            "started_at": self.started_at,
+            "active_cameras": self.active_cameras,
+            "cameras": {
+                cid: {"connected": cam["connected"], "frames": cam["frames"], "max_faces_detected": cam["max_faces_detected"]}
+                for cid, cam in self.cameras.items()
+            },
+            "recognized_students": sorted(self.recognized),
+            "total_faces_detected": self.total_faces_detected,
+            "total_faces_recognized": len(self.recognized)
+        }
+
+    async def commit(self, db, created_by: str, total_faces_detected: Optional[int] = None) -> str:
+        """Write the accumulator to the session's attendance record.
+
+        The first commit inserts the record; later commits (from other cameras
+        or a repeated save) only add students that were not written yet.
+        """
+        async with self._commit_lock:
+            present = sorted(self.recognized)
+            faces_detected = max(total_faces_detected or 0, self.total_faces_detected)
+            now = datetime.utcnow()
+            if self.attendance_id is None and self.session_key:
+                self.attendance_id = await upsert_session_attendance(
+                    db, self.class_id, self.session_key, created_by,
+                    {"present_students": present, "recognized_students": present, "cameras": sorted(self.cameras)},
+                    {"total_faces_detected": faces_detected, "total_faces_recognized": len(present)},
+                    mode=self.mode
+                )
+            elif self.attendance_id is None:
+                self.attendance_id = await insert_attendance(db, {
+                    "class_id": self.class_id,
+                    "date": now,
+                    "timestamp": now.isoformat(),
+                    "mode": self.mode,
+                    "present_students": present,
+                    "recognized_students": present,
+                    "total_faces_detected": faces_detected,
+                    "total_faces_recognized": len(present),
+                    "cameras": sorted(self.cameras),
+                    "created_by": created_by,
+                    "created_at": now
+                })
+            else:
+                await merge_into_attendance(
+                    db, self.attendance_id,
+                    {"present_students": present, "recognized_students": present, "cameras": sorted(self.cameras)},
+                    {"total_faces_detected": faces_detected, "total_faces_recognized": len(present)}
+                )
+            self.last_activity = now
+            if not self.active_cameras:
+                # Late saves from other cameras still merge in; new streams start a new session
+                self.closed = True
+            return self.attendance_id
+
+
+class AttendanceSessionManager:
+    """Registry of live attendance sessions keyed by class id"""
+
+    def __init__(self):
+        self.sessions: Dict[str, AttendanceSession] = {}
+
+    def _reap_idle(self):
+        cutoff = datetime.utcnow() - timedelta(minutes=settings.session_idle_timeout_minutes)
+        for class_id, session in list(self.sessions.items()):
+            if not session.active_cameras and session.last_activity < cutoff:
+                logger.info(f"Closing idle attendance session for class {class_id}")
+                del self.sessions[class_id]
+
+    def attach(
+        self,
+        class_id: str,
+        enrolled_students: List[str],
+        camera_id: str,
+        session_key: Optional[str] = None,
+        mode: str = "auto"
+    ) -> AttendanceSession:
+        self._reap_idle()
+        session = self.sessions.get(class_id)
+        if session is None or session.closed or session.enrolled != set(enrolled_students):
+            if session is not None and not session.closed and session.active_cameras:
+                # Roster changed while cameras are live; keep accumulating in place
+                session.enrolled = set(enrolled_students)
+                session.gallery = gallery_cache.get(class_id, enrolled_students) if session.gallery is not None else None
+            else:
+                session = AttendanceSession(class_id, enrolled_students, None, session_key, mode)
+                self.sessions[class_id] = session
+        if mode == "auto" and session.gallery is None:
+            session.gallery = gallery_cache.get(class_id, enrolled_students)
+        session.attach_camera(camera_id)
+        logger.info(f"Camera {camera_id} attached to class {class_id} ({len(session.active_cameras)} active)")
+        return session
+
+    def detach(self, class_id: str, camera_id: str):
+        session = self.sessions.get(class_id)
+        if session is not None:
+            session.detach_camera(camera_id)
+            logger.info(f"Camera {camera_id} detached from class {class_id} ({len(session.active_cameras)} active)")
+
+    def get(self, class_id: str) -> Optional[AttendanceSession]:
+        self._reap_idle()
+        return self.sessions.get(class_id)
+
+    def close(self, class_id: str) -> Optional[AttendanceSession]:
+        return self.sessions.pop(class_id, None)
+
+
+attendance_session_manager = AttendanceSessionManager()
@@ -0,0 +1,117 @@
+"""Attendance counts for many classes and students in a few queries.
+
+Reports used to run two ``count_documents`` and a ``users.find_one`` per
+enrolled student. These helpers answer the same questions for a whole list
+of classes with one query each, and look students up with one ``$in``
+query. Undated counts are read from the ``attendance_summary`` counters
+once they have been built. Other counts come from the cached presence
+matrices for small or already cached sets of classes (checked against
+the classes' write counters first), and from an aggregation over the
+attendance records otherwise.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from app.services.attendance_summary import attendance_summary
+from app.services.presence_matrix import presence_matrices
+
+
+def date_filter(start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> Optional[dict]:
+    """``date`` condition for an inclusive range, or None when unbounded"""
+    if not (start_date or end_date):
+        return None
+    condition = {}
+    if start_date:
+        condition["$gte"] = start_date
+    if end_date:
+        condition["$lte"] = end_date
+    return condition
+
+
+def _bounds(date_range: Optional[dict]):
+    date_range = date_range or {}
+    return date_range.get("$gte"), date_range.get("$lte")
+
+
+def _match(class_ids: List[str], date_range: Optional[dict], mode: Optional[str] = None) -> dict:
+    match = {"class_id": {"$in": class_ids}}
+    if date_range:
+        match["date"] = date_range
+    if mode:
+        match["mode"] = mode
+    return match
+
+
+async def count_sessions(
+    db,
+    class_ids: Iterable[str],
+    date_range: Optional[dict] = None,
+    mode: Optional[str] = None
+) -> Dict[str, int]:
+    """Number of attendance records per class"""
+    class_ids = list(class_ids)
+    if not class_ids:
+        return {}
+    if not date_range and await attendance_summary.is_ready(db):
+        return await attendance_summary.class_totals(db, class_ids, mode)
+    versions = await presence_matrices.versions(db, class_ids)
+    if versions is not None:
+        return await presence_matrices.class_totals(db, class_ids, versions, *_bounds(date_range), mode)
+    pipeline = [
+        {"$match": _match(class_ids, date_range, mode)},
+        {"$group": {"_id": "$class_id", "count": {"$sum": 1}}}
+    ]
+    return {doc["_id"]: doc["count"] async for doc in db.attendance.aggregate(pipeline)}
+
+
+async def count_presence(
+    db,
+    class_ids: Iterable[str],
+    date_range: Optional[dict] = None,
+    mode: Optional[str] = None,
+    student_ids: Optional[List[str]] = None
+) -> Dict[str, Dict[str, int]]:
+    """Per class, the number of attendance records each student is present in
+
+    ``student_ids`` limits the result to those students.
+    """
+    class_ids = list(class_ids)
+    if not class_ids:
+        return {}
+    if not date_range and await attendance_summary.is_ready(db):
+        return await attendance_summary.presence(db, class_ids, mode, student_ids)
+    versions = await presence_matrices.versions(db, class_ids)
+    if versions is not None:
+        return await presence_matrices.presence(db, class_ids, versions, *_bounds(date_range), mode, student_ids)
+    match = _match(class_ids, date_range, mode)
+    if student_ids is not None:
+        match["present_students"] = {"$in": student_ids}
+    pipeline = [
+        {"$match": match},
+        # A record counts once per student even if the id was stored twice
+        {"$project": {"class_id": 1, "present": {"$setUnion": [{"$ifNull": ["$present_students", []]}, []]}}},
+        {"$unwind": "$present"}
+    ]
+    if student_ids is not None:
+        pipeline.append({"$match": {"present": {"$in": student_ids}}})
+    pipeline += [
+        {"$group": {"_id": {"class_id": "$class_id", "student_id": "$present"}, "count": {"$sum": 1}}}
+    ]
+    presence: Dict[str, Dict[str, int]] = {}
+    async for doc in db.attendance.aggregate(pipeline):
+        presence.setdefault(doc["_id"]["class_id"], {})[doc["_id"]["student_id"]] = doc["count"]
+    return presence
+
+
+async def find_students(db, student_ids: Iterable[str], projection: Optional[dict] = None) -> Dict[str, dict]:
+    """Student users keyed by ``student_id``, fetched with one query"""
+    student_ids = list(set(student_ids))
+    if not student_ids:
+        return {}
+    projection = projection or {"student_id": 1, "full_name": 1}
+    cursor = db.users.find({"student_id": {"$in": student_ids}}, projection)
+    return {user["student_id"]: user async for user in cursor}
+
+
+def attendance_percentage(present: int, total: int) -> float:
+    return round(present / total * 100, 2) if total > 0 else 0
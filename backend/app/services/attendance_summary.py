@@ -0,0 +1,230 @@
+"""Incrementally maintained attendance counters.
+
+The ``attendance_summary`` collection holds, per class:
+
+- a class row (``student_id: None``) with ``total_sessions``,
+  ``sessions_by_mode`` and ``writes``, a counter bumped by every write to
+  the class's attendance (cached presence matrices are checked against it)
+- a row per (class, student) with ``present_count``, ``present_by_mode``
+  and ``last_present_at``
+
+Every write to ``attendance`` goes through ``app.services.attendance_writes``,
+which applies the change to these rows with atomic ``$inc``/``$max``
+updates, so undated reports read O(roster) small documents instead of
+recounting the whole history. The counters (and the ``attendance_daily``
+rollups) can always be rebuilt from the attendance records::
+
+    python -m app.services.attendance_summary [--class-id ID ...]
+
+Until the first rebuild has completed (recorded in ``system_settings``),
+readers fall back to counting the attendance records.
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import ReplaceOne, UpdateOne
+
+from app.database import close_db, get_database, init_db
+from app.services.attendance_daily import attendance_daily
+from app.services.build_state import BuildState
+from app.services.jobs import job_manager
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_STATE_ID = "attendance_summary"
+UNKNOWN_MODE = "unknown"
+
+
+def _mode(mode: Optional[str]) -> str:
+    return getattr(mode, "value", mode) or UNKNOWN_MODE
+
+
+class AttendanceSummary:
+    def __init__(self):
+        self.state = BuildState(
+            SUMMARY_STATE_ID,
+            "Attendance summary has not been built; reports count attendance records until "
+            "`python -m app.services.attendance_summary` or POST /api/admin/attendance-summary/rebuild runs"
+        )
+
+    async def load(self, db):
+        await self.state.load(db)
+
+    async def is_ready(self, db) -> bool:
+        return await self.state.is_ready(db)
+
+    async def apply(
+        self,
+        db,
+        class_id: str,
+        mode: Optional[str],
+        date: Optional[datetime],
+        sessions: int = 0,
+        added: Iterable[str] = (),
+        removed: Iterable[str] = ()
+    ):
+        """Apply one attendance write: ``sessions`` records added (+1) or deleted (-1),
+        students newly present in a record and students no longer present in it"""
+        mode = _mode(mode)
+        now = datetime.utcnow()
+        added = list(dict.fromkeys(added))
+        removed = list(dict.fromkeys(removed))
+        class_inc = {"writes": 1}
+        if sessions:
+            class_inc.update({"total_sessions": sessions, f"sessions_by_mode.{mode}": sessions})
+        operations = [UpdateOne(
+            {"class_id": class_id, "student_id": None},
+            {"$inc": class_inc, "$set": {"updated_at": now}},
+            upsert=True
+        )]
+        for student_id in added:
+            update = {"$inc": {"present_count": 1, f"present_by_mode.{mode}": 1}, "$set": {"updated_at": now}}
+            if date is not None:
+                update["$max"] = {"last_present_at": date}
+            operations.append(UpdateOne({"class_id": class_id, "student_id": student_id}, update, upsert=True))
+        for student_id in removed:
+            operations.append(UpdateOne(
+                {"class_id": class_id, "student_id": student_id},
+                {"$inc": {"present_count": -1, f"present_by_mode.{mode}": -1}, "$set": {"updated_at": now}},
+                upsert=True
+            ))
+        await db.attendance_summary.bulk_write(operations, ordered=False)
+        if removed:
+            await self._refresh_last_present(db, class_id, removed)
+
+    async def _refresh_last_present(self, db, class_id: str, student_ids: List[str]):
+        """``$max`` cannot go backwards; recompute last_present_at after removals"""
+        pipeline = [
+            {"$match": {"class_id": class_id, "present_students": {"$in": student_ids}}},
+            {"$unwind": "$present_students"},
+            {"$match": {"present_students": {"$in": student_ids}}},
+            {"$group": {"_id": "$present_students", "last_present_at": {"$max": "$date"}}}
+        ]
+        latest = {doc["_id"]: doc["last_present_at"] async for doc in db.attendance.aggregate(pipeline)}
+        await db.attendance_summary.bulk_write([
+            UpdateOne({"class_id": class_id, "student_id": student_id}, {"$set": {"last_present_at": latest.get(student_id)}})
+            for student_id in student_ids
+        ], ordered=False)
+
+    async def write_counts(self, db, class_ids: List[str]) -> Dict[str, int]:
+        """Per class, the number of attendance writes recorded so far"""
+        cursor = db.attendance_summary.find({"class_id": {"$in": class_ids}, "student_id": None}, {"class_id": 1, "writes": 1})
+        return {row["class_id"]: row.get("writes", 0) async for row in cursor}
+
+    async def class_totals(self, db, class_ids: List[str], mode: Optional[str] = None) -> Dict[str, int]:
+        field = f"sessions_by_mode.{mode}" if mode else "total_sessions"
+        cursor = db.attendance_summary.find({"class_id": {"$in": class_ids}, "student_id": None}, {"class_id": 1, field: 1})
+        totals = {}
+        async for row in cursor:
+            totals[row["class_id"]] = (row.get("sessions_by_mode", {}).get(mode, 0) if mode else row.get("total_sessions", 0))
+        return totals
+
+    async def presence(
+        self,
+        db,
+        class_ids: List[str],
+        mode: Optional[str] = None,
+        student_ids: Optional[List[str]] = None
+    ) -> Dict[str, Dict[str, int]]:
+        query = {"class_id": {"$in": class_ids}, "student_id": {"$in": student_ids} if student_ids is not None else {"$ne": None}}
+        field = f"present_by_mode.{mode}" if mode else "present_count"
+        presence: Dict[str, Dict[str, int]] = {}
+        async for row in db.attendance_summary.find(query, {"class_id": 1, "student_id": 1, field: 1}):
+            count = row.get("present_by_mode", {}).get(mode, 0) if mode else row.get("present_count", 0)
+            presence.setdefault(row["class_id"], {})[row["student_id"]] = count
+        return presence
+
+    async def rebuild(self, db, class_ids: Optional[List[str]] = None) -> dict:
+        """Recompute the counters from the attendance records, one class at a time.
+
+        Each class's rows are replaced right after its aggregation, so writes
+        landing during a rebuild can only be missed for the class being
+        rebuilt at that moment; run it again if sessions were being recorded.
+        """
+        full = class_ids is None
+        if full:
+            class_ids = await db.attendance.distinct("class_id")
+            class_ids += [cid for cid in await db.attendance_summary.distinct("class_id") if cid not in class_ids]
+        rows_written = 0
+        for class_id in class_ids:
+            rows_written += await self._rebuild_class(db, class_id)
+        if full:
+            # Only a full rebuild makes the counters trustworthy for every class
+            await self.state.mark_built(db, classes=len(class_ids), rows=rows_written)
+        logger.info(f"Rebuilt attendance summary for {len(class_ids)} classes ({rows_written} rows)")
+        return {"classes": len(class_ids), "rows": rows_written}
+
+    async def _rebuild_class(self, db, class_id: str) -> int:
+        now = datetime.utcnow()
+        mode = {"$ifNull": ["$mode", UNKNOWN_MODE]}
+        class_row = {"class_id": class_id, "student_id": None, "total_sessions": 0, "sessions_by_mode": {}, "updated_at": now}
+        async for doc in db.attendance.aggregate([
+            {"$match": {"class_id": class_id}},
+            {"$group": {"_id": mode, "count": {"$sum": 1}}}
+        ]):
+            class_row["total_sessions"] += doc["count"]
+            class_row["sessions_by_mode"][doc["_id"]] = doc["count"]
+
+        students: Dict[str, dict] = {}
+        async for doc in db.attendance.aggregate([
+            {"$match": {"class_id": class_id}},
+            {"$project": {"mode": mode, "date": 1, "present": {"$setUnion": [{"$ifNull": ["$present_students", []]}, []]}}},
+            {"$unwind": "$present"},
+            {"$group": {"_id": {"student_id": "$present", "mode": "$mode"}, "count": {"$sum": 1}, "last": {"$max": "$date"}}}
+        ]):
+            student_id = doc["_id"]["student_id"]
+            row = students.setdefault(student_id, {
+                "class_id": class_id, "student_id": student_id, "present_count": 0,
+                "present_by_mode": {}, "last_present_at": None, "updated_at": now
+            })
+            row["present_count"] += doc["count"]
+            row["present_by_mode"][doc["_id"]["mode"]] = doc["count"]
+            if doc["last"] is not None and (row["last_present_at"] is None or doc["last"] > row["last_present_at"]):
+                row["last_present_at"] = doc["last"]
+
+        operations = [
+            # Updated rather than replaced so the write counter keeps counting up
+            UpdateOne({"class_id": class_id, "student_id": None}, {"$set": class_row, "$inc": {"writes": 1}}, upsert=True)
+        ]
+        operations += [
+            ReplaceOne({"class_id": class_id, "student_id": student_id}, row, upsert=True)
+            for student_id, row in students.items()
+        ]
+        await db.attendance_summary.bulk_write(operations, ordered=False)
+        await db.attendance_summary.delete_many({"class_id": class_id, "student_id": {"$nin": [None] + list(students)}})
+        return len(operations)
+
+
+attendance_summary = AttendanceSummary()
+
+
+async def rebuild_all(db, class_ids: Optional[List[str]] = None) -> dict:
+    """Rebuild the counters and the daily rollups from the attendance records"""
+    result = await attendance_summary.rebuild(db, class_ids)
+    result["daily_rows"] = await attendance_daily.rebuild(db, class_ids)
+    return result
+
+
+async def run_summary_rebuild(job_id: str) -> dict:
+    """Background-job entry point for the admin rebuild endpoint"""
+    job = await job_manager.get(job_id)
+    return await rebuild_all(get_database(), job["params"].get("class_ids"))
+
+
+async def _main(class_ids: Optional[List[str]]):
+    await init_db()
+    try:
+        result = await rebuild_all(get_database(), class_ids)
+        print(f"Rebuilt attendance summary: {result['classes']} classes, {result['rows']} rows, {result['daily_rows']} daily rows")
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the attendance counters and daily rollups from the attendance records")
+    parser.add_argument("--class-id", action="append", help="only rebuild these classes (repeatable)")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(parser.parse_args().class_id))
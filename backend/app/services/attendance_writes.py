@@ -0,0 +1,154 @@
+"""The only place attendance records are written.
+
+Each function changes the ``attendance`` collection and then applies the
+exact delta (new record, students newly present or no longer present) to
+``attendance_summary``, the ``attendance_daily`` rollups and any cached
+presence matrix. Deltas come
+from the document as it was just before the write
+(``ReturnDocument.BEFORE``), so concurrent writers to the same record never
+count a student twice.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.services.attendance_daily import attendance_daily
+from app.services.attendance_summary import attendance_summary
+from app.services.presence_matrix import presence_matrices
+
+SUMMARY_FIELDS = {"class_id": 1, "mode": 1, "date": 1, "present_students": 1}
+
+
+async def _record_change(
+    db,
+    record_id,
+    class_id: str,
+    mode: Optional[str],
+    date: Optional[datetime],
+    sessions: int = 0,
+    added=(),
+    removed=()
+):
+    added, removed = list(added), list(removed)
+    presence_matrices.apply(class_id, str(record_id), date, mode, sessions, added, removed)
+    await attendance_summary.apply(db, class_id, mode, date, sessions, added, removed)
+    await attendance_daily.apply(db, class_id, date, sessions, added, removed)
+
+
+async def insert_attendance(db, record: dict) -> str:
+    """Insert a complete attendance record (manual, one-shot auto, batch)"""
+    result = await db.attendance.insert_one(record)
+    await _record_change(
+        db, result.inserted_id, record["class_id"], record.get("mode"), record.get("date"),
+        sessions=1, added=record.get("present_students") or []
+    )
+    return str(result.inserted_id)
+
+
+async def _merge(db, query: dict, update: dict, upsert: bool, new_record: Optional[dict] = None) -> Optional[dict]:
+    """Apply an ``$addToSet`` merge and record the newly present students"""
+    before = await db.attendance.find_one_and_update(
+        query, update, upsert=upsert, return_document=ReturnDocument.BEFORE, projection=SUMMARY_FIELDS
+    )
+    present = update.get("$addToSet", {}).get("present_students", {}).get("$each", [])
+    if before is None:
+        if not upsert:
+            return None
+        record = new_record or {}
+        await _record_change(db, record["_id"], record["class_id"], record.get("mode"), record.get("date"), sessions=1, added=present)
+        return None
+    already = set(before.get("present_students") or [])
+    await _record_change(
+        db, before["_id"], before["class_id"], before.get("mode"), before.get("date"),
+        added=[student_id for student_id in present if student_id not in already]
+    )
+    return before
+
+
+async def upsert_session_attendance(
+    db,
+    class_id: str,
+    session_key: str,
+    created_by: str,
+    add_to_set: Dict[str, List],
+    max_fields: Optional[dict] = None,
+    mode: str = "auto"
+) -> str:
+    """Merge students into the single attendance record of a scheduled session.
+
+    Every writer for the same session (cameras, self check-ins) targets the
+    record identified by (class_id, session_key), creating it on first write.
+    """
+    now = datetime.utcnow()
+    on_insert = {
+        # Chosen here so the new record's id is known without reading it back
+        "_id": ObjectId(),
+        "class_id": class_id,
+        "session_key": session_key,
+        "date": now,
+        "timestamp": now.isoformat(),
+        "mode": mode,
+        "created_by": created_by,
+        "created_at": now
+    }
+    update = {
+        "$setOnInsert": on_insert,
+        "$addToSet": {field: {"$each": values} for field, values in add_to_set.items()},
+        "$set": {"updated_at": now}
+    }
+    if max_fields:
+        update["$max"] = max_fields
+    query = {"class_id": class_id, "session_key": session_key}
+    for attempt in range(2):
+        try:
+            before = await _merge(db, query, update, upsert=True, new_record=on_insert)
+            return str(before["_id"] if before is not None else on_insert["_id"])
+        except DuplicateKeyError:
+            # Lost an upsert race with another writer; the record exists now
+            if attempt:
+                raise
+
+
+async def merge_into_attendance(db, attendance_id: str, add_to_set: Dict[str, List], max_fields: Optional[dict] = None) -> bool:
+    """Add students (and cameras) to an existing record; False if it does not exist"""
+    update = {
+        "$addToSet": {field: {"$each": values} for field, values in add_to_set.items()},
+        "$set": {"updated_at": datetime.utcnow()}
+    }
+    if max_fields:
+        update["$max"] = max_fields
+    return await _merge(db, {"_id": ObjectId(attendance_id)}, update, upsert=False) is not None
+
+
+async def set_present_students(db, attendance_id: str, present_students: List[str]) -> Optional[List[str]]:
+    """Replace a record's present students (corrections); returns the previous list"""
+    present_students = list(dict.fromkeys(present_students))
+    before = await db.attendance.find_one_and_update(
+        {"_id": ObjectId(attendance_id)},
+        {"$set": {"present_students": present_students, "updated_at": datetime.utcnow()}},
+        return_document=ReturnDocument.BEFORE,
+        projection=SUMMARY_FIELDS
+    )
+    if before is None:
+        return None
+    previous = before.get("present_students") or []
+    await _record_change(
+        db, before["_id"], before["class_id"], before.get("mode"), before.get("date"),
+        added=[s for s in present_students if s not in previous],
+        removed=[s for s in dict.fromkeys(previous) if s not in present_students]
+    )
+    return previous
+
+
+async def delete_attendance(db, attendance_id: str) -> bool:
+    record = await db.attendance.find_one_and_delete({"_id": ObjectId(attendance_id)}, projection=SUMMARY_FIELDS)
+    if record is None:
+        return False
+    await _record_change(
+        db, record["_id"], record["class_id"], record.get("mode"), record.get("date"),
+        sessions=-1, removed=record.get("present_students") or []
+    )
+    return True
@@ -0,0 +1,178 @@
+import asyncio
+import base64
+import logging
+import os
+import shutil
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from app.config import settings
+from app.services.encoder_profiles import encoder_registry
+from app.services.face_workers import detect_faces, encode_faces, get_process_pool, merge_detections, tile_image
+from app.services.gallery_cache import gallery_cache
+from app.services.jobs import job_manager
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = {".mp4", ".avi", ".mov", ".mkv", ".webm", ".m4v", ".3gp"}
+
+
+def is_video_upload(filename: str, content_type: Optional[str]) -> bool:
+    if content_type and content_type.startswith("video/"):
+        return True
+    return os.path.splitext(filename or "")[1].lower() in VIDEO_EXTENSIONS
+
+
+def _face_crop(frame: np.ndarray, location: Tuple[int, int, int, int]) -> Optional[str]:
+    top, right, bottom, left = location
+    crop = frame[max(top, 0):bottom, max(left, 0):right]
+    if crop.size == 0:
+        return None
+    scale = 96 / max(crop.shape[:2])
+    if scale < 1:
+        crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode(".jpg", crop, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return f"data:image/jpeg;base64,{base64.b64encode(buffer).decode('utf-8')}" if ok else None
+
+
+def _open_video(path: str) -> Tuple[cv2.VideoCapture, int, int]:
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        capture.release()
+        raise IOError("Could not open video")
+    source_fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    step = max(1, int(round(source_fps / settings.batch_video_sample_fps)))
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    samples = min(frame_count // step + 1, settings.batch_max_video_frames) if frame_count else settings.batch_max_video_frames
+    return capture, step, samples
+
+
+def _next_video_sample(capture: cv2.VideoCapture, step: int) -> Optional[np.ndarray]:
+    for _ in range(step - 1):
+        if not capture.grab():
+            return None
+    ok, frame = capture.read()
+    return frame if ok else None
+
+
+async def _detect_and_encode(frame: np.ndarray, version: str) -> List[Tuple[Tuple[int, int, int, int], np.ndarray]]:
+    """Tiled detection in parallel across the worker pool, then encoding of the merged faces"""
+    loop = asyncio.get_event_loop()
+    pool = get_process_pool()
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    height, width = rgb.shape[:2]
+    tiles = tile_image(height, width, settings.batch_tile_size, settings.batch_tile_overlap)
+    detections = await asyncio.gather(*[
+        loop.run_in_executor(pool, detect_faces, np.ascontiguousarray(rgb[top:bottom, left:right]), (top, left), settings.batch_detection_upsample)
+        for top, bottom, left, right in tiles
+    ])
+    locations = merge_detections([loc for tile_locations in detections for loc in tile_locations])
+    encodings = await loop.run_in_executor(pool, encode_faces, rgb, locations, 1, encoder_registry.profile(version)["encoding_model"])
+    return list(zip(locations, encodings))
+
+
+async def run_batch_attendance(job_id: str, class_id: str, enrolled_students: List[str], files: List[dict], job_dir: str) -> dict:
+    """Detect and match every face in uploaded photos and sampled video frames.
+
+    Produces a draft attendance record (not yet written to ``attendance``)
+    and a per-face evidence report: the best sighting of each recognized
+    student plus a capped list of faces that matched nobody.
+    """
+    loop = asyncio.get_event_loop()
+    try:
+        gallery = await loop.run_in_executor(None, gallery_cache.get, class_id, enrolled_students)
+        index = gallery.index
+
+        videos = {}
+        total = 0
+        for item in files:
+            if item["kind"] == "video":
+                try:
+                    videos[item["path"]] = await loop.run_in_executor(None, _open_video, item["path"])
+                    total += videos[item["path"]][2]
+                except IOError:
+                    item["error"] = "Could not open video"
+            else:
+                total += 1
+        await job_manager.progress(job_id, 0, total)
+
+        best_sightings: Dict[str, dict] = {}
+        unknown_faces: List[dict] = []
+        max_faces_in_frame = 0
+        processed = 0
+        file_reports = []
+
+        async def handle_frame(frame: np.ndarray, source: str, frame_index: Optional[int], timestamp: Optional[float]) -> int:
+            nonlocal max_faces_in_frame
+            faces = await _detect_and_encode(frame, gallery.version)
+            max_faces_in_frame = max(max_faces_in_frame, len(faces))
+            for location, encoding in faces:
+                student_id, distance = index.match(encoding)
+                top, right, bottom, left = location
+                evidence = {
+                    "source": source,
+                    "frame": frame_index,
+                    "timestamp": timestamp,
+                    "box": {"x": int(left), "y": int(top), "width": int(right - left), "height": int(bottom - top)},
+                    "student_id": student_id,
+                    "recognized": student_id is not None,
+                    "distance": round(distance, 4) if distance is not None else None
+                }
+                if student_id is not None:
+                    current = best_sightings.get(student_id)
+                    if current is None or distance < current["distance"]:
+                        evidence["face_crop"] = _face_crop(frame, location)
+                        best_sightings[student_id] = evidence
+                elif len(unknown_faces) < settings.batch_max_unknown_evidence:
+                    evidence["face_crop"] = _face_crop(frame, location)
+                    unknown_faces.append(evidence)
+            return len(faces)
+
+        for item in files:
+            report = {"filename": item["filename"], "kind": item["kind"], "frames": 0, "faces": 0, "error": item.get("error")}
+            file_reports.append(report)
+            if report["error"]:
+                continue
+            if item["kind"] == "video":
+                capture, step, samples = videos[item["path"]]
+                source_fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+                try:
+                    for sample_index in range(samples):
+                        frame = await loop.run_in_executor(None, _next_video_sample, capture, step)
+                        if frame is None:
+                            break
+                        frame_index = sample_index * step + step - 1
+                        report["faces"] += await handle_frame(frame, item["filename"], frame_index, round(frame_index / source_fps, 2))
+                        report["frames"] += 1
+                        processed += 1
+                        await job_manager.progress(job_id, processed)
+                finally:
+                    capture.release()
+            else:
+                frame = await loop.run_in_executor(None, cv2.imread, item["path"], cv2.IMREAD_COLOR)
+                if frame is None:
+                    report["error"] = "Could not decode image"
+                else:
+                    report["faces"] += await handle_frame(frame, item["filename"], None, None)
+                    report["frames"] = 1
+                processed += 1
+                await job_manager.progress(job_id, processed)
+
+        present = sorted(best_sightings)
+        return {
+            "draft": {
+                "class_id": class_id,
+                "mode": "auto",
+                "present_students": present,
+                "recognized_students": present,
+                "total_faces_detected": max_faces_in_frame,
+                "total_faces_recognized": len(present)
+            },
+            "evidence": [best_sightings[sid] for sid in present] + unknown_faces,
+            "files": file_reports,
+            "attendance_id": None
+        }
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
@@ -0,0 +1,95 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+from typing import Optional
+
+from PIL import Image, ImageOps
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class BlobStore:
+    """Content-addressed local file store for uploaded images.
+
+    A blob is stored under its SHA-256 (``ab/cdef...``), so writing the same
+    bytes twice is a no-op and the digest doubles as a strong ETag. A JPEG
+    thumbnail is generated alongside each image when it is first stored.
+    """
+
+    def __init__(self, root: str, thumbnail_size: int):
+        self.root = root
+        self.thumbnail_size = thumbnail_size
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def digest(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def thumbnail_path(self, digest: str) -> str:
+        return os.path.join(self.root, "thumbs", digest[:2], f"{digest[2:]}.jpg")
+
+    @staticmethod
+    def media_type(content: bytes) -> str:
+        """MIME type from the image header, without decoding pixels"""
+        try:
+            return Image.MIME.get(Image.open(io.BytesIO(content)).format, "application/octet-stream")
+        except Exception:
+            return "application/octet-stream"
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _render_thumbnail(self, content: bytes) -> Optional[bytes]:
+        try:
+            image = ImageOps.exif_transpose(Image.open(io.BytesIO(content))).convert("RGB")
+        except Exception as e:
+            logger.warning(f"Could not build thumbnail: {e}")
+            return None
+        image.thumbnail((self.thumbnail_size, self.thumbnail_size))
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=80)
+        return buffer.getvalue()
+
+    def put(self, content: bytes) -> str:
+        """Store bytes (and their thumbnail) if not already present; returns the digest"""
+        digest = self.digest(content)
+        if self.exists(digest):
+            return digest
+        thumbnail = self._render_thumbnail(content)
+        with self._lock:
+            if thumbnail is not None:
+                self._write(self.thumbnail_path(digest), thumbnail)
+            self._write(self.path(digest), content)
+        return digest
+
+    def read(self, digest: str) -> Optional[bytes]:
+        try:
+            with open(self.path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, digest: str):
+        for path in (self.path(digest), self.thumbnail_path(digest)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+blob_store = BlobStore(settings.blob_store_dir, settings.thumbnail_size)
@@ -0,0 +1,53 @@
+"""Completion flags of derived collections, kept in ``system_settings``.
+
+A derived collection (the attendance summary, the daily rollups) can only
+be trusted after a full rebuild has run with the current settings. The
+rebuild records ``built_at`` and those settings under the collection's
+``system_settings`` id; readers check the flag and, while it is not set,
+look again every ``READY_RECHECK_SECONDS`` in case another process has
+completed a rebuild.
+"""
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# How often a process that has not seen a completed rebuild checks again
+READY_RECHECK_SECONDS = 60.0
+
+
+class BuildState:
+    def __init__(self, state_id: str, not_built_message: str, **expected: Any):
+        self.state_id = state_id
+        self.not_built_message = not_built_message
+        # Settings the build must have been made with, e.g. its timezone
+        self.expected: Dict[str, Any] = expected
+        self.ready = False
+        self._checked_at = 0.0
+
+    async def load(self, db) -> Optional[dict]:
+        doc = await db.system_settings.find_one({"_id": self.state_id})
+        mismatched = {key: (doc or {}).get(key) for key, value in self.expected.items() if (doc or {}).get(key) != value}
+        self.ready = bool(doc and doc.get("built_at") and not mismatched)
+        self._checked_at = time.monotonic()
+        if doc and doc.get("built_at") and mismatched:
+            logger.warning(f"{self.state_id} was built with {mismatched}, not {self.expected}; rebuild it")
+        elif not self.ready:
+            logger.warning(self.not_built_message)
+        return doc
+
+    async def is_ready(self, db) -> bool:
+        if not self.ready and time.monotonic() - self._checked_at > READY_RECHECK_SECONDS:
+            await self.load(db)
+        return self.ready
+
+    async def mark_built(self, db, **fields: Any):
+        """Record a completed full rebuild (with ``fields`` as build statistics)"""
+        await db.system_settings.update_one(
+            {"_id": self.state_id},
+            {"$set": {"built_at": datetime.utcnow(), **self.expected, **fields}},
+            upsert=True
+        )
+        self.ready = True
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from app.config import settings
+from app.services.attendance_session import AttendanceSession, attendance_session_manager
+from app.utils.metrics import recognition_metrics, timed
+
+logger = logging.getLogger(__name__)
+
+
+class CameraIngestionWorker:
+    """Pulls frames from a camera URL (MJPEG/RTSP/HTTP) or a local video file
+    with cv2.VideoCapture and feeds them into a class attendance session.
+
+    Live sources are grabbed continuously so the decoder buffer never goes
+    stale, and only one frame per 1/sample_fps seconds is decoded and
+    recognized. Video files are stepped through at the same sampling rate
+    (based on the file's own fps) as fast as recognition allows, which makes
+    a recorded clip a stand-in for a classroom camera.
+    """
+
+    def __init__(self, class_id: str, camera_id: str, source: str, session: AttendanceSession, sample_fps: float, mode: str = "auto"):
+        self.class_id = class_id
+        self.mode = mode
+        self.camera_id = camera_id
+        self.source = source
+        self.session = session
+        self.sample_fps = max(sample_fps, 0.1)
+        self.is_file = os.path.isfile(source)
+        self.status = "starting"
+        self.error: Optional[str] = None
+        self.frames_sampled = 0
+        self.frames_with_faces = 0
+        self.started_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+        self._stop = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def _open(self) -> cv2.VideoCapture:
+        capture = cv2.VideoCapture(int(self.source) if self.source.isdigit() else self.source)
+        if not capture.isOpened():
+            capture.release()
+            raise IOError(f"Could not open video source: {self.source}")
+        return capture
+
+    def _next_file_frame(self, capture: cv2.VideoCapture) -> Optional[np.ndarray]:
+        source_fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        step = max(1, int(round(source_fps / self.sample_fps)))
+        # grab() skips frames without decoding them
+        for _ in range(step - 1):
+            if not capture.grab():
+                return None
+        ok, frame = capture.read()
+        return frame if ok else None
+
+    def _next_live_frame(self, capture: cv2.VideoCapture, due_at: float) -> Optional[np.ndarray]:
+        while time.monotonic() < due_at:
+            if self._stop.is_set() or not capture.grab():
+                return None
+        ok, frame = capture.retrieve()
+        return frame if ok else None
+
+    def _recognize(self, frame: np.ndarray) -> Tuple[List[str], int]:
+        timings: Dict[str, float] = {}
+        with timed(timings, "total"):
+            recognized_ids, total_detected, _, _ = self.session.identify(frame, self.mode, timings)
+        recognition_metrics.record_frame("camera", timings)
+        return recognized_ids, total_detected
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        interval = 1.0 / self.sample_fps
+        capture = None
+        try:
+            while not self._stop.is_set():
+                if capture is None:
+                    try:
+                        capture = await loop.run_in_executor(None, self._open)
+                        self.status = "running"
+                    except IOError as e:
+                        if self.is_file:
+                            raise
+                        self.status = "reconnecting"
+                        self.error = str(e)
+                        logger.warning(f"Camera {self.camera_id} for class {self.class_id}: {e}; retrying")
+                        await asyncio.sleep(settings.camera_reconnect_seconds)
+                        continue
+
+                if self.is_file:
+                    frame = await loop.run_in_executor(None, self._next_file_frame, capture)
+                else:
+                    frame = await loop.run_in_executor(None, self._next_live_frame, capture, time.monotonic() + interval)
+
+                if frame is None:
+                    if self.is_file or self._stop.is_set():
+                        break
+                    # Live stream dropped; reopen it
+                    capture.release()
+                    capture = None
+                    continue
+
+                recognized_ids, total_detected = await loop.run_in_executor(None, self._recognize, frame)
+                self.frames_sampled += 1
+                if total_detected > 0:
+                    self.frames_with_faces += 1
+                new_students = self.session.record_frame(self.camera_id, recognized_ids, total_detected)
+                if new_students:
+                    logger.info(f"Camera {self.camera_id} recognized {new_students} in class {self.class_id}")
+            self.status = "stopped" if self._stop.is_set() else "finished"
+        except asyncio.CancelledError:
+            self.status = "stopped"
+            raise
+        except Exception as e:
+            logger.error(f"Camera ingestion failed for class {self.class_id} ({self.camera_id}): {e}", exc_info=True)
+            self.status = "failed"
+            self.error = str(e)
+        finally:
+            if capture is not None:
+                capture.release()
+            self.finished_at = datetime.utcnow()
+            attendance_session_manager.detach(self.class_id, self.camera_id)
+            logger.info(f"Camera {self.camera_id} for class {self.class_id} {self.status}: {self.frames_sampled} frames sampled, {self.frames_with_faces} with faces")
+
+    def stop(self):
+        self._stop.set()
+
+    def summary(self) -> dict:
+        return {
+            "class_id": self.class_id,
+            "camera_id": self.camera_id,
+            "source": self.source,
+            "source_type": "file" if self.is_file else "stream",
+            "mode": self.mode,
+            "sample_fps": self.sample_fps,
+            "status": self.status,
+            "error": self.error,
+            "frames_sampled": self.frames_sampled,
+            "frames_with_faces": self.frames_with_faces,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+def resolve_source(cls: dict, camera_id: Optional[str] = None, video: Optional[str] = None) -> Tuple[str, str]:
+    """(camera_id, source) for an ingest request, limited to what an admin configured.
+
+    Cameras come from the class's ``cameras`` map (or its ``camera_url`` as
+    camera "default"); video files must lie inside ``settings.camera_video_dir``.
+    Raises ValueError for a missing source and PermissionError for anything
+    outside those.
+    """
+    if video:
+        root = os.path.realpath(settings.camera_video_dir)
+        path = os.path.realpath(os.path.join(root, video))
+        if os.path.commonpath([root, path]) != root:
+            raise PermissionError("Video files must be inside the configured videos directory")
+        if not os.path.isfile(path):
+            raise ValueError(f"Video file not found: {video}")
+        return camera_id or f"file-{os.path.basename(path)}", path
+    cameras = dict(cls.get("cameras") or {})
+    if cls.get("camera_url"):
+        cameras.setdefault("default", cls["camera_url"])
+    if camera_id is None:
+        if not cameras:
+            raise ValueError("No camera is configured for this class")
+        camera_id = "default" if "default" in cameras else next(iter(cameras))
+    if camera_id not in cameras:
+        raise PermissionError(f"Camera {camera_id} is not configured for this class")
+    return camera_id, str(cameras[camera_id])
+
+
+class CameraIngestionManager:
+    """Keeps track of server-side camera workers per class"""
+
+    def __init__(self):
+        self.workers: Dict[Tuple[str, str], CameraIngestionWorker] = {}
+
+    def start(
+        self,
+        class_id: str,
+        enrolled_students: List[str],
+        camera_id: str,
+        source: str,
+        sample_fps: Optional[float] = None,
+        session_key: Optional[str] = None,
+        mode: str = "auto"
+    ) -> CameraIngestionWorker:
+        existing = self.workers.get((class_id, camera_id))
+        if existing is not None and existing.finished_at is None:
+            raise ValueError(f"Camera {camera_id} is already ingesting for this class")
+        session = attendance_session_manager.attach(class_id, enrolled_students, camera_id, session_key, mode)
+        worker = CameraIngestionWorker(class_id, camera_id, source, session, sample_fps or settings.camera_sample_fps, mode)
+        worker.task = asyncio.ensure_future(worker.run())
+        self.workers[(class_id, camera_id)] = worker
+        return worker
+
+    def stop(self, class_id: str, camera_id: str) -> Optional[CameraIngestionWorker]:
+        worker = self.workers.get((class_id, camera_id))
+        if worker is not None:
+            worker.stop()
+        return worker
+
+    def for_class(self, class_id: str) -> List[CameraIngestionWorker]:
+        return [worker for (cid, _), worker in self.workers.items() if cid == class_id]
+
+    async def shutdown(self):
+        for worker in self.workers.values():
+            worker.stop()
+        tasks = [worker.task for worker in self.workers.values() if worker.task is not None]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+camera_ingestion_manager = CameraIngestionManager()
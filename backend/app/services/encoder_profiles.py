@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Encodings from different profiles are not comparable, so a profile is never
+# edited once it has been used: add a new version instead and re-encode.
+# ``v1`` is the pipeline the system has always used.
+ENCODER_PROFILES = {
+    "v1": {"detection_model": "hog", "upsample": 1, "encoding_model": "small", "num_jitters": 1},
+    "v2": {"detection_model": "hog", "upsample": 1, "encoding_model": "large", "num_jitters": 2},
+}
+
+LEGACY_VERSION = "v1"
+
+ACTIVE_VERSION_ID = "active_encoder"
+
+
+class EncoderRegistry:
+    """Which encoder profile version galleries and new uploads currently use.
+
+    The version lives in the ``system_settings`` collection. Each server
+    process caches it for the hot paths and re-reads it every
+    ``encoder_version_poll_seconds``, so an activation made by another
+    worker is picked up within that interval. Face worker processes never
+    read it: they are handed the profile with every task.
+    """
+
+    def __init__(self, default_version: str, poll_seconds: float):
+        self.active_version = default_version
+        self.poll_seconds = poll_seconds
+        self.task: Optional[asyncio.Task] = None
+
+    def profile(self, version: Optional[str] = None) -> dict:
+        version = version or self.active_version
+        if version not in ENCODER_PROFILES:
+            raise ValueError(f"Unknown encoder profile version: {version}")
+        return {"version": version, "max_side": settings.training_image_max_side, **ENCODER_PROFILES[version]}
+
+    async def load(self, db):
+        doc = await db.system_settings.find_one({"_id": ACTIVE_VERSION_ID})
+        if doc and doc.get("version") in ENCODER_PROFILES and doc["version"] != self.active_version:
+            self.active_version = doc["version"]
+            logger.info(f"Active face encoder profile: {self.active_version}")
+
+    def start(self, db):
+        """Keep re-reading the active version in the background"""
+        logger.info(f"Active face encoder profile: {self.active_version}")
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._poll(db))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _poll(self, db):
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                await self.load(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Reading the active encoder profile failed: {e}")
+
+    async def activate(self, db, version: str, job_id: Optional[str] = None):
+        """Point new galleries and uploads at ``version`` with a single write"""
+        self.profile(version)
+        await db.system_settings.update_one(
+            {"_id": ACTIVE_VERSION_ID},
+            {"$set": {"version": version, "previous_version": self.active_version, "job_id": job_id, "switched_at": datetime.utcnow()}},
+            upsert=True
+        )
+        self.active_version = version
+        logger.info(f"Switched face encoder profile to {version}")
+
+
+encoder_registry = EncoderRegistry(
+    settings.encoder_version if settings.encoder_version in ENCODER_PROFILES else LEGACY_VERSION,
+    settings.encoder_version_poll_seconds
+)
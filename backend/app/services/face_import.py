@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import os
+import posixpath
+import zipfile
+from collections import OrderedDict
+from datetime import datetime
+from typing import List
+
+from pymongo import UpdateOne
+
+from app.config import settings
+from app.database import get_database
+from app.services.encoder_profiles import encoder_registry
+from app.services.face_recognition import face_recognition_service
+from app.services.face_samples import build_samples, release_blobs, store_blobs
+from app.services.face_workers import encode_training_images
+from app.services.gallery_cache import gallery_cache
+from app.services.jobs import job_manager
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def list_archive_students(archive_path: str) -> "OrderedDict[str, List[zipfile.ZipInfo]]":
+    """Group image members by their parent folder, which is the student id.
+
+    Only the central directory is read here; member data is read one file
+    at a time while importing.
+    """
+    students: "OrderedDict[str, List[zipfile.ZipInfo]]" = OrderedDict()
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            parts = [p for p in posixpath.normpath(info.filename).split("/") if p]
+            if len(parts) < 2 or any(p.startswith(".") or p == "__MACOSX" for p in parts):
+                continue
+            if posixpath.splitext(parts[-1])[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            if info.file_size > settings.bulk_import_max_image_bytes:
+                logger.warning(f"Skipping oversized archive member {info.filename}")
+                continue
+            students.setdefault(parts[-2], []).append(info)
+    return students
+
+
+def _read_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> bytes:
+    # ZipFile serializes seeks on the shared handle, so threads can read members concurrently
+    with archive.open(info) as member:
+        return member.read(settings.bulk_import_max_image_bytes + 1)
+
+
+async def _import_student(archive: zipfile.ZipFile, members: List[zipfile.ZipInfo], semaphore: asyncio.Semaphore, version: str) -> dict:
+    loop = asyncio.get_event_loop()
+
+    async def encode_one(info: zipfile.ZipInfo):
+        async with semaphore:
+            content = await loop.run_in_executor(None, _read_member, archive, info)
+            outcome = (await encode_training_images([content], version))[0]
+            return (posixpath.basename(info.filename), content), outcome
+
+    results = await asyncio.gather(*[encode_one(info) for info in members])
+    uploads = [upload for upload, _ in results]
+    docs, encodings, _ = build_samples(uploads, [outcome for _, outcome in results])
+    await store_blobs(uploads, docs)
+    return {"samples": docs, "encodings": encodings, "total_images": len(results)}
+
+
+async def _import_batches(db, job_oid, archive, archive_students, pending, known_ids, completed, semaphore, batch_size):
+    loop = asyncio.get_event_loop()
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        version = encoder_registry.active_version
+        imports = await asyncio.gather(*[_import_student(archive, archive_students[sid], semaphore, version) for sid in batch])
+        previous = await db.face_images.find({"student_id": {"$in": batch}}, {"samples.blob": 1}).to_list(length=None)
+
+        now = datetime.utcnow()
+        face_image_ops, user_ops, student_results = [], [], []
+        for student_id, imported in zip(batch, imports):
+            result = {
+                "student_id": student_id,
+                "total_images": imported["total_images"],
+                "faces_detected": len(imported["encodings"]),
+                "status": "ok" if imported["encodings"] else "no_faces"
+            }
+            student_results.append(result)
+            if not imported["encodings"]:
+                continue
+            face_data_path = await loop.run_in_executor(
+                None, face_recognition_service.save_face_samples, student_id, imported["encodings"], version
+            )
+            gallery_cache.update_student(student_id, list(imported["encodings"].values()), version)
+            face_image_ops.append(UpdateOne(
+                {"student_id": student_id},
+                {
+                    "$set": {"student_id": student_id, "samples": imported["samples"], "updated_at": now},
+                    "$unset": {"images": ""},
+                    "$setOnInsert": {"created_at": now}
+                },
+                upsert=True
+            ))
+            user_ops.append(UpdateOne(
+                {"student_id": student_id},
+                {"$set": {
+                    "face_data_path": face_data_path,
+                    "has_face_data": True,
+                    "face_sample_count": len(imported["encodings"]),
+                    "face_data_updated_at": now,
+                    "updated_at": now
+                }}
+            ))
+
+        if face_image_ops:
+            await db.face_images.bulk_write(face_image_ops, ordered=False)
+            await db.users.bulk_write(user_ops, ordered=False)
+            await release_blobs(db, [s["blob"] for doc in previous for s in doc.get("samples", []) if "blob" in s])
+        completed.update(batch)
+        await db.jobs.update_one(
+            {"_id": job_oid},
+            {
+                "$addToSet": {"completed_students": {"$each": batch}},
+                "$push": {"student_results": {"$each": student_results}},
+                "$set": {"progress.processed": len(completed & known_ids), "updated_at": datetime.utcnow()}
+            }
+        )
+
+
+async def run_bulk_face_import(job_id: str) -> dict:
+    """Import a ``student_id/*.jpg`` ZIP archive, resuming after the last checkpoint.
+
+    Students are processed in batches of ``bulk_import_batch_size``; each
+    batch fans its images out across the worker pool, then writes the
+    encodings, the face_images/users updates and the job checkpoint together.
+    """
+    db = get_database()
+    loop = asyncio.get_event_loop()
+    job = await job_manager.get(job_id)
+    archive_path = job["params"]["archive_path"]
+    completed = set(job.get("completed_students", []))
+
+    archive_students = await loop.run_in_executor(None, list_archive_students, archive_path)
+    known = await db.users.find(
+        {"student_id": {"$in": list(archive_students)}, "role": "student"},
+        {"student_id": 1}
+    ).to_list(length=None)
+    known_ids = {user["student_id"] for user in known}
+    unknown_ids = [sid for sid in archive_students if sid not in known_ids]
+    pending = [sid for sid in archive_students if sid in known_ids and sid not in completed]
+
+    total = len(known_ids)
+    await job_manager.progress(job_id, len(completed & known_ids), total, unknown_students=unknown_ids)
+
+    semaphore = asyncio.Semaphore(max(2, (settings.face_worker_processes or os.cpu_count() or 1) * 2))
+    batch_size = max(1, settings.bulk_import_batch_size)
+    archive = zipfile.ZipFile(archive_path)
+    try:
+        await _import_batches(db, job["_id"], archive, archive_students, pending, known_ids, completed, semaphore, batch_size)
+    finally:
+        archive.close()
+
+    job = await job_manager.get(job_id)
+    student_results = job.get("student_results", [])
+    try:
+        os.remove(archive_path)
+    except OSError:
+        pass
+    return {
+        "students_imported": sum(1 for r in student_results if r["status"] == "ok"),
+        "students_without_faces": [r["student_id"] for r in student_results if r["status"] != "ok"],
+        "unknown_students": unknown_ids,
+        "total_students": total
+    }
@@ -3,8 +3,10 @@ import cv2
 import numpy as np
 import os
 import pickle
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 from app.config import settings
+from app.services.encoder_profiles import LEGACY_VERSION, encoder_registry
+from app.utils.metrics import timed
 
 class FaceRecognitionService:
     def __init__(self):
@@ -18,13 +20,44 @@ class FaceRecognitionService:
             pickle.dump(encodings, f)
         return file_path
     
-    def load_face_encodings(self, student_id: str) -> Optional[List[np.ndarray]]:
-        """Load face encodings for a student"""
-        file_path = os.path.join(self.face_data_dir, f"{student_id}.pkl")
+    def face_data_path(self, student_id: str, version: Optional[str] = None) -> str:
+        """Pickle path for an encoder version; the original version keeps the flat layout"""
+        version = version or encoder_registry.active_version
+        if version == LEGACY_VERSION:
+            return os.path.join(self.face_data_dir, f"{student_id}.pkl")
+        return os.path.join(self.face_data_dir, version, f"{student_id}.pkl")
+    
+    def save_face_samples(self, student_id: str, samples: Dict[str, np.ndarray], version: Optional[str] = None):
+        """Save face encodings keyed by sample id, replacing the file atomically"""
+        file_path = self.face_data_path(student_id, version)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(dict(samples), f)
+        os.replace(tmp_path, file_path)
+        return file_path
+    
+    def load_face_samples(self, student_id: str, version: Optional[str] = None) -> Optional[Dict[str, np.ndarray]]:
+        """Load face encodings keyed by sample id.
+        
+        Files written by ``save_face_encodings`` hold a plain list; those
+        entries get ``legacy-<index>`` ids.
+        """
+        file_path = self.face_data_path(student_id, version)
         if not os.path.exists(file_path):
             return None
         with open(file_path, 'rb') as f:
-            return pickle.load(f)
+            data = pickle.load(f)
+        if isinstance(data, dict):
+            return data
+        return {f"legacy-{i}": encoding for i, encoding in enumerate(data)}
+    
+    def load_face_encodings(self, student_id: str, version: Optional[str] = None) -> Optional[List[np.ndarray]]:
+        """Load face encodings for a student"""
+        samples = self.load_face_samples(student_id, version)
+        if samples is None:
+            return None
+        return list(samples.values())
     
     def encode_face_from_image(self, image_path: str) -> Optional[np.ndarray]:
         """Encode a single face from an image file path"""
@@ -34,13 +67,13 @@ class FaceRecognitionService:
             return face_encodings[0]
         return None
     
-    def encode_face_from_bytes(self, image_bytes: bytes) -> Optional[np.ndarray]:
+    def encode_face_from_bytes(self, image_bytes: bytes, version: Optional[str] = None) -> Optional[np.ndarray]:
         """Encode a single face from image bytes"""
         import io
         from PIL import Image
         image = Image.open(io.BytesIO(image_bytes))
         image_array = np.array(image)
-        face_encodings = face_recognition.face_encodings(image_array)
+        face_encodings = face_recognition.face_encodings(image_array, model=encoder_registry.profile(version)["encoding_model"])
         if len(face_encodings) > 0:
             return face_encodings[0]
         return None
@@ -54,7 +87,35 @@ class FaceRecognitionService:
                 encodings.append(encoding)
         return encodings
     
-    def recognize_faces_in_frame(self, frame: np.ndarray, known_encodings: dict) -> Tuple[List[str], int, int, List[dict]]:
+    def match_face(self, face_encoding: np.ndarray, known_encodings: dict, tolerance: float = 0.6) -> Tuple[Optional[str], Optional[float]]:
+        """Return the closest student within tolerance and its distance, or (None, closest distance)"""
+        best_match_score = 1.0
+        best_match_id = None
+        closest_distance = None
+        
+        for sid, known_encoding_list in known_encodings.items():
+            if not known_encoding_list or len(known_encoding_list) == 0:
+                continue
+            
+            face_distances = face_recognition.face_distance(known_encoding_list, face_encoding)
+            min_distance = float(min(face_distances))
+            if closest_distance is None or min_distance < closest_distance:
+                closest_distance = min_distance
+            
+            if min_distance <= tolerance and min_distance < best_match_score:
+                best_match_score = min_distance
+                best_match_id = sid
+        
+        return best_match_id, closest_distance
+    
+    def recognize_faces_in_frame(self, frame: np.ndarray, known_encodings: dict, version: Optional[str] = None, index=None, timings: Optional[Dict[str, float]] = None) -> Tuple[List[str], int, int, List[dict]]:
+        """Detect, encode and match every face in a BGR frame.
+        
+        ``index`` is an optional prebuilt ``GalleryIndex`` over ``known_encodings``
+        that matches each face with one vectorized distance computation.
+        When ``timings`` is given, the color_convert/detect/encode/match stage
+        durations (ms) are added to it.
+        """
         if frame is None or frame.size == 0:
             return [], 0, 0, []
         
@@ -62,15 +123,19 @@ class FaceRecognitionService:
             return [], 0, 0, []
         
         try:
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            with timed(timings, "color_convert"):
+                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         except Exception as e:
             import logging
             logging.getLogger(__name__).error(f"Error converting BGR to RGB: {e}")
             return [], 0, 0, []
         
         try:
-            face_locations = face_recognition.face_locations(rgb_frame, model="hog")
-            face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+            profile = encoder_registry.profile(version)
+            with timed(timings, "detect"):
+                face_locations = face_recognition.face_locations(rgb_frame, model=profile["detection_model"])
+            with timed(timings, "encode"):
+                face_encodings = face_recognition.face_encodings(rgb_frame, face_locations, model=profile["encoding_model"])
             
             if len(face_encodings) != len(face_locations):
                 import logging
@@ -113,22 +178,11 @@ class FaceRecognitionService:
                 student_id = None
                 
                 try:
-                    best_match_score = 1.0
-                    best_match_id = None
-                    
-                    for sid, known_encoding_list in known_encodings.items():
-                        if not known_encoding_list or len(known_encoding_list) == 0:
-                            continue
-                        
-                        matches = face_recognition.compare_faces(known_encoding_list, face_encoding, tolerance=0.6)
-                        
-                        if any(matches):
-                            face_distances = face_recognition.face_distance(known_encoding_list, face_encoding)
-                            min_distance = min(face_distances)
-                            
-                            if min_distance < best_match_score:
-                                best_match_score = min_distance
-                                best_match_id = sid
+                    with timed(timings, "match"):
+                        if index is not None:
+                            best_match_id, _ = index.match(face_encoding)
+                        else:
+                            best_match_id, _ = self.match_face(face_encoding, known_encodings)
                     
                     if best_match_id:
                         recognized_ids.append(best_match_id)
@@ -158,11 +212,11 @@ class FaceRecognitionService:
         
         return recognized_ids, total_detected, len(recognized_ids), face_detections
     
-    def load_all_face_encodings(self, student_ids: List[str]) -> dict:
+    def load_all_face_encodings(self, student_ids: List[str], version: Optional[str] = None) -> dict:
         """Load face encodings for multiple students"""
         encodings_dict = {}
         for student_id in student_ids:
-            encodings = self.load_face_encodings(student_id)
+            encodings = self.load_face_encodings(student_id, version)
             if encodings:
                 encodings_dict[student_id] = encodings
         return encodings_dict
@@ -0,0 +1,232 @@
+import asyncio
+import base64
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.services.blob_store import blob_store
+from app.services.encoder_profiles import encoder_registry
+from app.services.face_recognition import face_recognition_service
+from app.services.face_workers import encode_training_images
+from app.services.gallery_cache import gallery_cache
+
+logger = logging.getLogger(__name__)
+
+# One writer at a time per student so read-modify-write of the pickle is safe.
+# Entries are (lock, holders and waiters) and are dropped when nobody uses them.
+_student_locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+
+
+@asynccontextmanager
+async def _student_lock(student_id: str):
+    lock, users = _student_locks.get(student_id, (None, 0))
+    lock = lock or asyncio.Lock()
+    _student_locks[student_id] = (lock, users + 1)
+    try:
+        async with lock:
+            yield
+    finally:
+        lock, users = _student_locks[student_id]
+        if users == 1:
+            del _student_locks[student_id]
+        else:
+            _student_locks[student_id] = (lock, users - 1)
+
+
+def sample_id_for(content: bytes) -> str:
+    """Stable id of a training image: the prefix of its blob digest"""
+    return blob_store.digest(content)[:16]
+
+
+def build_samples(
+    uploads: List[Tuple[str, bytes]],
+    outcomes: List[dict],
+    existing: Optional[Dict[str, np.ndarray]] = None
+) -> Tuple[List[dict], Dict[str, np.ndarray], List[dict]]:
+    """Turn encoded uploads into new samples, skipping duplicates.
+
+    An upload is dropped when its bytes match a sample we already have, when
+    no face was found, or when its encoding is within
+    ``face_sample_dedup_distance`` of an existing or earlier-accepted
+    encoding (burst shots of the same pose add nothing to matching).
+    Returns (sample documents, {sample_id: encoding}, per-upload results).
+    """
+    existing = existing or {}
+    kept = list(existing.values())
+    new_docs, new_encodings, results = [], {}, []
+    now = datetime.utcnow()
+
+    for index, ((filename, content), outcome) in enumerate(zip(uploads, outcomes)):
+        sample_id = sample_id_for(content)
+        result = {"index": index, "filename": filename, "sample_id": sample_id, "status": outcome["status"], "faces": outcome["faces"]}
+        results.append(result)
+        if sample_id in existing or sample_id in new_encodings:
+            result["status"] = "duplicate_image"
+            continue
+        encoding = outcome["encoding"]
+        if encoding is None:
+            continue
+        if kept:
+            distance = float(np.linalg.norm(np.asarray(kept) - encoding, axis=1).min())
+            if distance < settings.face_sample_dedup_distance:
+                result["status"] = "duplicate_face"
+                result["distance"] = distance
+                continue
+        kept.append(encoding)
+        new_encodings[sample_id] = encoding
+        new_docs.append({
+            "sample_id": sample_id,
+            "filename": filename,
+            "blob": blob_store.digest(content),
+            "content_type": blob_store.media_type(content),
+            "size": len(content),
+            "created_at": now
+        })
+    return new_docs, new_encodings, results
+
+
+async def store_blobs(uploads: List[Tuple[str, bytes]], docs: List[dict]):
+    """Write the images behind freshly built sample documents to the blob store"""
+    loop = asyncio.get_event_loop()
+    wanted = {doc["blob"] for doc in docs}
+    contents = {blob_store.digest(content): content for _, content in uploads}
+    await asyncio.gather(*[
+        loop.run_in_executor(None, blob_store.put, contents[digest]) for digest in wanted if digest in contents
+    ])
+
+
+async def release_blobs(db, digests):
+    """Delete blobs that no face_images document refers to any more"""
+    loop = asyncio.get_event_loop()
+    for digest in set(digests):
+        if await db.face_images.count_documents({"samples.blob": digest}, limit=1) == 0:
+            await loop.run_in_executor(None, blob_store.delete, digest)
+
+
+async def _current_samples(db, student_id: str, version: str) -> Tuple[List[dict], Dict[str, np.ndarray], bool]:
+    """Current sample documents and encodings, migrating older layouts on first use.
+
+    Returns (docs, encodings, migrated); migrated docs still need storing.
+    Data written before samples existed is a list of base64 images plus an
+    unkeyed list of encodings, so the images are encoded once more to pair
+    each encoding with its image. Samples with an inline base64 ``image``
+    just have it moved to the blob store.
+    """
+    loop = asyncio.get_event_loop()
+    face_data = await db.face_images.find_one({"student_id": student_id})
+    if face_data is None:
+        return [], {}, False
+    if "samples" in face_data:
+        encodings = await loop.run_in_executor(None, face_recognition_service.load_face_samples, student_id, version) or {}
+        docs = face_data["samples"]
+        inline = [doc for doc in docs if "image" in doc]
+        if not inline:
+            return docs, encodings, False
+        for doc in inline:
+            content = base64.b64decode(doc.pop("image"))
+            doc["blob"] = await loop.run_in_executor(None, blob_store.put, content)
+            doc["content_type"] = blob_store.media_type(content)
+            doc["size"] = len(content)
+        return docs, encodings, True
+
+    uploads = [(None, base64.b64decode(image)) for image in face_data.get("images", [])]
+    outcomes = await encode_training_images([content for _, content in uploads], version)
+    docs, encodings, _ = build_samples(uploads, outcomes)
+    await store_blobs(uploads, docs)
+    logger.info(f"Migrated {len(uploads)} legacy face images of student {student_id} to {len(docs)} samples")
+    return docs, encodings, True
+
+
+async def _store_samples(db, student_id: str, docs: List[dict], encodings: Dict[str, np.ndarray], version: str) -> str:
+    loop = asyncio.get_event_loop()
+    face_data_path = await loop.run_in_executor(None, face_recognition_service.save_face_samples, student_id, encodings, version)
+    gallery_cache.update_student(student_id, list(encodings.values()), version)
+
+    now = datetime.utcnow()
+    await db.face_images.update_one(
+        {"student_id": student_id},
+        {
+            "$set": {"student_id": student_id, "samples": docs, "updated_at": now},
+            "$unset": {"images": ""},
+            "$setOnInsert": {"created_at": now}
+        },
+        upsert=True
+    )
+    await db.users.update_one(
+        {"student_id": student_id},
+        {"$set": {
+            "face_data_path": face_data_path,
+            "has_face_data": len(encodings) > 0,
+            "face_sample_count": len(encodings),
+            "face_data_updated_at": now,
+            "updated_at": now
+        }}
+    )
+    return face_data_path
+
+
+async def add_face_samples(db, student_id: str, uploads: List[Tuple[str, bytes]], replace: bool = False) -> dict:
+    """Encode only the uploaded images and append them to the student's samples.
+
+    With ``replace`` the uploads become the student's whole sample set, which
+    is what the original face-data upload does.
+    """
+    async with _student_lock(student_id):
+        version = encoder_registry.active_version
+        previous = await db.face_images.find_one({"student_id": student_id}, {"samples.blob": 1})
+        if replace:
+            docs, encodings, migrated = [], {}, False
+        else:
+            docs, encodings, migrated = await _current_samples(db, student_id, version)
+
+        known_ids = {doc["sample_id"] for doc in docs} | set(encodings)
+        to_encode = [(i, upload) for i, upload in enumerate(uploads) if sample_id_for(upload[1]) not in known_ids]
+        encoded = await encode_training_images([content for _, (_, content) in to_encode], version)
+        outcomes = [{"status": "duplicate_image", "faces": 0, "encoding": None}] * len(uploads)
+        for (i, _), outcome in zip(to_encode, encoded):
+            outcomes[i] = outcome
+
+        new_docs, new_encodings, results = build_samples(uploads, outcomes, encodings)
+        if new_docs or migrated:
+            await store_blobs(uploads, new_docs)
+            encodings = {**encodings, **new_encodings}
+            await _store_samples(db, student_id, docs + new_docs, encodings, version)
+            if replace and previous:
+                await release_blobs(db, [doc["blob"] for doc in previous.get("samples", []) if "blob" in doc])
+
+    return {
+        "added": [doc["sample_id"] for doc in new_docs],
+        "total_samples": len(encodings),
+        "results": results
+    }
+
+
+async def remove_face_sample(db, student_id: str, sample_id: str) -> Optional[int]:
+    """Drop one sample; returns the remaining sample count, or None if it did not exist"""
+    async with _student_lock(student_id):
+        version = encoder_registry.active_version
+        docs, encodings, _ = await _current_samples(db, student_id, version)
+        removed = [doc for doc in docs if doc["sample_id"] == sample_id]
+        if sample_id not in encodings and not removed:
+            return None
+        docs = [doc for doc in docs if doc["sample_id"] != sample_id]
+        encodings.pop(sample_id, None)
+        await _store_samples(db, student_id, docs, encodings, version)
+        await release_blobs(db, [doc["blob"] for doc in removed])
+    return len(encodings)
+
+
+async def list_samples(db, student_id: str) -> Optional[List[dict]]:
+    """Sample documents of a student (None if they have no face data), migrating older layouts"""
+    async with _student_lock(student_id):
+        if not await db.face_images.count_documents({"student_id": student_id}, limit=1):
+            return None
+        version = encoder_registry.active_version
+        docs, encodings, migrated = await _current_samples(db, student_id, version)
+        if migrated:
+            await _store_samples(db, student_id, docs, encodings, version)
+    return docs
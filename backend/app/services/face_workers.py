@@ -0,0 +1,125 @@
+"""Face detection and encoding helpers that run in worker processes.
+
+dlib holds the GIL for the whole detection/encoding call, so CPU-heavy
+batches go through a ProcessPoolExecutor. Everything submitted to the pool is
+a module-level function taking plain arguments so it can be pickled.
+"""
+import asyncio
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import face_recognition
+import numpy as np
+from PIL import Image, ImageOps
+
+from app.config import settings
+from app.services.encoder_profiles import encoder_registry
+
+logger = logging.getLogger(__name__)
+
+Location = Tuple[int, int, int, int]
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        workers = settings.face_worker_processes or os.cpu_count() or 1
+        _process_pool = ProcessPoolExecutor(max_workers=workers)
+        logger.info(f"Started face worker pool with {workers} processes")
+    return _process_pool
+
+
+def shutdown_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False)
+        _process_pool = None
+
+
+def tile_image(height: int, width: int, tile_size: int, overlap: int) -> List[Tuple[int, int, int, int]]:
+    """Split an image into overlapping (top, bottom, left, right) tiles"""
+    if height <= tile_size and width <= tile_size:
+        return [(0, height, 0, width)]
+    step = max(tile_size - overlap, 1)
+    tops = list(range(0, max(height - overlap, 1), step))
+    lefts = list(range(0, max(width - overlap, 1), step))
+    return [(top, min(top + tile_size, height), left, min(left + tile_size, width)) for top in tops for left in lefts]
+
+
+def detect_faces(rgb_tile: np.ndarray, offset: Tuple[int, int] = (0, 0), upsample: int = 1, model: str = "hog") -> List[Location]:
+    """Detect faces in a tile and return locations in full-image coordinates"""
+    off_y, off_x = offset
+    locations = face_recognition.face_locations(rgb_tile, number_of_times_to_upsample=upsample, model=model)
+    return [(top + off_y, right + off_x, bottom + off_y, left + off_x) for top, right, bottom, left in locations]
+
+
+def encode_faces(rgb: np.ndarray, locations: List[Location], num_jitters: int = 1, model: str = "small") -> List[np.ndarray]:
+    if not locations:
+        return []
+    return face_recognition.face_encodings(rgb, locations, num_jitters=num_jitters, model=model)
+
+
+def _overlap(a: Location, b: Location) -> float:
+    """Intersection over the smaller box, so a face cut by a tile edge merges with the full one"""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    if bottom <= top or right <= left:
+        return 0.0
+    inter = (bottom - top) * (right - left)
+    smaller = min((a[2] - a[0]) * (a[1] - a[3]), (b[2] - b[0]) * (b[1] - b[3]))
+    return inter / smaller if smaller > 0 else 0.0
+
+
+def merge_detections(locations: List[Location], threshold: float = 0.5) -> List[Location]:
+    """Drop duplicates found in overlapping tiles, keeping the larger box"""
+    kept: List[Location] = []
+    for loc in sorted(locations, key=lambda l: (l[2] - l[0]) * (l[1] - l[3]), reverse=True):
+        if all(_overlap(loc, other) < threshold for other in kept):
+            kept.append(loc)
+    return kept
+
+
+def encode_training_image(image_bytes: bytes, profile: dict) -> dict:
+    """Full training pipeline for one uploaded photo.
+
+    Decodes, applies the EXIF orientation (phone photos are often stored
+    sideways), converts to RGB, downscales so the longest side is at most
+    the profile's ``max_side`` and encodes the largest face in the picture
+    with the profile's detection and encoding models.
+    """
+    max_side = profile["max_side"]
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+    except Exception as e:
+        return {"status": "invalid_image", "error": str(e), "faces": 0, "encoding": None}
+
+    scale = max_side / max(image.size)
+    if scale < 1:
+        image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.BILINEAR)
+    rgb = np.asarray(image)
+
+    locations = face_recognition.face_locations(rgb, number_of_times_to_upsample=profile["upsample"], model=profile["detection_model"])
+    if not locations:
+        return {"status": "no_face", "faces": 0, "encoding": None}
+    largest = max(locations, key=lambda l: (l[2] - l[0]) * (l[1] - l[3]))
+    encodings = face_recognition.face_encodings(rgb, [largest], num_jitters=profile["num_jitters"], model=profile["encoding_model"])
+    if not encodings:
+        return {"status": "no_face", "faces": len(locations), "encoding": None}
+    return {"status": "ok", "faces": len(locations), "encoding": encodings[0]}
+
+
+async def encode_training_images(images: List[bytes], version: Optional[str] = None) -> List[dict]:
+    """Run ``encode_training_image`` for every image across the worker pool"""
+    loop = asyncio.get_event_loop()
+    pool = get_process_pool()
+    profile = encoder_registry.profile(version)
+    return await asyncio.gather(*[
+        loop.run_in_executor(pool, encode_training_image, content, profile)
+        for content in images
+    ])
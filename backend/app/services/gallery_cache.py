@@ -0,0 +1,177 @@
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.services.encoder_profiles import encoder_registry
+from app.services.face_recognition import face_recognition_service
+
+logger = logging.getLogger(__name__)
+
+
+class GalleryIndex:
+    """Every encoding of a gallery stacked into one matrix.
+
+    Matching a face is then a single vectorized distance computation instead
+    of one ``face_distance`` call per student.
+    """
+
+    def __init__(self, encodings: Dict[str, List[np.ndarray]]):
+        rows, owners = [], []
+        for student_id, student_encodings in encodings.items():
+            for encoding in student_encodings:
+                rows.append(encoding)
+                owners.append(student_id)
+        self.matrix = np.asarray(rows, dtype=np.float64) if rows else np.empty((0, 128))
+        self.squared_norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+        self.owners = owners
+
+    def __len__(self):
+        return len(self.owners)
+
+    def match(self, face_encoding: np.ndarray, tolerance: float = 0.6) -> Tuple[Optional[str], Optional[float]]:
+        """Same result as ``FaceRecognitionService.match_face`` over the indexed encodings"""
+        if not self.owners:
+            return None, None
+        # |a - b|^2 = |a|^2 - 2ab + |b|^2: one matrix-vector product, no N x 128 temporary
+        squared = self.squared_norms - 2.0 * (self.matrix @ face_encoding) + float(face_encoding @ face_encoding)
+        best = int(np.argmin(squared))
+        closest = float(np.sqrt(max(squared[best], 0.0)))
+        return (self.owners[best] if closest <= tolerance else None), closest
+
+
+class ClassGallery:
+    """Face encodings of the students enrolled in one class, all from one encoder version"""
+
+    def __init__(self, class_id: str, roster: FrozenSet[str], encodings: Dict[str, List[np.ndarray]], version: str):
+        self.class_id = class_id
+        self.roster = roster
+        self.version = version
+        self._index_lock = threading.Lock()
+        self.encodings = encodings
+        self.loaded_at = datetime.utcnow()
+
+    @property
+    def encodings(self) -> Dict[str, List[np.ndarray]]:
+        return self._encodings
+
+    @encodings.setter
+    def encodings(self, encodings: Dict[str, List[np.ndarray]]):
+        with self._index_lock:
+            self._encodings = encodings
+            self._index: Optional[GalleryIndex] = None
+
+    @property
+    def index(self) -> GalleryIndex:
+        """Stacked-matrix index of the current encodings, built on first use"""
+        with self._index_lock:
+            if self._index is None:
+                self._index = GalleryIndex(self._encodings)
+            return self._index
+
+    def __len__(self):
+        return len(self.encodings)
+
+
+class GalleryCache:
+    """Process-wide LRU cache of class galleries.
+
+    Every stream attached to a class shares the same gallery, so opening more
+    cameras or sessions does not load the encodings again. A gallery built
+    from an older encoder version is never returned once another version is
+    active; sessions already holding it keep a consistent (version,
+    encodings) pair until they end.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._galleries: "OrderedDict[str, ClassGallery]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, class_id: str, student_ids: List[str]) -> ClassGallery:
+        roster = frozenset(student_ids)
+        version = encoder_registry.active_version
+        with self._lock:
+            gallery = self._galleries.get(class_id)
+            if gallery is not None and gallery.roster == roster and gallery.version == version:
+                self._galleries.move_to_end(class_id)
+                return gallery
+
+        encodings = face_recognition_service.load_all_face_encodings(list(roster), version)
+        gallery = ClassGallery(class_id, roster, encodings, version)
+        logger.info(f"Loaded gallery for class {class_id}: {len(gallery)} of {len(roster)} students have encodings")
+
+        with self._lock:
+            self._galleries[class_id] = gallery
+            self._galleries.move_to_end(class_id)
+            while len(self._galleries) > self.max_size:
+                self._galleries.popitem(last=False)
+        return gallery
+
+    def is_warm(self, class_id: str, student_ids: List[str]) -> bool:
+        """Whether ``get`` would be served from memory"""
+        with self._lock:
+            gallery = self._galleries.get(class_id)
+            return (
+                gallery is not None
+                and gallery.roster == frozenset(student_ids)
+                and gallery.version == encoder_registry.active_version
+            )
+
+    def snapshot(self) -> List[dict]:
+        with self._lock:
+            galleries = list(self._galleries.values())
+        return [
+            {
+                "class_id": gallery.class_id,
+                "version": gallery.version,
+                "students": len(gallery.roster),
+                "students_with_encodings": len(gallery),
+                "loaded_at": gallery.loaded_at
+            }
+            for gallery in galleries
+        ]
+
+    def peek(self, class_id: str) -> Optional[ClassGallery]:
+        with self._lock:
+            return self._galleries.get(class_id)
+
+    def invalidate(self, class_id: Optional[str] = None):
+        """Drop one class gallery, or all of them when class_id is None"""
+        with self._lock:
+            if class_id is None:
+                self._galleries.clear()
+            else:
+                self._galleries.pop(class_id, None)
+
+    def update_student(self, student_id: str, encodings: List[np.ndarray], version: Optional[str] = None):
+        """Swap one student's encodings into every cached gallery that contains them.
+
+        The encodings dict is replaced rather than mutated so frames being
+        recognized on other threads keep a consistent view.
+        """
+        version = version or encoder_registry.active_version
+        with self._lock:
+            for gallery in self._galleries.values():
+                if student_id not in gallery.roster or gallery.version != version:
+                    continue
+                updated = dict(gallery.encodings)
+                if encodings:
+                    updated[student_id] = list(encodings)
+                else:
+                    updated.pop(student_id, None)
+                gallery.encodings = updated
+
+    def invalidate_student(self, student_id: str):
+        """Drop every cached gallery that contains the given student"""
+        with self._lock:
+            stale = [cid for cid, gallery in self._galleries.items() if student_id in gallery.roster]
+            for cid in stale:
+                del self._galleries[cid]
+
+
+gallery_cache = GalleryCache(max_size=settings.gallery_cache_size)
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from app.config import settings
+from app.database import get_database
+from app.services.gallery_cache import gallery_cache
+from app.utils.schedule import current_window, windows_between
+
+logger = logging.getLogger(__name__)
+
+
+class GalleryPrewarmer:
+    """Loads the galleries of classes that are about to start.
+
+    Every ``prewarm_poll_seconds`` the class schedules are scanned for
+    sessions starting within ``prewarm_lead_minutes`` (or already running),
+    and any of those galleries that are not cached are loaded, together
+    with their matching index, on worker threads. The first stream of a
+    session then finds everything in memory.
+    """
+
+    def __init__(self, lead: timedelta, poll_seconds: float, concurrency: int):
+        self.lead = lead
+        self.poll_seconds = poll_seconds
+        self.concurrency = max(1, concurrency)
+        self.task: Optional[asyncio.Task] = None
+        self.last_run_at: Optional[datetime] = None
+        self.last_warmed: List[str] = []
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def run(self):
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Gallery pre-warming failed: {e}", exc_info=True)
+            await asyncio.sleep(self.poll_seconds)
+
+    @staticmethod
+    def _warm(class_id: str, enrolled_students: List[str]) -> int:
+        gallery = gallery_cache.get(class_id, enrolled_students)
+        return len(gallery.index)
+
+    async def tick(self, now: Optional[datetime] = None) -> List[str]:
+        """Warm every due gallery that is not already cached; returns the class ids warmed"""
+        db = get_database()
+        now = now or datetime.utcnow()
+        classes = await db.classes.find(
+            {"schedule": {"$nin": [None, {}]}},
+            {"enrolled_students": 1, "schedule": 1}
+        ).to_list(length=None)
+
+        due = []
+        for cls in classes:
+            schedule = cls.get("schedule")
+            upcoming = windows_between(schedule, now, now + self.lead)
+            running = current_window(schedule, now)
+            starts = [start for start, _ in upcoming] + ([running[0]] if running else [])
+            if starts and cls.get("enrolled_students"):
+                due.append((min(starts), str(cls["_id"]), cls["enrolled_students"]))
+        due.sort()
+
+        if len(due) > gallery_cache.max_size:
+            logger.warning(f"{len(due)} classes are due but the gallery cache holds {gallery_cache.max_size}; raise GALLERY_CACHE_SIZE")
+
+        cold = [(class_id, enrolled) for _, class_id, enrolled in due if not gallery_cache.is_warm(class_id, enrolled)]
+        loop = asyncio.get_event_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def warm(class_id: str, enrolled: List[str]):
+            async with semaphore:
+                encodings = await loop.run_in_executor(None, self._warm, class_id, enrolled)
+                logger.info(f"Pre-warmed gallery for class {class_id} ({encodings} encodings)")
+
+        await asyncio.gather(*[warm(class_id, enrolled) for class_id, enrolled in cold])
+        self.last_run_at = now
+        self.last_warmed = [class_id for class_id, _ in cold]
+        return self.last_warmed
+
+
+gallery_prewarmer = GalleryPrewarmer(
+    timedelta(minutes=settings.prewarm_lead_minutes),
+    settings.prewarm_poll_seconds,
+    settings.prewarm_concurrency
+)
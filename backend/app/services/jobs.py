@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from bson import ObjectId
+
+from app.database import get_database
+
+logger = logging.getLogger(__name__)
+
+
+class JobManager:
+    """Background jobs whose state lives in the ``jobs`` collection.
+
+    The request that creates a job returns immediately with its id; the work
+    runs as an asyncio task and records progress, checkpoints and the final
+    result on the job document so clients can poll it.
+    """
+
+    def __init__(self):
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    async def create(self, job_type: str, created_by: str, params: Optional[dict] = None) -> str:
+        db = get_database()
+        now = datetime.utcnow()
+        result = await db.jobs.insert_one({
+            "type": job_type,
+            "status": "pending",
+            "params": params or {},
+            "progress": {"processed": 0, "total": 0},
+            "result": None,
+            "error": None,
+            "created_by": created_by,
+            "created_at": now,
+            "updated_at": now
+        })
+        return str(result.inserted_id)
+
+    def start(self, job_id: str, work: Callable[[str], Awaitable[Any]]) -> asyncio.Task:
+        """Run ``work(job_id)`` in the background and record its outcome"""
+        async def runner():
+            await self.update(job_id, status="running", started_at=datetime.utcnow())
+            try:
+                result = await work(job_id)
+                await self.update(job_id, status="completed", result=result, finished_at=datetime.utcnow())
+            except asyncio.CancelledError:
+                await self.update(job_id, status="cancelled", finished_at=datetime.utcnow())
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}", exc_info=True)
+                await self.update(job_id, status="failed", error=str(e), finished_at=datetime.utcnow())
+            finally:
+                self.tasks.pop(job_id, None)
+
+        task = asyncio.ensure_future(runner())
+        self.tasks[job_id] = task
+        return task
+
+    async def update(self, job_id: str, **fields):
+        db = get_database()
+        fields["updated_at"] = datetime.utcnow()
+        await db.jobs.update_one({"_id": ObjectId(job_id)}, {"$set": fields})
+
+    async def claim(self, job_id: str, field: str, marker: Any = "pending") -> bool:
+        """Atomically set an unset ``field`` of a completed job; False if another request got there first"""
+        db = get_database()
+        result = await db.jobs.update_one(
+            {"_id": ObjectId(job_id), "status": "completed", field: None},
+            {"$set": {field: marker, "updated_at": datetime.utcnow()}}
+        )
+        return result.modified_count == 1
+
+    async def progress(self, job_id: str, processed: int, total: Optional[int] = None, **fields):
+        fields["progress.processed"] = processed
+        if total is not None:
+            fields["progress.total"] = total
+        await self.update(job_id, **fields)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        if not ObjectId.is_valid(job_id):
+            return None
+        db = get_database()
+        return await db.jobs.find_one({"_id": ObjectId(job_id)})
+
+    def is_running(self, job_id: str) -> bool:
+        return job_id in self.tasks
+
+    def cancel(self, job_id: str) -> bool:
+        task = self.tasks.get(job_id)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    async def shutdown(self):
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+job_manager = JobManager()
@@ -0,0 +1,403 @@
+"""Per-class student × session presence as a packed NumPy bit matrix.
+
+Percentages, streaks, at-risk lists and per-session absentees of a class
+all reduce to its presence matrix: one row per student, one bit column per
+attendance record. The matrix is built once from ``attendance``, kept in a
+process-wide LRU cache and updated in place by ``app.services.attendance_writes``,
+so these questions become vectorized operations instead of queries.
+
+Every write also bumps the class's ``writes`` counter in
+``attendance_summary``. A cached matrix remembers the counter value it
+reflects and is only served while the two agree (one indexed read per
+query), so writes made by other processes trigger a reload instead of
+stale counts. Matrices are also reloaded after
+``settings.presence_matrix_max_age_seconds``.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app.config import settings
+from app.services.attendance_summary import attendance_summary
+
+logger = logging.getLogger(__name__)
+
+RECORD_FIELDS = {"date": 1, "mode": 1, "present_students": 1}
+
+# Classes a single query may build matrices for; larger sets use aggregations
+BUILD_LIMIT = 16
+
+# Number of set bits in every byte value, for popcounts over packed rows
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+NAT = np.datetime64("NaT", "us")
+
+
+def _to_datetime64(moment) -> np.datetime64:
+    """Naive UTC (as stored by Mongo) at microsecond precision; NaT for non-dates"""
+    if not isinstance(moment, datetime):
+        return NAT
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(moment, "us")
+
+
+def trailing_run(matrix: np.ndarray) -> np.ndarray:
+    """Length of the run of True values ending each row"""
+    rows, columns = matrix.shape
+    if not columns:
+        return np.zeros(rows, dtype=np.int64)
+    reversed_rows = matrix[:, ::-1]
+    return np.where(reversed_rows.all(axis=1), columns, np.argmin(reversed_rows, axis=1))
+
+
+def longest_run(matrix: np.ndarray) -> np.ndarray:
+    """Length of the longest run of True values in each row"""
+    rows, columns = matrix.shape
+    longest = np.zeros(rows, dtype=np.int64)
+    if not rows or not columns:
+        return longest
+    padded = np.zeros((rows, columns + 2), dtype=np.int8)
+    padded[:, 1:-1] = matrix
+    edges = np.diff(padded, axis=1)
+    # Row-major order pairs every run start with its end
+    start_rows, start_columns = np.nonzero(edges == 1)
+    _, end_columns = np.nonzero(edges == -1)
+    np.maximum.at(longest, start_rows, end_columns - start_columns)
+    return longest
+
+
+class ClassPresence:
+    """Presence matrix of one class.
+
+    Columns are kept in the order records were seen; analyses that need
+    time order sort them by date. A deleted record leaves an empty column
+    that is no longer ``live``.
+    """
+
+    def __init__(self, class_id: str):
+        self.class_id = class_id
+        self.students: List[str] = []
+        self.student_rows: Dict[str, int] = {}
+        self.session_ids: List[str] = []
+        self.session_columns: Dict[str, int] = {}
+        self.dates = np.full(0, NAT)
+        self.modes = np.full(0, "", dtype=object)
+        self.live = np.zeros(0, dtype=bool)
+        # Packed rows (np.packbits order: column c is bit 7 - c % 8 of byte c // 8)
+        self.bits = np.zeros((0, 0), dtype=np.uint8)
+        self.loaded_at = time.monotonic()
+        # Value of the class's write counter this matrix reflects
+        self.version = 0
+
+    @classmethod
+    def from_records(cls, class_id: str, records: Iterable[dict], version: int = 0) -> "ClassPresence":
+        presence = cls(class_id)
+        presence.version = version
+        rows, columns = [], []
+        for record in records:
+            column = presence.add_session(str(record["_id"]), record.get("date"), record.get("mode"))
+            for student_id in record.get("present_students") or []:
+                rows.append(presence._row(student_id))
+                columns.append(column)
+        dense = np.zeros((len(presence.students), len(presence.session_ids)), dtype=bool)
+        dense[rows, columns] = True
+        packed = np.packbits(dense, axis=1)
+        presence.bits[:packed.shape[0], :packed.shape[1]] = packed
+        return presence
+
+    def _reserve(self, rows: int, columns: int):
+        """Grow the arrays (doubling) to hold ``rows`` students and ``columns`` sessions"""
+        capacity_rows, capacity_bytes = self.bits.shape
+        new_rows = capacity_rows if rows <= capacity_rows else max(rows, 2 * capacity_rows)
+        new_bytes = capacity_bytes if columns <= 8 * capacity_bytes else max((columns + 7) // 8, 2 * capacity_bytes)
+        if (new_rows, new_bytes) != (capacity_rows, capacity_bytes):
+            bits = np.zeros((new_rows, new_bytes), dtype=np.uint8)
+            bits[:capacity_rows, :capacity_bytes] = self.bits
+            self.bits = bits
+        if columns > len(self.dates):
+            extra = max(columns, 2 * len(self.dates)) - len(self.dates)
+            self.dates = np.concatenate([self.dates, np.full(extra, NAT)])
+            self.modes = np.concatenate([self.modes, np.full(extra, "", dtype=object)])
+            self.live = np.concatenate([self.live, np.zeros(extra, dtype=bool)])
+
+    def _row(self, student_id: str) -> int:
+        row = self.student_rows.get(student_id)
+        if row is None:
+            row = len(self.students)
+            self._reserve(row + 1, len(self.session_ids))
+            self.students.append(student_id)
+            self.student_rows[student_id] = row
+        return row
+
+    def add_session(self, session_id: str, date: Optional[datetime], mode: Optional[str]) -> int:
+        column = self.session_columns.get(session_id)
+        if column is None:
+            column = len(self.session_ids)
+            self._reserve(len(self.students), column + 1)
+            self.session_ids.append(session_id)
+            self.session_columns[session_id] = column
+        self.dates[column] = _to_datetime64(date)
+        self.modes[column] = mode or ""
+        self.live[column] = True
+        return column
+
+    def remove_session(self, session_id: str):
+        column = self.session_columns.get(session_id)
+        if column is not None:
+            self.live[column] = False
+            self.bits[:, column >> 3] &= np.uint8(~(0x80 >> (column & 7)) & 0xFF)
+
+    def set_present(self, session_id: str, student_ids: Iterable[str], present: bool = True):
+        column = self.session_columns[session_id]
+        if present:
+            rows = [self._row(student_id) for student_id in student_ids]
+        else:
+            rows = [self.student_rows[s] for s in student_ids if s in self.student_rows]
+        if not rows:
+            return
+        bit = 0x80 >> (column & 7)
+        if present:
+            self.bits[rows, column >> 3] |= np.uint8(bit)
+        else:
+            self.bits[rows, column >> 3] &= np.uint8(~bit & 0xFF)
+
+    def column_mask(self, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, mode: Optional[str] = None) -> np.ndarray:
+        """Live sessions within the inclusive date range and of the given mode"""
+        count = len(self.session_ids)
+        mask = self.live[:count].copy()
+        # Comparisons with NaT are False, as range queries skip non-date values
+        if start_date is not None:
+            mask &= self.dates[:count] >= _to_datetime64(start_date)
+        if end_date is not None:
+            mask &= self.dates[:count] <= _to_datetime64(end_date)
+        if mode:
+            mask &= self.modes[:count] == mode
+        return mask
+
+    def presence_counts(self, mask: np.ndarray) -> np.ndarray:
+        """Selected sessions each student (by row) is present in"""
+        packed = np.packbits(mask)
+        rows = self.bits[:len(self.students), :packed.size]
+        return POPCOUNT[rows & packed].sum(axis=1, dtype=np.int64)
+
+    def dense(self, student_ids: List[str], columns: np.ndarray) -> np.ndarray:
+        """Boolean presence of the given students in the given columns; unknown students are absent"""
+        count = len(self.session_ids)
+        unpacked = np.unpackbits(self.bits[:len(self.students), :(count + 7) // 8], axis=1, count=count)
+        rows = np.array([self.student_rows.get(student_id, -1) for student_id in student_ids], dtype=np.intp)
+        result = np.zeros((len(student_ids), len(columns)), dtype=bool)
+        known = rows >= 0
+        result[known] = unpacked[rows[known]][:, columns].astype(bool)
+        return result
+
+    def analytics(
+        self,
+        roster: List[str],
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        mode: Optional[str] = None,
+        threshold: float = 75.0,
+        recent_sessions: int = 20
+    ) -> dict:
+        """Per-student percentages and streaks, at-risk students and recent absentees of ``roster``"""
+        mask = self.column_mask(start_date, end_date, mode)
+        columns = np.flatnonzero(mask)
+        # Time order, with records lacking a date first
+        dates = self.dates[columns]
+        columns = columns[np.lexsort((dates, ~np.isnat(dates)))]
+        present = self.dense(roster, columns)
+        total = len(columns)
+        present_counts = present.sum(axis=1)
+        current_streaks = trailing_run(present)
+        longest_absences = longest_run(~present)
+
+        students = []
+        for i, student_id in enumerate(roster):
+            count = int(present_counts[i])
+            students.append({
+                "student_id": student_id,
+                "present_count": count,
+                "absent_count": total - count,
+                "attendance_percentage": round(count / total * 100, 2) if total > 0 else 0,
+                "current_streak": int(current_streaks[i]),
+                "longest_absence_streak": int(longest_absences[i])
+            })
+        at_risk = sorted(
+            (s for s in students if total and s["attendance_percentage"] < threshold),
+            key=lambda s: s["attendance_percentage"]
+        )
+
+        sessions = []
+        roster_array = np.array(roster, dtype=object)
+        for position in range(total - 1, max(total - recent_sessions, 0) - 1, -1):
+            column = columns[position]
+            sessions.append({
+                "attendance_id": self.session_ids[column],
+                "date": self.dates[column].item(),
+                "mode": self.modes[column] or None,
+                "present_count": int(present[:, position].sum()),
+                "absent_students": roster_array[~present[:, position]].tolist()
+            })
+        return {
+            "total_sessions": total,
+            "students": students,
+            "at_risk": [s["student_id"] for s in at_risk],
+            "recent_sessions": sessions
+        }
+
+
+class PresenceMatrixCache:
+    """Process-wide LRU cache of class presence matrices"""
+
+    def __init__(self, max_size: int, max_age: float):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._matrices: "OrderedDict[str, ClassPresence]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Writes seen per class, so a build that raced a write is not cached
+        self._writes: Dict[str, int] = {}
+
+    def _fresh(self, class_id: str, version: int) -> Optional[ClassPresence]:
+        presence = self._matrices.get(class_id)
+        if (
+            presence is not None
+            and presence.version == version
+            and time.monotonic() - presence.loaded_at <= self.max_age
+        ):
+            self._matrices.move_to_end(class_id)
+            return presence
+        return None
+
+    async def versions(self, db, class_ids: List[str]) -> Optional[Dict[str, int]]:
+        """Current write counters if counts for these classes should come from
+        matrices, or None when an aggregation should answer instead"""
+        versions = await attendance_summary.write_counts(db, class_ids)
+        if len(class_ids) <= BUILD_LIMIT or all(self._fresh(class_id, versions.get(class_id, 0)) for class_id in class_ids):
+            return versions
+        return None
+
+    async def get(self, db, class_id: str, version: Optional[int] = None) -> ClassPresence:
+        """The class's matrix, rebuilt unless the cached one matches ``version``
+        (read from ``attendance_summary`` when not given)"""
+        if version is None:
+            version = (await attendance_summary.write_counts(db, [class_id])).get(class_id, 0)
+        presence = self._fresh(class_id, version)
+        if presence is not None:
+            return presence
+        lock = self._locks.setdefault(class_id, asyncio.Lock())
+        async with lock:
+            presence = self._fresh(class_id, version)
+            if presence is not None:
+                return presence
+            writes = self._writes.get(class_id, 0)
+            # Read after the counter, so the matrix holds at least the writes it claims
+            records = await db.attendance.find({"class_id": class_id}, RECORD_FIELDS).to_list(length=None)
+            presence = ClassPresence.from_records(class_id, records, version)
+            logger.info(f"Built presence matrix for class {class_id}: {len(presence.students)} students x {len(records)} sessions")
+            if self._writes.get(class_id, 0) == writes:
+                self._matrices[class_id] = presence
+                self._matrices.move_to_end(class_id)
+                while len(self._matrices) > self.max_size:
+                    evicted, _ = self._matrices.popitem(last=False)
+                    self._locks.pop(evicted, None)
+        return presence
+
+    def apply(
+        self,
+        class_id: str,
+        session_id: str,
+        date: Optional[datetime],
+        mode: Optional[str],
+        sessions: int = 0,
+        added: Iterable[str] = (),
+        removed: Iterable[str] = ()
+    ):
+        """Same deltas as ``AttendanceSummary.apply`` for one record, applied to a cached matrix"""
+        self._writes[class_id] = self._writes.get(class_id, 0) + 1
+        presence = self._matrices.get(class_id)
+        if presence is None:
+            return
+        if sessions > 0:
+            presence.add_session(session_id, date, mode)
+        if session_id not in presence.session_columns:
+            # Record created by another process: reload on next use
+            self._matrices.pop(class_id, None)
+            return
+        # The same write bumps the stored counter
+        presence.version += 1
+        if sessions < 0:
+            presence.remove_session(session_id)
+            return
+        presence.set_present(session_id, added, True)
+        presence.set_present(session_id, removed, False)
+
+    async def class_totals(
+        self,
+        db,
+        class_ids: List[str],
+        versions: Dict[str, int],
+        start_date=None,
+        end_date=None,
+        mode=None
+    ) -> Dict[str, int]:
+        totals = {}
+        for class_id in class_ids:
+            presence = await self.get(db, class_id, versions.get(class_id, 0))
+            count = int(presence.column_mask(start_date, end_date, mode).sum())
+            if count:
+                totals[class_id] = count
+        return totals
+
+    async def presence(
+        self,
+        db,
+        class_ids: List[str],
+        versions: Dict[str, int],
+        start_date=None,
+        end_date=None,
+        mode=None,
+        student_ids: Optional[List[str]] = None
+    ) -> Dict[str, Dict[str, int]]:
+        wanted = set(student_ids) if student_ids is not None else None
+        result: Dict[str, Dict[str, int]] = {}
+        for class_id in class_ids:
+            presence = await self.get(db, class_id, versions.get(class_id, 0))
+            counts = presence.presence_counts(presence.column_mask(start_date, end_date, mode))
+            class_counts = {
+                student_id: int(counts[row])
+                for row, student_id in enumerate(presence.students)
+                if counts[row] and (wanted is None or student_id in wanted)
+            }
+            if class_counts:
+                result[class_id] = class_counts
+        return result
+
+    def invalidate(self, class_id: Optional[str] = None):
+        """Drop one class matrix, or all of them when class_id is None"""
+        if class_id is None:
+            self._matrices.clear()
+        else:
+            self._matrices.pop(class_id, None)
+
+    def snapshot(self) -> List[dict]:
+        now = time.monotonic()
+        return [
+            {
+                "class_id": presence.class_id,
+                "students": len(presence.students),
+                "sessions": int(presence.live[:len(presence.session_ids)].sum()),
+                "bytes": presence.bits.nbytes,
+                "version": presence.version,
+                "age_seconds": round(now - presence.loaded_at, 1)
+            }
+            for presence in self._matrices.values()
+        ]
+
+
+presence_matrices = PresenceMatrixCache(settings.presence_matrix_cache_size, settings.presence_matrix_max_age_seconds)
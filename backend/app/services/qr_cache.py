@@ -0,0 +1,62 @@
+import hashlib
+import io
+import os
+import threading
+from typing import Tuple
+
+import qrcode
+
+from app.config import settings
+
+# Bump when the rendering below changes so old PNGs are not served
+QR_RENDER_VERSION = "v1"
+
+
+class QRCodeCache:
+    """Content-addressed on-disk cache of student QR code PNGs.
+
+    A QR image is fully determined by the student id and the render
+    parameters, so the cache key (and the strong ETag) is a hash of both and
+    an entry never needs invalidating.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def etag_for(student_id: str) -> str:
+        digest = hashlib.sha256(f"{QR_RENDER_VERSION}:{student_id}".encode("utf-8")).hexdigest()
+        return digest[:32]
+
+    @staticmethod
+    def _render(student_id: str) -> bytes:
+        qr = qrcode.QRCode(version=1, box_size=10, border=5)
+        qr.add_data(student_id)
+        qr.make(fit=True)
+        img = qr.make_image(fill_color="black", back_color="white")
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    def get_png(self, student_id: str) -> Tuple[bytes, str]:
+        """Return (png_bytes, etag), rendering and storing the image on first use"""
+        etag = self.etag_for(student_id)
+        path = os.path.join(self.cache_dir, f"{etag}.png")
+        try:
+            with open(path, "rb") as f:
+                return f.read(), etag
+        except FileNotFoundError:
+            pass
+
+        png = self._render(student_id)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with self._lock:
+            with open(tmp_path, "wb") as f:
+                f.write(png)
+            os.replace(tmp_path, path)
+        return png, etag
+
+
+qr_code_cache = QRCodeCache(settings.qr_cache_dir)
@@ -0,0 +1,47 @@
+import logging
+from typing import Iterable, List, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def scan_qr_codes(frame: np.ndarray, enrolled_students: Iterable[str]) -> Tuple[List[str], int, int, List[dict]]:
+    """Decode every student QR code in a frame.
+
+    Returns the same (recognized_ids, total_detected, total_recognized,
+    detections) tuple as ``recognize_faces_in_frame`` so QR mode can share the
+    streaming and session code. Decoded ids that are not on the class roster
+    are reported as unrecognized detections.
+    """
+    if frame is None or frame.size == 0:
+        return [], 0, 0, []
+
+    try:
+        found, decoded, points, _ = cv2.QRCodeDetector().detectAndDecodeMulti(frame)
+    except cv2.error as e:
+        logger.error(f"Error scanning QR codes: {e}")
+        return [], 0, 0, []
+    if not found or points is None:
+        return [], 0, 0, []
+
+    roster = set(enrolled_students)
+    recognized_ids = []
+    detections = []
+    for text, corners in zip(decoded, points):
+        xs, ys = corners[:, 0], corners[:, 1]
+        x, y = int(xs.min()), int(ys.min())
+        student_id = text.strip() if text else None
+        recognized = bool(student_id) and student_id in roster
+        if recognized and student_id not in recognized_ids:
+            recognized_ids.append(student_id)
+        detections.append({
+            "x": x,
+            "y": y,
+            "width": int(xs.max()) - x,
+            "height": int(ys.max()) - y,
+            "student_id": student_id if recognized else None,
+            "recognized": recognized
+        })
+    return recognized_ids, len(detections), len(recognized_ids), detections
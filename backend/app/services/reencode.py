@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+
+import numpy as np
+
+from app.config import settings
+from app.database import get_database
+from app.services.blob_store import blob_store
+from app.services.encoder_profiles import encoder_registry
+from app.services.face_recognition import face_recognition_service
+from app.services.face_samples import list_samples
+from app.services.face_workers import encode_training_images
+from app.services.gallery_cache import gallery_cache
+from app.services.jobs import job_manager
+
+logger = logging.getLogger(__name__)
+
+# Catch-up rounds for students edited while the main pass was running
+MAX_CATCH_UP_ROUNDS = 3
+
+
+async def _encode_student(db, face_data: dict, version: str, semaphore: asyncio.Semaphore) -> Dict[str, np.ndarray]:
+    """Encode every stored sample of one student with the target profile"""
+    loop = asyncio.get_event_loop()
+    samples = face_data.get("samples")
+    if samples is None or any("blob" not in sample for sample in samples):
+        # Older layouts are moved to the blob store first
+        samples = await list_samples(db, face_data["student_id"]) or []
+
+    async def encode_one(sample: dict):
+        async with semaphore:
+            content = await loop.run_in_executor(None, blob_store.read, sample["blob"])
+            if content is None:
+                logger.warning(f"Blob {sample['blob']} of student {face_data['student_id']} is missing")
+                return sample["sample_id"], None
+            outcome = (await encode_training_images([content], version))[0]
+            return sample["sample_id"], outcome["encoding"]
+
+    results = await asyncio.gather(*[encode_one(sample) for sample in samples])
+    return {sample_id: encoding for sample_id, encoding in results if encoding is not None}
+
+
+async def _reencode_batch(db, docs, version: str, semaphore: asyncio.Semaphore) -> int:
+    """Re-encode and save a batch of students; returns how many ended up without any encoding"""
+    loop = asyncio.get_event_loop()
+    encoded = await asyncio.gather(*[_encode_student(db, doc, version, semaphore) for doc in docs])
+    empty = 0
+    for doc, encodings in zip(docs, encoded):
+        await loop.run_in_executor(None, face_recognition_service.save_face_samples, doc["student_id"], encodings, version)
+        gallery_cache.update_student(doc["student_id"], list(encodings.values()), version)
+        if not encodings:
+            empty += 1
+    return empty
+
+
+async def run_reencode(job_id: str) -> dict:
+    """Rebuild every student's encodings for ``params.version`` from the stored images.
+
+    Students are walked in ``student_id`` order, so the checkpoint is just the
+    last finished id. Each batch is limited to ``reencode_concurrency``
+    images in flight and followed by ``reencode_pause_seconds`` of idle time,
+    leaving the worker pool free for live recognition. Students edited while
+    the job runs are picked up again at the end; the active version is then
+    switched with one write, and galleries built from the old version stop
+    being handed out.
+    """
+    db = get_database()
+    job = await job_manager.get(job_id)
+    params = job["params"]
+    version = params["version"]
+    encoder_registry.profile(version)
+
+    pass_started_at = job.get("reencode_started_at")
+    if pass_started_at is None:
+        pass_started_at = datetime.utcnow()
+        await job_manager.update(job_id, reencode_started_at=pass_started_at)
+
+    checkpoint = job.get("checkpoint") or {}
+    last_student_id: Optional[str] = checkpoint.get("last_student_id")
+    processed = job.get("progress", {}).get("processed", 0) if last_student_id else 0
+    students_without_faces = checkpoint.get("students_without_faces", 0)
+    total = await db.face_images.count_documents({})
+    await job_manager.progress(job_id, processed, total)
+
+    semaphore = asyncio.Semaphore(max(1, settings.reencode_concurrency))
+    batch_size = max(1, settings.reencode_batch_size)
+    projection = {"student_id": 1, "samples": 1}
+
+    while True:
+        query = {"student_id": {"$gt": last_student_id}} if last_student_id else {}
+        docs = await db.face_images.find(query, projection).sort("student_id", 1).limit(batch_size).to_list(length=batch_size)
+        if not docs:
+            break
+        students_without_faces += await _reencode_batch(db, docs, version, semaphore)
+        last_student_id = docs[-1]["student_id"]
+        processed += len(docs)
+        await job_manager.progress(job_id, processed, total, **{
+            "checkpoint.last_student_id": last_student_id,
+            "checkpoint.students_without_faces": students_without_faces
+        })
+        await asyncio.sleep(settings.reencode_pause_seconds)
+
+    async def catch_up(since: datetime) -> int:
+        changed = await db.face_images.find({"updated_at": {"$gte": since}}, projection).to_list(length=None)
+        if changed:
+            await _reencode_batch(db, changed, version, semaphore)
+        return len(changed)
+
+    caught_up = 0
+    for _ in range(MAX_CATCH_UP_ROUNDS):
+        round_started_at = datetime.utcnow()
+        changed = await catch_up(pass_started_at)
+        caught_up += changed
+        pass_started_at = round_started_at
+        if not changed:
+            break
+
+    activated = params.get("activate", True)
+    if activated and encoder_registry.active_version != version:
+        switch_started_at = datetime.utcnow()
+        await encoder_registry.activate(db, version, job_id)
+        gallery_cache.invalidate()
+        # Writes that landed in the old version between the last round and the switch
+        caught_up += await catch_up(min(pass_started_at, switch_started_at))
+
+    logger.info(f"Re-encoded {processed} students for encoder {version} ({caught_up} caught up)")
+    return {
+        "version": version,
+        "students_processed": processed,
+        "students_caught_up": caught_up,
+        "students_without_faces": students_without_faces,
+        "activated": activated
+    }
@@ -0,0 +1,284 @@
+"""Streaming attendance report exports.
+
+Rows are produced as they are read: classes come from a cursor in batches,
+each batch costing one count per kind plus one student lookup. The same
+rows feed every format:
+
+- CSV is written to the response every ``CSV_CHUNK_ROWS`` rows, header
+  first, before any query runs
+- xlsx (openpyxl write-only mode) and Parquet (one row group per batch)
+  are written to a temporary file in the default executor, then streamed;
+  the file is deleted by a background task of the response, which also
+  runs when the client disconnects before the body is sent
+
+Memory stays bounded by one batch for all-classes, full-year exports.
+"""
+import asyncio
+import csv
+import logging
+import os
+import tempfile
+from datetime import datetime
+from io import StringIO
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import aiofiles
+from bson import ObjectId
+from fastapi.responses import StreamingResponse
+from openpyxl import Workbook
+from starlette.background import BackgroundTask
+
+from app.services.attendance_stats import count_presence, count_sessions, find_students
+
+logger = logging.getLogger(__name__)
+
+CLASS_BATCH_SIZE = 50
+RECORD_BATCH_SIZE = 500
+CSV_CHUNK_ROWS = 500
+EXPORT_BATCH_ROWS = 5000
+FILE_CHUNK_SIZE = 64 * 1024
+
+# Accepted ``format`` values and the file type each produces
+REPORT_FORMATS = {"csv": "csv", "excel": "xlsx", "xlsx": "xlsx", "parquet": "parquet"}
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet"
+}
+
+# (header, kind) with kind one of "string", "int", "percent"
+ROSTER_COLUMNS = [
+    ("Class Name", "string"),
+    ("Student ID", "string"),
+    ("Student Name", "string"),
+    ("Total Classes", "int"),
+    ("Present", "int"),
+    ("Absent", "int"),
+    ("Attendance Percentage", "percent")
+]
+FACULTY_ROSTER_COLUMNS = [column for column in ROSTER_COLUMNS if column[0] != "Absent"]
+STUDENT_RECORD_COLUMNS = [
+    ("Date", "string"),
+    ("Time", "string"),
+    ("Class Name", "string"),
+    ("Mode", "string"),
+    ("Status", "string")
+]
+
+
+def report_filename(subject: str, start_date: Optional[datetime], end_date: Optional[datetime], extension: str) -> str:
+    """``attendance_report_<subject>[_<start>][_to_<end>].<extension>``"""
+    date_suffix = ""
+    if start_date or end_date:
+        start_str = start_date.strftime("%Y%m%d") if start_date else ""
+        end_str = end_date.strftime("%Y%m%d") if end_date else ""
+        date_suffix = f"_{start_str}_to_{end_str}" if start_str and end_str else f"_{start_str}" if start_str else f"_{end_str}"
+    return f"attendance_report_{subject}{date_suffix}.{extension}"
+
+
+async def _csv_chunks(header: Iterable, rows: AsyncIterator[Iterable]) -> AsyncIterator[bytes]:
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    # Send the header straight away, before any query has run
+    yield buffer.getvalue().encode("utf-8")
+    buffer.seek(0)
+    buffer.truncate()
+    pending = 0
+    try:
+        async for row in rows:
+            writer.writerow(row)
+            pending += 1
+            if pending >= CSV_CHUNK_ROWS:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+    except Exception as e:
+        # The status line is already sent; the client sees a truncated file
+        logger.error(f"CSV export failed after the response started: {e}")
+        raise
+    if pending:
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _csv_values(columns: Sequence[Tuple[str, str]], rows: AsyncIterator[Sequence]) -> AsyncIterator[list]:
+    percent = [i for i, (_, kind) in enumerate(columns) if kind == "percent"]
+
+    async def formatted():
+        async for row in rows:
+            row = list(row)
+            for i in percent:
+                row[i] = f"{row[i]}%"
+            yield row
+    return formatted()
+
+
+class _XlsxWriter:
+    def __init__(self, path: str, columns: Sequence[Tuple[str, str]]):
+        self.path = path
+        # Write-only workbooks stream rows to disk instead of holding cells
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet("Attendance")
+        self.sheet.append([name for name, _ in columns])
+
+    def write(self, rows: List[Sequence]):
+        for row in rows:
+            self.sheet.append(list(row))
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+class _ParquetWriter:
+    def __init__(self, path: str, columns: Sequence[Tuple[str, str]]):
+        # Imported here: pyarrow is large and only needed for this format
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        types = {"string": pa.string(), "int": pa.int64(), "percent": pa.float64()}
+        self.schema = pa.schema([(name, types[kind]) for name, kind in columns])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="snappy")
+
+    def write(self, rows: List[Sequence]):
+        # One row group per batch
+        columns = list(zip(*rows))
+        self.writer.write_table(self.pa.Table.from_arrays(
+            [self.pa.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+            schema=self.schema
+        ))
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {"xlsx": _XlsxWriter, "parquet": _ParquetWriter}
+
+
+async def _write_file(extension: str, columns: Sequence[Tuple[str, str]], rows: AsyncIterator[Sequence]) -> str:
+    """Write the rows to a temporary file off the event loop; returns its path"""
+    loop = asyncio.get_running_loop()
+    fd, path = tempfile.mkstemp(suffix=f".{extension}")
+    os.close(fd)
+    try:
+        writer = await loop.run_in_executor(None, WRITERS[extension], path, columns)
+        batch = []
+        async for row in rows:
+            batch.append(row)
+            if len(batch) >= EXPORT_BATCH_ROWS:
+                await loop.run_in_executor(None, writer.write, batch)
+                batch = []
+        if batch:
+            await loop.run_in_executor(None, writer.write, batch)
+        await loop.run_in_executor(None, writer.close)
+    except Exception:
+        os.unlink(path)
+        raise
+    return path
+
+
+async def _file_chunks(path: str) -> AsyncIterator[bytes]:
+    async with aiofiles.open(path, "rb") as f:
+        while chunk := await f.read(FILE_CHUNK_SIZE):
+            yield chunk
+
+
+def _remove_file(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def csv_response(header: Iterable, rows: AsyncIterator[Iterable], filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        _csv_chunks(header, rows),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+
+async def export_response(
+    report_format: str,
+    columns: Sequence[Tuple[str, str]],
+    rows: AsyncIterator[Sequence],
+    subject: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None
+) -> StreamingResponse:
+    """Report download in one of ``REPORT_FORMATS``; raises ValueError for any other"""
+    extension = REPORT_FORMATS.get(report_format)
+    if extension is None:
+        raise ValueError(f"Unsupported report format: {report_format}")
+    filename = report_filename(subject, start_date, end_date, extension)
+    if extension == "csv":
+        return csv_response([name for name, _ in columns], _csv_values(columns, rows), filename)
+    path = await _write_file(extension, columns, rows)
+    return StreamingResponse(
+        _file_chunks(path),
+        media_type=MEDIA_TYPES[extension],
+        headers={"Content-Disposition": f"attachment; filename={filename}", "Content-Length": str(os.path.getsize(path))},
+        background=BackgroundTask(_remove_file, path)
+    )
+
+
+async def roster_rows(
+    db,
+    class_query: dict,
+    date_range: Optional[dict] = None,
+    mode: Optional[str] = None
+) -> AsyncIterator[Tuple[str, str, str, int, int]]:
+    """``(class_name, student_id, student_name, total, present)`` per enrolled student
+
+    Students without a user account are skipped, as in the on-screen reports.
+    """
+    cursor = db.classes.find(class_query, {"name": 1, "enrolled_students": 1}).batch_size(CLASS_BATCH_SIZE)
+    batch = []
+    async for cls in cursor:
+        batch.append(cls)
+        if len(batch) >= CLASS_BATCH_SIZE:
+            async for row in _roster_batch(db, batch, date_range, mode):
+                yield row
+            batch = []
+    if batch:
+        async for row in _roster_batch(db, batch, date_range, mode):
+            yield row
+
+
+async def _roster_batch(db, classes: list, date_range: Optional[dict], mode: Optional[str]):
+    class_ids = [str(cls["_id"]) for cls in classes]
+    totals = await count_sessions(db, class_ids, date_range, mode)
+    presence = await count_presence(db, class_ids, date_range, mode)
+    students = await find_students(db, (sid for cls in classes for sid in cls.get("enrolled_students", [])))
+    for cls in classes:
+        class_name = cls.get("name", "Unknown")
+        total = totals.get(str(cls["_id"]), 0)
+        class_presence = presence.get(str(cls["_id"]), {})
+        for student_id in cls.get("enrolled_students", []):
+            student = students.get(student_id)
+            if not student:
+                continue
+            yield class_name, student_id, student.get("full_name", "Unknown"), total, class_presence.get(student_id, 0)
+
+
+async def student_record_rows(db, query: dict, class_names: Dict[str, str]) -> AsyncIterator[Tuple[str, str, str, str, str]]:
+    """``(date, time, class_name, mode, status)`` for the records matching ``query``, newest first"""
+    cursor = db.attendance.find(
+        query, {"class_id": 1, "date": 1, "created_at": 1, "mode": 1}
+    ).sort("date", -1).batch_size(RECORD_BATCH_SIZE)
+    async for record in cursor:
+        date_obj = record.get("date") or record.get("created_at")
+        if isinstance(date_obj, str):
+            date_obj = datetime.fromisoformat(date_obj.replace('Z', '+00:00'))
+        date_str = date_obj.strftime("%Y-%m-%d") if isinstance(date_obj, datetime) else str(date_obj)
+        time_str = date_obj.strftime("%H:%M:%S") if isinstance(date_obj, datetime) else ""
+        yield date_str, time_str, class_names.get(record.get("class_id"), "Unknown"), record.get("mode", "manual"), "Present"
+
+
+async def class_names_for(db, class_ids: Iterable[str]) -> Dict[str, str]:
+    """Class names keyed by id, fetched with one query"""
+    object_ids = [ObjectId(cid) for cid in set(class_ids) if ObjectId.is_valid(cid)]
+    if not object_ids:
+        return {}
+    return {str(cls["_id"]): cls.get("name", "Unknown") async for cls in db.classes.find({"_id": {"$in": object_ids}}, {"name": 1})}
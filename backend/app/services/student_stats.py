@@ -0,0 +1,94 @@
+"""Student dashboard statistics in one aggregation.
+
+The dashboard used to count per class, per day and overall in separate
+queries and look up a class for each recent record. One ``$facet``
+aggregation over the attendance of the student's enrolled classes now
+returns the per-class counts (overall totals are their sums) and the
+recent records; class names come from the enrolled classes the caller has
+already loaded. The daily chart is read concurrently from the
+``attendance_daily`` rollups.
+"""
+import asyncio
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.services.attendance_daily import attendance_daily
+from app.services.attendance_stats import attendance_percentage, date_filter
+
+RECENT_LIMIT = 10
+
+
+def _pipeline(student_id: str, class_ids: List[str], date_range: Optional[dict]) -> list:
+    present = {"$in": [student_id, {"$ifNull": ["$present_students", []]}]}
+    facets = {
+        "by_class": [
+            {"$group": {
+                "_id": "$class_id",
+                "total": {"$sum": 1},
+                "present": {"$sum": {"$cond": [present, 1, 0]}}
+            }}
+        ],
+        "recent": [
+            {"$match": {"present_students": student_id}},
+            {"$sort": {"date": -1}},
+            {"$limit": RECENT_LIMIT},
+            {"$project": {"_id": 0, "class_id": 1, "date": 1, "mode": 1}}
+        ]
+    }
+    match = {"class_id": {"$in": class_ids}}
+    if date_range:
+        match["date"] = date_range
+    return [{"$match": match}, {"$facet": facets}]
+
+
+async def get_student_stats(
+    db,
+    student_id: str,
+    classes: List[dict],
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None
+) -> dict:
+    """Dashboard payload for a student over their enrolled ``classes``"""
+    first_day, last_day = attendance_daily.day_range(start_date, end_date)
+    class_names: Dict[str, str] = {str(cls["_id"]): cls.get("name", "Unknown") for cls in classes}
+    result = {"by_class": [], "recent": []}
+    present_by_day = {}
+    if class_names:
+        class_ids = list(class_names)
+        pipeline = _pipeline(student_id, class_ids, date_filter(start_date, end_date))
+        results, present_by_day = await asyncio.gather(
+            db.attendance.aggregate(pipeline).to_list(length=1),
+            attendance_daily.presence_by_day(db, student_id, first_day, last_day, class_ids)
+        )
+        result = results[0]
+
+    counts = {doc["_id"]: doc for doc in result["by_class"]}
+    attendance_by_class = []
+    for class_id, name in class_names.items():
+        row = counts.get(class_id, {})
+        total, present = row.get("total", 0), row.get("present", 0)
+        attendance_by_class.append({
+            "class_name": name,
+            "total_classes": total,
+            "present_count": present,
+            "attendance_percentage": attendance_percentage(present, total)
+        })
+    total_attendance = sum(row["present_count"] for row in attendance_by_class)
+    total_possible = sum(row["total_classes"] for row in attendance_by_class)
+
+    return {
+        "total_classes": len(classes),
+        "total_attendance": total_attendance,
+        "total_possible_attendance": total_possible,
+        "attendance_percentage": attendance_percentage(total_attendance, total_possible),
+        "attendance_by_class": attendance_by_class,
+        "attendance_by_day": attendance_daily.series(present_by_day, first_day, last_day),
+        "recent_attendance": [
+            {
+                "class_name": class_names.get(record.get("class_id"), "Unknown"),
+                "date": record.get("date"),
+                "mode": record.get("mode", "manual")
+            }
+            for record in result["recent"]
+        ]
+    }
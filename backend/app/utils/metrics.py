@@ -0,0 +1,164 @@
+"""Per-stage latency histograms for the recognition hot path.
+
+A frame's stages, in milliseconds:
+
+- ``receive``: unpacking the WebSocket message and parsing its JSON
+- ``b64_decode``, ``imdecode``: base64 and JPEG/PNG decoding
+- ``color_convert``, ``detect``, ``encode``, ``match``: inside
+  ``recognize_faces_in_frame`` (QR mode reports the whole scan as ``detect``)
+- ``annotate``, ``jpeg_encode``, ``send``: building and sending the reply
+- ``total``: from the message arriving to the reply being sent
+
+Histograms use fixed buckets, so merging and reporting are cheap and the
+memory per histogram is constant.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+BUCKET_BOUNDS_MS = [0.5, 1, 2, 5, 10, 20, 35, 50, 75, 100, 150, 200, 300, 500, 750, 1000, 2000, 5000]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value_ms: float):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS_MS, value_ms)] += 1
+        self.count += 1
+        self.total += value_ms
+        self.max = max(self.max, value_ms)
+
+    def merge(self, other: "Histogram"):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Approximate percentile, interpolated linearly inside the bucket"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = BUCKET_BOUNDS_MS[i - 1] if i > 0 else 0.0
+                upper = BUCKET_BOUNDS_MS[i] if i < len(BUCKET_BOUNDS_MS) else self.max
+                value = lower + (upper - lower) * (rank - seen) / bucket_count
+                return round(min(value, self.max), 3)
+            seen += bucket_count
+        return round(self.max, 3)
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else None,
+            "p50_ms": self.percentile(0.5),
+            "p90_ms": self.percentile(0.9),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max, 3),
+            "buckets": [
+                {"le_ms": bound, "count": count}
+                for bound, count in zip(BUCKET_BOUNDS_MS + ["inf"], self.counts)
+                if count
+            ]
+        }
+
+
+class StageTimings:
+    """One histogram per stage name"""
+
+    def __init__(self):
+        self.stages: Dict[str, Histogram] = {}
+
+    def observe(self, stage: str, value_ms: float):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.observe(value_ms)
+
+    def observe_frame(self, timings: Dict[str, float]):
+        for stage, value_ms in timings.items():
+            self.observe(stage, value_ms)
+
+    def merge(self, other: "StageTimings"):
+        for stage, histogram in other.stages.items():
+            self.stages.setdefault(stage, Histogram()).merge(histogram)
+
+    def to_dict(self) -> dict:
+        return {stage: histogram.to_dict() for stage, histogram in self.stages.items()}
+
+
+@contextmanager
+def timed(timings: Optional[Dict[str, float]], stage: str):
+    """Add the block's wall time in ms to ``timings[stage]`` (no-op when timings is None)"""
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - started) * 1000
+
+
+class RecognitionMetrics:
+    """Node-wide and per-session stage histograms.
+
+    Frames are recorded from the event loop (streams) and from camera
+    worker threads, so everything goes through one lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.node: Dict[str, StageTimings] = {}
+        self.sessions: Dict[Tuple[str, str], StageTimings] = {}
+
+    def open_session(self, class_id: str, camera_id: str) -> StageTimings:
+        timings = StageTimings()
+        with self._lock:
+            self.sessions[(class_id, camera_id)] = timings
+        return timings
+
+    def close_session(self, class_id: str, camera_id: str):
+        with self._lock:
+            self.sessions.pop((class_id, camera_id), None)
+
+    def record_frame(self, source: str, timings: Dict[str, float], session: Optional[StageTimings] = None):
+        with self._lock:
+            self.node.setdefault(source, StageTimings()).observe_frame(timings)
+            if session is not None:
+                session.observe_frame(timings)
+
+    def snapshot_session(self, session: StageTimings) -> dict:
+        with self._lock:
+            return session.to_dict()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self.started_at, 1),
+                "load_average": os.getloadavg() if hasattr(os, "getloadavg") else None,
+                "cpu_count": os.cpu_count(),
+                "node": {source: timings.to_dict() for source, timings in self.node.items()},
+                "sessions": [
+                    {"class_id": class_id, "camera_id": camera_id, "stages": timings.to_dict()}
+                    for (class_id, camera_id), timings in self.sessions.items()
+                ]
+            }
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.node.clear()
+
+
+recognition_metrics = RecognitionMetrics()
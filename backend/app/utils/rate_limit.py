@@ -0,0 +1,29 @@
+import time
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+
+class SlidingWindowRateLimiter:
+    """In-process limiter allowing ``max_calls`` per ``period`` seconds for each key"""
+
+    def __init__(self, max_calls: int, period: float):
+        self.max_calls = max_calls
+        self.period = period
+        self._calls: Dict[str, Deque[float]] = {}
+
+    def hit(self, key: str) -> Tuple[bool, int]:
+        """Record an attempt; returns (allowed, seconds until the next attempt is allowed)"""
+        now = time.monotonic()
+        calls = self._calls.setdefault(key, deque())
+        while calls and calls[0] <= now - self.period:
+            calls.popleft()
+        if len(calls) >= self.max_calls:
+            return False, max(1, int(calls[0] + self.period - now) + 1)
+        calls.append(now)
+        if len(self._calls) > 10000:
+            self._prune(now)
+        return True, 0
+
+    def _prune(self, now: float):
+        for key in [k for k, calls in self._calls.items() if not calls or calls[-1] <= now - self.period]:
+            del self._calls[key]
@@ -0,0 +1,99 @@
+"""Helpers for the free-form ``schedule`` dict stored on classes.
+
+Supported shapes, keyed by weekday (``monday`` or ``mon``, any case)::
+
+    {"monday": "09:00-10:30"}
+    {"monday": {"start": "09:00", "end": "10:30"}}
+    {"monday": ["09:00-10:30", {"start": "14:00", "end": "15:00"}]}
+
+Times are wall-clock times in ``settings.schedule_timezone``; everything
+returned here is naive UTC like the rest of the database.
+"""
+from datetime import datetime, time, timedelta, timezone
+from typing import List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from app.config import settings
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+Window = Tuple[datetime, datetime]
+
+
+def _parse_time(value: str) -> time:
+    return datetime.strptime(value.strip(), "%H:%M").time()
+
+
+def _parse_slot(slot) -> Optional[Tuple[time, time]]:
+    try:
+        if isinstance(slot, str) and "-" in slot:
+            start, end = slot.split("-", 1)
+            return _parse_time(start), _parse_time(end)
+        if isinstance(slot, dict) and slot.get("start") and slot.get("end"):
+            return _parse_time(slot["start"]), _parse_time(slot["end"])
+    except ValueError:
+        pass
+    return None
+
+
+def _weekday_index(key: str) -> Optional[int]:
+    key = str(key).strip().lower()
+    for index, name in enumerate(WEEKDAYS):
+        if key == name or key == name[:3]:
+            return index
+    return None
+
+
+def weekly_slots(schedule: Optional[dict]) -> List[Tuple[int, time, time]]:
+    """Flatten a schedule into (weekday, start, end) tuples, ignoring entries it cannot parse"""
+    slots = []
+    for key, value in (schedule or {}).items():
+        weekday = _weekday_index(key)
+        if weekday is None:
+            continue
+        for slot in value if isinstance(value, list) else [value]:
+            parsed = _parse_slot(slot)
+            if parsed and parsed[1] > parsed[0]:
+                slots.append((weekday, parsed[0], parsed[1]))
+    return slots
+
+
+def windows_between(schedule: Optional[dict], start: datetime, end: datetime) -> List[Window]:
+    """Scheduled sessions (naive UTC start, end) that start within [start, end)"""
+    tz = ZoneInfo(settings.schedule_timezone)
+    slots = weekly_slots(schedule)
+    if not slots:
+        return []
+    local_day = start.replace(tzinfo=timezone.utc).astimezone(tz).date() - timedelta(days=1)
+    last_day = end.replace(tzinfo=timezone.utc).astimezone(tz).date()
+    windows = []
+    while local_day <= last_day:
+        for weekday, slot_start, slot_end in slots:
+            if local_day.weekday() != weekday:
+                continue
+            window_start = datetime.combine(local_day, slot_start, tz).astimezone(timezone.utc).replace(tzinfo=None)
+            window_end = datetime.combine(local_day, slot_end, tz).astimezone(timezone.utc).replace(tzinfo=None)
+            if start <= window_start < end:
+                windows.append((window_start, window_end))
+        local_day += timedelta(days=1)
+    return sorted(windows)
+
+
+def current_window(schedule: Optional[dict], now: Optional[datetime] = None, open_before: timedelta = timedelta(0)) -> Optional[Window]:
+    """The scheduled session in progress at ``now`` (opening ``open_before`` early), if any"""
+    now = now or datetime.utcnow()
+    for window_start, window_end in windows_between(schedule, now - timedelta(days=1), now + open_before + timedelta(seconds=1)):
+        if window_start - open_before <= now <= window_end:
+            return window_start, window_end
+    return None
+
+
+def session_key(class_id: str, window_start: datetime) -> str:
+    """Identifier shared by every attendance write for one scheduled session"""
+    return f"{class_id}:{window_start.strftime('%Y%m%dT%H%M')}"
+
+
+def current_session_key(cls: dict, now: Optional[datetime] = None) -> Optional[str]:
+    """Session key of the class's scheduled session in progress, or None outside the schedule"""
+    window = current_window(cls.get("schedule"), now, timedelta(minutes=settings.session_open_before_minutes))
+    return session_key(str(cls["_id"]), window[0]) if window else None
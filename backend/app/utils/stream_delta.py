@@ -0,0 +1,117 @@
+from typing import Dict, List, Set
+
+
+def _iou(a: dict, b: dict) -> float:
+    ax2, ay2 = a["x"] + a["width"], a["y"] + a["height"]
+    bx2, by2 = b["x"] + b["width"], b["y"] + b["height"]
+    inter_w = min(ax2, bx2) - max(a["x"], b["x"])
+    inter_h = min(ay2, by2) - max(a["y"], b["y"])
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    union = a["width"] * a["height"] + b["width"] * b["height"] - inter
+    return inter / union if union > 0 else 0.0
+
+
+class StreamDeltaEncoder:
+    """Encodes per-frame recognition results as deltas against the previous frame.
+
+    Face detections are associated across frames by box overlap and given a
+    stable ``track_id``. Keyframes carry the full state (all tracks plus every
+    student recognized so far in the stream) and are sent on the first frame,
+    every ``keyframe_interval`` frames and whenever the client asks for one.
+    """
+
+    def __init__(self, keyframe_interval: int = 30, match_iou: float = 0.3, move_threshold: int = 4):
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.match_iou = match_iou
+        self.move_threshold = move_threshold
+        self.tracks: Dict[int, dict] = {}
+        self.recognized: Set[str] = set()
+        self.next_track_id = 1
+        self.seq = 0
+        self.frames_since_keyframe = 0
+        self.keyframe_requested = True
+
+    def request_keyframe(self):
+        self.keyframe_requested = True
+
+    def _has_moved(self, old: dict, new: dict) -> bool:
+        if old["student_id"] != new["student_id"] or old["recognized"] != new["recognized"]:
+            return True
+        return any(abs(old[k] - new[k]) > self.move_threshold for k in ("x", "y", "width", "height"))
+
+    def _update_tracks(self, face_detections: List[dict]):
+        """Match detections to existing tracks and return (added, moved, removed)"""
+        candidates = []
+        for det_index, det in enumerate(face_detections):
+            for track_id, track in self.tracks.items():
+                overlap = _iou(track, det)
+                if overlap >= self.match_iou:
+                    candidates.append((overlap, det_index, track_id))
+        candidates.sort(reverse=True)
+
+        assigned: Dict[int, int] = {}
+        used_tracks: Set[int] = set()
+        for _, det_index, track_id in candidates:
+            if det_index in assigned or track_id in used_tracks:
+                continue
+            assigned[det_index] = track_id
+            used_tracks.add(track_id)
+
+        added, moved = [], []
+        new_tracks: Dict[int, dict] = {}
+        for det_index, det in enumerate(face_detections):
+            track_id = assigned.get(det_index)
+            if track_id is None:
+                track_id = self.next_track_id
+                self.next_track_id += 1
+                track = dict(det, track_id=track_id)
+                added.append(track)
+            else:
+                track = dict(det, track_id=track_id)
+                if self._has_moved(self.tracks[track_id], track):
+                    moved.append(track)
+                else:
+                    # Keep the previously sent box so small jitter does not accumulate
+                    track = self.tracks[track_id]
+            new_tracks[track_id] = track
+
+        removed = [track_id for track_id in self.tracks if track_id not in new_tracks]
+        self.tracks = new_tracks
+        return added, moved, removed
+
+    def encode(self, recognized_ids: List[str], total_detected: int, total_recognized: int, face_detections: List[dict]) -> dict:
+        self.seq += 1
+        new_students = [sid for sid in dict.fromkeys(recognized_ids) if sid not in self.recognized]
+        self.recognized.update(new_students)
+        added, moved, removed = self._update_tracks(face_detections)
+
+        self.frames_since_keyframe += 1
+        if self.keyframe_requested or self.frames_since_keyframe >= self.keyframe_interval:
+            self.keyframe_requested = False
+            self.frames_since_keyframe = 0
+            return {
+                "type": "keyframe",
+                "seq": self.seq,
+                "recognized_students": sorted(self.recognized),
+                "total_faces_detected": total_detected,
+                "total_faces_recognized": total_recognized,
+                "face_detections": list(self.tracks.values())
+            }
+
+        response = {
+            "type": "delta",
+            "seq": self.seq,
+            "total_faces_detected": total_detected,
+            "total_faces_recognized": total_recognized
+        }
+        if new_students:
+            response["new_students"] = new_students
+        if added:
+            response["tracks_added"] = added
+        if moved:
+            response["tracks_moved"] = moved
+        if removed:
+            response["tracks_removed"] = removed
+        return response
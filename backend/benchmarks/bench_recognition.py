@@ -0,0 +1,232 @@
+"""Micro-benchmarks for FaceRecognitionService.
+
+Measures, for every encoder profile:
+
+- detection and encoding time per frame, for 1-50 faces per frame
+- matching time per face against galleries of 30, 300 and 3,000 students,
+  both with the per-student loop (``match_face``) and the stacked
+  ``GalleryIndex``
+- end-to-end ``recognize_faces_in_frame`` latency with the per-stage split
+
+Frames are either synthetic (a face photo tiled N times on a canvas, so the
+face count is exact) or recorded JPEG/PNG frames from a directory. Gallery
+encodings are random vectors with the spread of real dlib encodings; the
+matching cost depends only on their count.
+
+Run from the backend directory::
+
+    python -m benchmarks.bench_recognition --face-image face.jpg --output results.json
+    python -m benchmarks.bench_recognition --frames-dir recorded/ --compare results.json
+
+Results are JSON (one record per profile/stage/faces/gallery size) so runs
+on different commits can be diffed with ``--compare``.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import cv2
+import face_recognition
+import numpy as np
+
+from app.services.encoder_profiles import ENCODER_PROFILES, encoder_registry
+from app.services.face_recognition import face_recognition_service
+from app.services.gallery_cache import GalleryIndex
+from benchmarks.frames import noise_frame, recorded_frame_paths, synthetic_frame
+
+DEFAULT_GALLERY_SIZES = [30, 300, 3000]
+DEFAULT_FACE_COUNTS = [1, 5, 10, 25, 50]
+
+
+def _summary(samples_ms: List[float], items_per_run: int = 1) -> dict:
+    samples = np.asarray(samples_ms)
+    mean = float(samples.mean())
+    return {
+        "runs": len(samples_ms),
+        "mean_ms": round(mean, 4),
+        "p50_ms": round(float(np.percentile(samples, 50)), 4),
+        "p90_ms": round(float(np.percentile(samples, 90)), 4),
+        "p99_ms": round(float(np.percentile(samples, 99)), 4),
+        "min_ms": round(float(samples.min()), 4),
+        "throughput_per_s": round(1000.0 * items_per_run / mean, 2) if mean > 0 else None
+    }
+
+
+def _time(fn: Callable[[], object], repeat: int, warmup: int = 1) -> List[float]:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def random_gallery(students: int, per_student: int, rng: np.random.Generator) -> Dict[str, List[np.ndarray]]:
+    # dlib encodings have unit-ish norm with components around +-0.1
+    return {
+        f"S{i:05d}": [rng.normal(0, 0.09, 128) for _ in range(per_student)]
+        for i in range(students)
+    }
+
+
+def load_frames(args, rng) -> List[dict]:
+    frames = []
+    if args.frames_dir:
+        for path in recorded_frame_paths(args.frames_dir, args.max_recorded_frames):
+            frame = cv2.imread(path)
+            if frame is not None:
+                frames.append({"source": "recorded", "name": os.path.basename(path), "faces": None, "frame": frame})
+    if args.face_image:
+        face = cv2.imread(args.face_image)
+        if face is None:
+            sys.exit(f"Could not read face image {args.face_image}")
+        for count in args.faces:
+            frames.append({"source": "synthetic", "name": f"tiled_{count}", "faces": count, "frame": synthetic_frame(face, count)})
+    if not frames:
+        # Without a face photo, detection still gets measured on a face-free frame
+        frames.append({"source": "synthetic", "name": "noise_720p", "faces": 0, "frame": noise_frame(rng)})
+    return frames
+
+
+def bench_frames(profile_name: str, frames: List[dict], gallery: Dict[str, List[np.ndarray]], repeat: int) -> List[dict]:
+    profile = encoder_registry.profile(profile_name)
+    index = GalleryIndex(gallery)
+    results = []
+    for item in frames:
+        frame = item["frame"]
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        locations = face_recognition.face_locations(rgb, model=profile["detection_model"])
+        base = {
+            "profile": profile_name,
+            "frame": item["name"],
+            "source": item["source"],
+            "resolution": f"{frame.shape[1]}x{frame.shape[0]}",
+            "faces_expected": item["faces"],
+            "faces": len(locations),
+            "gallery_size": len(gallery)
+        }
+
+        detect = _time(lambda: face_recognition.face_locations(rgb, model=profile["detection_model"]), repeat)
+        results.append({**base, "stage": "detect", **_summary(detect)})
+        if locations:
+            encode = _time(lambda: face_recognition.face_encodings(rgb, locations, model=profile["encoding_model"]), repeat)
+            results.append({**base, "stage": "encode", **_summary(encode, len(locations))})
+
+        stages: Dict[str, List[float]] = {}
+
+        def end_to_end():
+            timings: Dict[str, float] = {}
+            face_recognition_service.recognize_faces_in_frame(frame, gallery, profile_name, index, timings)
+            for stage, ms in timings.items():
+                stages.setdefault(stage, []).append(ms)
+
+        total = _time(end_to_end, repeat)
+        results.append({
+            **base,
+            "stage": "end_to_end",
+            **_summary(total),
+            "stages_mean_ms": {stage: round(float(np.mean(ms)), 4) for stage, ms in stages.items()}
+        })
+    return results
+
+
+def bench_matching(gallery_sizes: List[int], per_student: int, repeat: int, rng) -> List[dict]:
+    results = []
+    probes = [rng.normal(0, 0.09, 128) for _ in range(50)]
+    for size in gallery_sizes:
+        gallery = random_gallery(size, per_student, rng)
+        index = GalleryIndex(gallery)
+        base = {"stage": "match", "gallery_size": size, "encodings": len(index), "faces": len(probes)}
+        loop_ms = _time(lambda: [face_recognition_service.match_face(p, gallery) for p in probes], repeat)
+        results.append({**base, "method": "per_student_loop", **_summary(loop_ms, len(probes))})
+        index_ms = _time(lambda: [index.match(p) for p in probes], repeat)
+        results.append({**base, "method": "gallery_index", **_summary(index_ms, len(probes))})
+        build_ms = _time(lambda: GalleryIndex(gallery), max(3, repeat // 5))
+        results.append({**base, "stage": "index_build", "faces": None, **_summary(build_ms)})
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _key(record: dict) -> tuple:
+    return tuple(record.get(k) for k in ("profile", "stage", "method", "frame", "gallery_size", "faces"))
+
+
+def compare(results: List[dict], baseline_path: str):
+    """Print the p50 change per case; on stderr, so stdout stays a valid JSON report"""
+    with open(baseline_path) as f:
+        baseline = {_key(r): r for r in json.load(f)["results"]}
+    print(f"{'stage':<12} {'profile':<8} {'case':<28} {'base p50':>10} {'new p50':>10} {'change':>8}", file=sys.stderr)
+    for record in results:
+        old = baseline.get(_key(record))
+        if not old or not old.get("p50_ms"):
+            continue
+        change = (record["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100
+        case = record.get("frame") or f"{record.get('method') or ''} g={record.get('gallery_size')}"
+        print(f"{record['stage']:<12} {record.get('profile') or '-':<8} {case:<28} {old['p50_ms']:>10.3f} {record['p50_ms']:>10.3f} {change:>+7.1f}%", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--face-image", help="photo of one face, tiled into synthetic frames")
+    parser.add_argument("--frames-dir", help="directory of recorded classroom frames (.jpg/.png)")
+    parser.add_argument("--max-recorded-frames", type=int, default=20)
+    parser.add_argument("--faces", type=lambda s: [int(x) for x in s.split(",")], default=DEFAULT_FACE_COUNTS)
+    parser.add_argument("--gallery-sizes", type=lambda s: [int(x) for x in s.split(",")], default=DEFAULT_GALLERY_SIZES)
+    parser.add_argument("--encodings-per-student", type=int, default=5)
+    parser.add_argument("--profiles", type=lambda s: s.split(","), default=list(ENCODER_PROFILES))
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write JSON results here (default: stdout)")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run to diff p50 against")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    cv2.setNumThreads(1)
+    frames = load_frames(args, rng)
+
+    results = bench_matching(args.gallery_sizes, args.encodings_per_student, args.repeat, rng)
+    # Frame benchmarks use the middle gallery size; matching cost is covered above
+    frame_gallery = random_gallery(args.gallery_sizes[len(args.gallery_sizes) // 2], args.encodings_per_student, rng)
+    for profile_name in args.profiles:
+        results.extend(bench_frames(profile_name, frames, frame_gallery, args.repeat))
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare")}
+        },
+        "results": results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
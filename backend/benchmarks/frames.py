@@ -0,0 +1,31 @@
+"""Test frames shared by the benchmarks (OpenCV and NumPy only)"""
+import glob
+import math
+import os
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+FACE_CELL = 160
+
+
+def synthetic_frame(face_bgr: np.ndarray, faces: int) -> np.ndarray:
+    """Tile one face photo ``faces`` times on a grey canvas"""
+    columns = math.ceil(math.sqrt(faces))
+    rows = math.ceil(faces / columns)
+    cell = cv2.resize(face_bgr, (FACE_CELL - 20, FACE_CELL - 20))
+    canvas = np.full((rows * FACE_CELL, columns * FACE_CELL, 3), 128, dtype=np.uint8)
+    for i in range(faces):
+        top, left = (i // columns) * FACE_CELL + 10, (i % columns) * FACE_CELL + 10
+        canvas[top:top + cell.shape[0], left:left + cell.shape[1]] = cell
+    return canvas
+
+
+def recorded_frame_paths(frames_dir: str, limit: Optional[int] = None) -> List[str]:
+    paths = sorted(glob.glob(os.path.join(frames_dir, "*.jpg")) + glob.glob(os.path.join(frames_dir, "*.png")))
+    return paths[:limit] if limit else paths
+
+
+def noise_frame(rng: np.random.Generator, width: int = 1280, height: int = 720) -> np.ndarray:
+    return rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
@@ -0,0 +1,432 @@
+"""Load generator for the auto-attendance stream and notification sockets.
+
+Opens ``--sessions`` concurrent ``/api/faculty/attendance/auto/stream/{class_id}``
+sessions (spread over the given classes, one camera id each) and replays
+JPEG frames into every one of them at ``--fps``, while holding
+``--notification-sockets`` faculty/student notification sockets open and
+pinging them.
+
+The stream answers frames in order, one reply per decoded frame, so a
+reply's latency is measured against the oldest unanswered frame. Each
+session keeps at most ``--max-in-flight`` frames unanswered; a frame due
+while the session is at that limit is skipped, like a camera dropping
+frames it cannot upload, and counted as ``skipped``. Frames unanswered
+after ``--frame-timeout`` are counted as ``lost``.
+
+Server CPU comes from psutil when the server runs on this host
+(``--server-pid``, worker processes included), and the server-side stage
+histograms and load average from ``/api/admin/metrics/recognition`` when an
+admin login is given. Both are optional.
+
+Run from the backend directory::
+
+    python -m benchmarks.load_stream --class-id <id> --sessions 20 --fps 5 --duration 60 \\
+        --face-image face.jpg --faces 30 --faculty faculty@example.com:secret \\
+        --student student@example.com:secret --notification-sockets 200 \\
+        --admin admin@example.com:secret --server-pid 1234 --output load.json
+
+``--faculty``/``--student``/``--admin`` take either ``email:password`` or an
+access token. Sessions are stopped with the normal ``stop`` action, so the
+attendance they accumulate is discarded, not committed.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import sys
+import time
+import urllib.parse
+import urllib.request
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from benchmarks.frames import noise_frame, recorded_frame_paths, synthetic_frame
+
+try:
+    import websockets
+except ImportError:  # pragma: no cover - installed with uvicorn[standard]
+    websockets = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def _percentiles(samples: List[float]) -> dict:
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples)
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p90_ms": round(float(np.percentile(values, 90)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3)
+    }
+
+
+def _ws_url(base_url: str, path: str, **params) -> str:
+    parsed = urllib.parse.urlparse(base_url)
+    scheme = "wss" if parsed.scheme == "https" else "ws"
+    query = urllib.parse.urlencode({k: v for k, v in params.items() if v is not None})
+    return f"{scheme}://{parsed.netloc}{path}" + (f"?{query}" if query else "")
+
+
+def _http_json(base_url: str, path: str, token: Optional[str] = None, body: Optional[dict] = None) -> dict:
+    request = urllib.request.Request(base_url.rstrip("/") + path)
+    if token:
+        request.add_header("Authorization", f"Bearer {token}")
+    data = None
+    if body is not None:
+        data = json.dumps(body).encode()
+        request.add_header("Content-Type", "application/json")
+    with urllib.request.urlopen(request, data=data, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def resolve_token(base_url: str, credential: Optional[str]) -> Optional[str]:
+    """Log in for ``email:password``; anything else is taken as a token"""
+    if not credential or ":" not in credential:
+        return credential
+    email, password = credential.split(":", 1)
+    return _http_json(base_url, "/api/auth/login", body={"email": email, "password": password})["access_token"]
+
+
+def load_payloads(args, rng: np.random.Generator) -> List[str]:
+    """Frames as the browser sends them: JSON with a base64 JPEG"""
+    frames = []
+    if args.frames_dir:
+        frames = [frame for frame in map(cv2.imread, recorded_frame_paths(args.frames_dir, args.max_recorded_frames)) if frame is not None]
+    elif args.face_image:
+        face = cv2.imread(args.face_image)
+        if face is None:
+            sys.exit(f"Could not read face image {args.face_image}")
+        frames = [synthetic_frame(face, args.faces)]
+    if not frames:
+        frames = [noise_frame(rng) for _ in range(4)]
+
+    payloads = []
+    for frame in frames:
+        ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, args.jpeg_quality])
+        if ok:
+            payloads.append(json.dumps({"image": base64.b64encode(buffer).decode("utf-8")}))
+    return payloads
+
+
+class StreamSession:
+    def __init__(self, index: int, url: str, payloads: List[str], args):
+        self.index = index
+        self.url = url
+        self.payloads = payloads
+        self.fps = args.fps
+        self.max_in_flight = max(1, args.max_in_flight)
+        self.frame_timeout = args.frame_timeout
+        self.in_flight: deque = deque()
+        self.latencies: List[float] = []
+        self.server_totals: List[float] = []
+        self.sent = self.skipped = self.lost = self.replies = 0
+        self.faces_detected = self.faces_recognized = 0
+        self.duration = 0.0
+        self.error: Optional[str] = None
+        self.summary: Optional[dict] = None
+
+    def _expire(self, now: float):
+        while self.in_flight and now - self.in_flight[0] > self.frame_timeout:
+            self.in_flight.popleft()
+            self.lost += 1
+
+    async def _receive(self, ws):
+        async for message in ws:
+            now = time.perf_counter()
+            reply = json.loads(message)
+            if reply.get("status") == "stopped":
+                self.summary = reply
+                return
+            self.replies += 1
+            self._expire(now)
+            if self.in_flight:
+                self.latencies.append((now - self.in_flight.popleft()) * 1000)
+            self.faces_detected += reply.get("total_faces_detected", 0) or 0
+            self.faces_recognized += reply.get("total_faces_recognized", 0) or 0
+            if reply.get("timings"):
+                # Echoed before the reply is sent, so this is server time up to the send
+                self.server_totals.append(sum(reply["timings"].values()))
+
+    async def run(self, start_delay: float, duration: float):
+        self.duration = duration
+        await asyncio.sleep(start_delay)
+        try:
+            async with websockets.connect(self.url, max_size=None, open_timeout=30) as ws:
+                receiver = asyncio.ensure_future(self._receive(ws))
+                interval = 1.0 / self.fps
+                deadline = time.perf_counter() + duration
+                next_at = time.perf_counter()
+                frame = 0
+                while time.perf_counter() < deadline and not receiver.done():
+                    now = time.perf_counter()
+                    self._expire(now)
+                    if len(self.in_flight) >= self.max_in_flight:
+                        self.skipped += 1
+                    else:
+                        self.in_flight.append(now)
+                        await ws.send(self.payloads[frame % len(self.payloads)])
+                        self.sent += 1
+                    frame += 1
+                    next_at += interval
+                    await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+                await ws.send(json.dumps({"action": "stop"}))
+                try:
+                    await asyncio.wait_for(receiver, timeout=self.frame_timeout)
+                except asyncio.TimeoutError:
+                    receiver.cancel()
+                self.lost += len(self.in_flight)
+                self.in_flight.clear()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+
+    def report(self) -> dict:
+        attempted = self.sent + self.skipped
+        return {
+            "session": self.index,
+            "url": self.url,
+            "error": self.error,
+            "frames_attempted": attempted,
+            "frames_sent": self.sent,
+            "replies": self.replies,
+            "skipped": self.skipped,
+            "lost": self.lost,
+            "drop_rate": round((self.skipped + self.lost) / attempted, 4) if attempted else None,
+            "achieved_fps": round(self.replies / self.duration, 2) if self.duration else None,
+            "faces_detected": self.faces_detected,
+            "faces_recognized": self.faces_recognized,
+            "latency": _percentiles(self.latencies),
+            "server_processing": _percentiles(self.server_totals),
+            "server_stages": (self.summary or {}).get("timings")
+        }
+
+
+class NotificationSocket:
+    def __init__(self, url: str, ping_interval: float):
+        self.url = url
+        self.ping_interval = ping_interval
+        self.rtts: List[float] = []
+        self.notifications = 0
+        self.error: Optional[str] = None
+
+    async def run(self, start_delay: float, duration: float):
+        await asyncio.sleep(start_delay)
+        try:
+            async with websockets.connect(self.url, open_timeout=30) as ws:
+                deadline = time.perf_counter() + duration
+                while time.perf_counter() < deadline:
+                    sent_at = time.perf_counter()
+                    await ws.send("ping")
+                    while True:
+                        message = await asyncio.wait_for(ws.recv(), timeout=30)
+                        if message == "pong":
+                            self.rtts.append((time.perf_counter() - sent_at) * 1000)
+                            break
+                        self.notifications += 1
+                    await asyncio.sleep(self.ping_interval)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+
+
+class CpuSampler:
+    """Samples CPU of the server process and its children (workers) once a second"""
+
+    def __init__(self, pid: int):
+        self.process = psutil.Process(pid)
+        self.samples: List[float] = []
+        self._known: Dict[int, "psutil.Process"] = {}
+
+    def _tree(self):
+        processes = [self.process] + self.process.children(recursive=True)
+        for process in processes:
+            if process.pid not in self._known:
+                process.cpu_percent(None)
+                self._known[process.pid] = process
+        return [self._known[p.pid] for p in processes]
+
+    async def run(self, duration: float):
+        self._tree()
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(1.0)
+            total = 0.0
+            for process in self._tree():
+                try:
+                    total += process.cpu_percent(None)
+                except psutil.NoSuchProcess:
+                    self._known.pop(process.pid, None)
+            self.samples.append(total)
+
+    def report(self) -> dict:
+        if not self.samples:
+            return {}
+        values = np.asarray(self.samples)
+        return {
+            "cpu_percent_mean": round(float(values.mean()), 1),
+            "cpu_percent_max": round(float(values.max()), 1),
+            "cpu_count": psutil.cpu_count(),
+            "samples": len(self.samples)
+        }
+
+
+def print_report(report: dict):
+    total = report["totals"]
+    print(f"{'session':>7} {'sent':>6} {'replies':>7} {'skip':>5} {'lost':>5} {'drop':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8}  error")
+    for s in report["sessions"]:
+        latency = s["latency"]
+        drop = f"{s['drop_rate'] * 100:.1f}%" if s["drop_rate"] is not None else "-"
+        print(f"{s['session']:>7} {s['frames_sent']:>6} {s['replies']:>7} {s['skipped']:>5} {s['lost']:>5} {drop:>6} "
+              f"{latency.get('p50_ms', '-'):>8} {latency.get('p90_ms', '-'):>8} {latency.get('p99_ms', '-'):>8}  {s['error'] or ''}")
+    latency = total["latency"]
+    print(f"\nall sessions: {total['replies']} replies, {total['replies_per_second']}/s, drop rate {total['drop_rate']}, "
+          f"p50 {latency.get('p50_ms')} ms, p99 {latency.get('p99_ms')} ms")
+    notifications = report["notifications"]
+    if notifications["sockets"]:
+        print(f"notification sockets: {notifications['connected']}/{notifications['sockets']} held, "
+              f"ping p50 {notifications['ping'].get('p50_ms')} ms, p99 {notifications['ping'].get('p99_ms')} ms")
+    if report.get("server_cpu"):
+        cpu = report["server_cpu"]
+        print(f"server cpu: mean {cpu['cpu_percent_mean']}%, max {cpu['cpu_percent_max']}% of {cpu['cpu_count']} cores")
+
+
+async def run(args) -> dict:
+    rng = np.random.default_rng(args.seed)
+    payloads = load_payloads(args, rng)
+    faculty_token = resolve_token(args.url, args.faculty)
+    student_token = resolve_token(args.url, args.student)
+    admin_token = resolve_token(args.url, args.admin)
+
+    if admin_token:
+        _http_json(args.url, "/api/admin/metrics/recognition?reset=true", admin_token)
+
+    sessions = []
+    for i in range(args.sessions):
+        class_id = args.class_id[i % len(args.class_id)]
+        url = _ws_url(
+            args.url, f"/api/faculty/attendance/auto/stream/{class_id}",
+            camera_id=f"load-{i}", mode=args.mode, timings="true",
+            delta="true" if args.delta else None
+        )
+        sessions.append(StreamSession(i, url, payloads, args))
+
+    sockets = []
+    for i in range(args.notification_sockets):
+        use_student = student_token and (i % 2 or not faculty_token)
+        token = student_token if use_student else faculty_token
+        if not token:
+            break
+        path = "/api/student/notifications/ws" if use_student else "/api/faculty/notifications/ws"
+        sockets.append(NotificationSocket(_ws_url(args.url, path, token=token), args.ping_interval))
+
+    sampler = None
+    if args.server_pid:
+        if psutil is None:
+            print("psutil is not installed; server CPU is not sampled", file=sys.stderr)
+        else:
+            sampler = CpuSampler(args.server_pid)
+
+    ramp = args.ramp_up / max(1, len(sessions))
+    started = time.perf_counter()
+    tasks = [s.run(i * ramp, args.duration) for i, s in enumerate(sessions)]
+    # Notification sockets connect first and stay up for the whole run
+    tasks += [s.run(0.0, args.duration + args.ramp_up) for s in sockets]
+    if sampler:
+        tasks.append(sampler.run(args.duration + args.ramp_up))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    session_reports = [s.report() for s in sessions]
+    attempted = sum(s["frames_attempted"] for s in session_reports)
+    dropped = sum(s["skipped"] + s["lost"] for s in session_reports)
+    replies = sum(s["replies"] for s in session_reports)
+
+    server_metrics = None
+    if admin_token:
+        server_metrics = _http_json(args.url, "/api/admin/metrics/recognition", admin_token)
+
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "client": platform.node(),
+            "client_cpu_count": os.cpu_count(),
+            "frame_bytes": [len(p) for p in payloads],
+            "args": {k: v for k, v in vars(args).items() if k not in ("faculty", "student", "admin", "output")}
+        },
+        "totals": {
+            "sessions": len(sessions),
+            "sessions_failed": sum(1 for s in sessions if s.error),
+            "elapsed_seconds": round(elapsed, 2),
+            "frames_attempted": attempted,
+            "replies": replies,
+            "replies_per_second": round(replies / args.duration, 2),
+            "drop_rate": round(dropped / attempted, 4) if attempted else None,
+            "latency": _percentiles([ms for s in sessions for ms in s.latencies]),
+            "server_processing": _percentiles([ms for s in sessions for ms in s.server_totals])
+        },
+        "sessions": session_reports,
+        "notifications": {
+            "sockets": len(sockets),
+            "connected": sum(1 for s in sockets if s.rtts),
+            "errors": sorted({s.error for s in sockets if s.error}),
+            "ping": _percentiles([ms for s in sockets for ms in s.rtts]),
+            "notifications_received": sum(s.notifications for s in sockets)
+        },
+        "server_cpu": sampler.report() if sampler else None,
+        "server_metrics": server_metrics
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://localhost:8000", help="server base URL")
+    parser.add_argument("--class-id", action="append", required=True, help="class to stream into (repeat for several)")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--fps", type=float, default=5.0, help="frames per second per session")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds each session streams")
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="seconds over which sessions are started")
+    parser.add_argument("--max-in-flight", type=int, default=2, help="unanswered frames per session before skipping")
+    parser.add_argument("--frame-timeout", type=float, default=10.0)
+    parser.add_argument("--mode", choices=["auto", "qr"], default="auto")
+    parser.add_argument("--delta", action="store_true", help="request delta-encoded replies")
+    parser.add_argument("--face-image", help="photo of one face, tiled --faces times into the frame")
+    parser.add_argument("--faces", type=int, default=30)
+    parser.add_argument("--frames-dir", help="directory of recorded classroom frames (.jpg/.png)")
+    parser.add_argument("--max-recorded-frames", type=int, default=100)
+    parser.add_argument("--jpeg-quality", type=int, default=70, help="matches the web client")
+    parser.add_argument("--notification-sockets", type=int, default=0)
+    parser.add_argument("--ping-interval", type=float, default=5.0)
+    parser.add_argument("--faculty", help="faculty email:password or token, for faculty notification sockets")
+    parser.add_argument("--student", help="student email:password or token, for student notification sockets")
+    parser.add_argument("--admin", help="admin email:password or token, for server-side metrics")
+    parser.add_argument("--server-pid", type=int, help="sample this local server process's CPU (needs psutil)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args()
+
+    if websockets is None:
+        sys.exit("The websockets package is required (pip install websockets)")
+    if args.notification_sockets and not (args.faculty or args.student):
+        sys.exit("--notification-sockets needs --faculty and/or --student")
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()